@@ -1,34 +1,196 @@
+import itertools
+import numbers
+
+import numpy as np
+import openpyxl
 import pandas as pd
 
+from plate_layout import row_index
+
+# Sheets the dashboard reads from a workbook
+PLATEMAP_SHEETS = ["treatments", "celltypes"]
+MICROSCOPY_SHEETS = ["phase", "green", "red"]
+DASHBOARD_SHEETS = PLATEMAP_SHEETS + MICROSCOPY_SHEETS
+
 # Function to load all sheets from the Excel file into a dictionary
 def load_excel_tabs(platemap_path):
     # Read all sheets into a dictionary of DataFrames
     sheets_dict = pd.read_excel(platemap_path, sheet_name=None, index_col=0)
     return sheets_dict
 
-# Function to process the DataFrame
+# Function to stream only the sheets the dashboard uses, row by row, with openpyxl's read-only reader
+def load_dashboard_sheets(source, sheet_names=DASHBOARD_SHEETS):
+    workbook = openpyxl.load_workbook(source, read_only=True, data_only=True)
+    try:
+        return {
+            name: sheet_to_frame(workbook[name].iter_rows(values_only=True))
+            for name in workbook.sheetnames if name in sheet_names
+        }
+    finally:
+        workbook.close()
+
+# Function to turn streamed sheet rows into a DataFrame indexed by the first column,
+# matching pd.read_excel(..., index_col=0)
+def sheet_to_frame(rows):
+    header = next(rows, None)
+    if header is None:
+        return pd.DataFrame()
+
+    # Skip empty rows and drop the trailing blank cells read-only mode may report
+    data = [row for row in rows if any(cell is not None for cell in row)]
+    width = len(header)
+    while width > 1 and header[width - 1] is None and all(len(row) < width or row[width - 1] is None for row in data):
+        width -= 1
+
+    columns = [f"Unnamed: {i}" if label is None else label for i, label in enumerate(header[1:width], start=1)]
+    frame = pd.DataFrame(
+        [row[1:width] + (None,) * (width - len(row)) for row in data],
+        index=pd.Index([row[0] for row in data], name=header[0]),
+        columns=columns
+    )
+    # Numeric columns with empty cells come out as object, let pandas settle the dtypes
+    frame = frame.infer_objects()
+    for i, dtype in enumerate(frame.dtypes):
+        if dtype == object and frame.iloc[:, i].isna().all():
+            frame.isetitem(i, frame.iloc[:, i].astype(np.float64))
+    return frame
+
+# Function to normalize well identifiers (e.g. " c3 " -> "C3")
+def normalize_wells(wells):
+    return pd.Index(wells).astype(str).str.strip().str.upper()
+
+# Function to order annotation values that mix numbers and text (e.g. a dose of 0.5 next to "DMSO"),
+# the numbers first in numeric order and then the rest in text order
+def annotation_sort_key(value):
+    if isinstance(value, numbers.Number) and not isinstance(value, bool):
+        return (0, value)
+    return (1, str(value))
+
+# Function to process a platemap grid into one row per annotated well: the categorical well
+# identifier, its 0-based plate row and column (-1 when the label is not a plate position) and
+# the annotation as a categorical with sorted categories
 def process_platemap(df, value_name):
-    # Stack the dataframe and reset the index to make the data long-format
-    platemap = df.stack().reset_index()
+    # Normalize the row letters and column numbers of the grid once, every well combines one of each
+    row_labels = normalize_wells(df.index)
+    column_labels = normalize_wells(df.columns)
+    rows = np.array([row_index(label) if label.isalpha() else -1 for label in row_labels], dtype=np.int16)
+    columns = np.array([int(label) - 1 if label.isdigit() else -1 for label in column_labels], dtype=np.int16)
 
-    # Rename columns to match the desired structure
-    platemap.columns = ["Row", "Column", value_name]
+    # Keep the annotated cells of the grid, in row-major order
+    values = df.to_numpy(dtype=object).ravel()
+    annotated = np.flatnonzero(~pd.isna(values))
+    row_positions, column_positions = np.divmod(annotated, len(column_labels))
+    wells = row_labels[row_positions] + column_labels[column_positions]
 
-    # Generate the well names by combining row and column
-    platemap["Well"] = platemap["Row"] + platemap["Column"].astype(str)
+    platemap = pd.DataFrame({
+        "Well": pd.Categorical(wells, categories=wells.unique()),
+        "Row": rows[row_positions],
+        "Column": columns[column_positions],
+        value_name: pd.Categorical(values[annotated], categories=sorted(set(values[annotated]), key=annotation_sort_key)),
+    })
 
     # Print the unique values for the specified value_name
-    unique_values = platemap[value_name].unique()
     print(f"Available {value_name}s:")
-    print(unique_values)
+    print(platemap[value_name].cat.categories.tolist())
+    return platemap
 
-    # Drop the Row and Column columns as they are no longer needed
-    return platemap.drop(columns=["Row", "Column"])
+# Function to parse a flat array of decimal-comma strings (or mixed cells) into float64 values,
+# cells that are not numbers become NaN
+def parse_decimal_comma_cells(flat):
+    cells = pd.Series(flat, dtype=object)
+    text = cells.str.replace(",", ".", regex=False)
+    # Numbers stored in an object column (mixed sheets) have no text to fix and are kept as they are
+    if text.hasnans:
+        text = text.fillna(cells)
+    return pd.to_numeric(text, errors="coerce").to_numpy(dtype=np.float64)
+
+# Function to convert decimal-comma strings (e.g. "12,5") to floats in a single vectorized pass
+def parse_decimal_comma(df):
+    # Only object-typed columns can hold strings, numeric columns are left untouched
+    object_positions = [i for i, dtype in enumerate(df.dtypes)
+                        if dtype == object or pd.api.types.is_string_dtype(dtype)]
+    # Header-only sheets (a live export before its first scan) have nothing to parse
+    if not object_positions or not len(df):
+        return df
+
+    # Stack the object columns once and parse all their cells together
+    block = df if len(object_positions) == df.shape[1] else df.iloc[:, object_positions]
+    values = parse_decimal_comma_cells(block.to_numpy().ravel()).reshape(len(df), -1)
+
+    if len(object_positions) == df.shape[1]:
+        return pd.DataFrame(values, index=df.index, columns=df.columns)
+
+    # Shallow copy so the numeric columns share memory with the input frame
+    parsed = df.copy(deep=False)
+    for j, i in enumerate(object_positions):
+        parsed.isetitem(i, values[:, j])
+    return parsed
 
 def process_microscopy_data(df):
     df.index.name = "Time"
-    df = df.map(lambda x: float(x.replace(',', '.')) if isinstance(x, str) else x)
-    return df
+    return parse_decimal_comma(df)
+
+# Function to find the header line of a per-channel CSV export (Incucyte writes a few metadata lines
+# before it). Returns the column labels, the delimiter and the byte offset of the first data row,
+# or None while the header has not been written completely.
+def read_csv_export_header(path):
+    offset = 0
+    with open(path, "rb") as f:
+        for line in f:
+            offset += len(line)
+            if not line.endswith(b"\n"):
+                return None
+            text = line.decode("utf-8-sig").rstrip("\r\n")
+            if "Elapsed" in text:
+                delimiter = max(("\t", ";", ","), key=text.count)
+                return [label.strip() for label in text.split(delimiter)], delimiter, offset
+    return None
+
+# Function to read the rows appended to a per-channel CSV export since the byte offset, up to the last
+# complete line (the imager may be writing the next one). Returns the rows indexed by their elapsed
+# time, like a microscopy sheet, and the offset to resume from.
+def read_csv_export_rows(path, columns, delimiter, offset):
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = f.read()
+    end = data.rfind(b"\n") + 1
+    data = data[:end]
+
+    # A few rows of hundreds of wells: split the lines here and parse every cell in one vectorized
+    # pass, per-column parsing would dominate. The date column is not needed.
+    elapsed = columns.index("Elapsed")
+    keep = [elapsed] + [i for i, column in enumerate(columns)
+                        if column and i != elapsed and not column.lower().startswith("date")]
+    width = len(columns)
+    lines = [line.split(delimiter) for line in data.decode("utf-8").splitlines() if line.strip()]
+    values = np.empty((0, len(keep)))
+    if lines:
+        cells = np.array([line[:width] + [""] * (width - len(line)) for line in lines], dtype=object)
+        values = parse_decimal_comma_cells(cells[:, keep].ravel()).reshape(len(lines), -1)
+    values = values[~np.isnan(values[:, 0])]
+    # One float block indexed by the elapsed time, set_index would split it column by column
+    frame = pd.DataFrame(values[:, 1:], index=pd.Index(values[:, 0], name="Elapsed"),
+                         columns=[columns[i] for i in keep[1:]])
+    return frame, offset + end
+
+# Function to stream the rows added to the microscopy sheets of a workbook since the last read.
+# rows_read maps each sheet to the number of data rows already read; the zipped XML is still scanned
+# from the start, but only the new rows are turned into frames. Returns the header and new rows of
+# every sheet.
+def read_appended_sheet_rows(source, rows_read, sheet_names=MICROSCOPY_SHEETS):
+    workbook = openpyxl.load_workbook(source, read_only=True, data_only=True)
+    try:
+        appended = {}
+        for name in workbook.sheetnames:
+            if name not in sheet_names:
+                continue
+            rows = workbook[name].iter_rows(values_only=True)
+            header = next(rows, None)
+            new_rows = list(itertools.islice(rows, rows_read.get(name, 0), None))
+            appended[name] = (header, len(new_rows), sheet_to_frame(iter([header] + new_rows)) if header else None)
+        return appended
+    finally:
+        workbook.close()
 
 
 
@@ -0,0 +1,113 @@
+import numpy as np
+
+from advanced_data_loader import annotation_sort_key
+
+
+# Function to compute per-group statistics directly on a wide (..., well) matrix.
+# group_index holds one group id per well (-1 excludes the well). Every statistic
+# is returned with the group on the first axis, e.g. (group, time) for a
+# (time, well) input or (group, channel, time) for a (channel, time, well) cube.
+def grouped_stats(values, group_index, quantiles=False):
+    group_index = np.asarray(group_index)
+
+    # Sort the selected wells by group so each group is one contiguous slice
+    selected = np.flatnonzero(group_index >= 0)
+    selected = selected[np.argsort(group_index[selected], kind="stable")]
+    groups, starts, well_counts = np.unique(group_index[selected], return_index=True, return_counts=True)
+
+    stats = {"groups": groups}
+    if len(groups) == 0:
+        empty = np.empty((0,) + values.shape[:-1])
+        stats.update(n=empty.astype(np.int64), mean=empty, std=empty, sem=empty)
+        if quantiles:
+            stats.update(median=empty, q1=empty, q3=empty)
+        return stats
+
+    # np.take gathers the wells far faster than fancy indexing once values has more than two axes,
+    # and the float64 working copy is updated in place, batched (channel, time, well) cubes stay cheap
+    selected_values = np.take(values, selected, axis=-1)
+    x = selected_values.astype(np.float64)
+    missing = np.isnan(x)
+    x[missing] = 0.0
+
+    # Per-group counts and sums of the non-NaN values
+    n = np.add.reduceat(~missing, starts, axis=-1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.add.reduceat(x, starts, axis=-1) / n
+
+        # Second pass over the deviations keeps the variance numerically stable
+        x -= np.repeat(mean, well_counts, axis=-1)
+        x[missing] = 0.0
+        x *= x
+        sum_squares = np.add.reduceat(x, starts, axis=-1)
+        std = np.sqrt(sum_squares / (n - 1))
+        std[n < 2] = np.nan
+        sem = std / np.sqrt(n)
+
+    stats.update(
+        n=np.moveaxis(n, -1, 0),
+        mean=np.moveaxis(mean, -1, 0),
+        std=np.moveaxis(std, -1, 0),
+        sem=np.moveaxis(sem, -1, 0),
+    )
+
+    if quantiles:
+        stats.update(grouped_quantiles(selected_values, starts, well_counts))
+    return stats
+
+
+# Function to compute the NaN-aware median and interquartile range of contiguous well groups
+def grouped_quantiles(sorted_values, starts, well_counts):
+    quantiles = {"q1": [], "median": [], "q3": []}
+    for start, count in zip(starts, well_counts):
+        # Sorting pushes NaNs to the end, so each row's valid values come first
+        block = np.sort(sorted_values[..., start:start + count].astype(np.float64), axis=-1)
+        n = (~np.isnan(block)).sum(axis=-1)
+        for name, q in (("q1", 0.25), ("median", 0.5), ("q3", 0.75)):
+            # Linear interpolation between the closest ranks, as np.percentile does
+            position = np.maximum(n - 1, 0) * q
+            lower = np.floor(position).astype(np.int64)
+            upper = np.ceil(position).astype(np.int64)
+            low_value = np.take_along_axis(block, lower[..., None], axis=-1)[..., 0]
+            high_value = np.take_along_axis(block, upper[..., None], axis=-1)[..., 0]
+            value = low_value + (high_value - low_value) * (position - lower)
+            quantiles[name].append(np.where(n > 0, value, np.nan))
+    return {name: np.array(values) for name, values in quantiles.items()}
+
+
+# Function to merge grouped statistics computed on separate partitions (e.g. plates).
+# Each part maps its group keys and axis values (e.g. timepoints) to "n", "mean" and "std"
+# arrays shaped (group, axis); groups and axis values are aligned on their union.
+def merge_grouped_stats(parts):
+    keys = sorted({key for part in parts for key in part["keys"]},
+                  key=lambda key: tuple(map(annotation_sort_key, key)))
+    axis = np.unique(np.concatenate([part["axis"] for part in parts])) if parts else np.array([])
+    key_index = {key: i for i, key in enumerate(keys)}
+
+    n = np.zeros((len(keys), len(axis)))
+    total = np.zeros((len(keys), len(axis)))
+    for part in parts:
+        rows = [key_index[key] for key in part["keys"]]
+        columns = np.searchsorted(axis, part["axis"])
+        part_n = part["n"]
+        np.add.at(n, (np.array(rows)[:, None], columns[None, :]), part_n)
+        np.add.at(total, (np.array(rows)[:, None], columns[None, :]), np.where(part_n > 0, part["mean"] * part_n, 0.0))
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = total / n
+
+        # Pooled sum of squared deviations (Chan et al.): within-part plus between-part terms
+        sum_squares = np.zeros_like(mean)
+        for part in parts:
+            rows = [key_index[key] for key in part["keys"]]
+            columns = np.searchsorted(axis, part["axis"])
+            part_n = part["n"]
+            within = np.where(part_n > 1, part["std"] ** 2 * (part_n - 1), 0.0)
+            between = np.where(part_n > 0, part_n * (part["mean"] - mean[np.ix_(rows, columns)]) ** 2, 0.0)
+            np.add.at(sum_squares, (np.array(rows)[:, None], columns[None, :]), within + between)
+
+        std = np.sqrt(sum_squares / (n - 1))
+        std[n < 2] = np.nan
+        sem = std / np.sqrt(n)
+
+    return {"keys": keys, "axis": axis, "n": n, "mean": mean, "std": std, "sem": sem}
@@ -0,0 +1,94 @@
+// Resumable chunked upload of large plate exports straight to the server spool.
+// The state lives in window.bioimagingUpload and is polled by a clientside callback while active.
+(function () {
+    var CHUNK_SIZE = 8 * 1024 * 1024;
+    var STATUS_POLL_MS = 500;
+
+    window.bioimagingUpload = {version: 0};
+
+    // Whether a file is being sent, a file dialog closed meanwhile must not stop the polling
+    var sending = false;
+
+    function setState(changes) {
+        var state = Object.assign({}, window.bioimagingUpload, changes);
+        state.version = window.bioimagingUpload.version + 1;
+        window.bioimagingUpload = state;
+    }
+
+    // The same file always maps to the same id, so an interrupted upload can resume
+    function uploadId(file) {
+        var key = [file.name, file.size, file.lastModified].join("-");
+        var hash = 0;
+        for (var i = 0; i < key.length; i++) {
+            hash = (hash * 31 + key.charCodeAt(i)) | 0;
+        }
+        return "u" + (hash >>> 0).toString(16) + "-" + file.size.toString(16);
+    }
+
+    async function sendFile(file) {
+        var id = uploadId(file);
+        var url = "/upload/" + id;
+        sending = true;
+        setState({id: id, filename: file.name, received: 0, total: file.size, done: false, error: null, datasetId: null,
+                  processing: false, active: true});
+
+        try {
+            // Ask the server how much of this file it already has
+            var status = await (await fetch(url)).json();
+            // An earlier attempt that failed to parse is retried from the first chunk
+            if (status.error) {
+                status = {done: false, error: null, received: 0};
+            }
+            var offset = status.done ? file.size : (status.received || 0);
+
+            while (!status.done && !status.error && !status.processing) {
+                var chunk = file.slice(offset, Math.min(offset + CHUNK_SIZE, file.size));
+                var query = "?offset=" + offset + "&total=" + file.size + "&filename=" + encodeURIComponent(file.name);
+                var response = await fetch(url + query, {method: "POST", body: chunk});
+                status = await response.json();
+                if (!response.ok && response.status !== 409) {
+                    throw new Error(status.error || response.statusText);
+                }
+                // On 409 the server reports the offset to resume from
+                offset = status.received;
+                setState({received: offset});
+            }
+
+            // The server parses the complete file in the background, ask until it is done
+            if (status.processing) {
+                setState({received: file.size, processing: true});
+            }
+            while (status.processing) {
+                await new Promise(function (resolve) { setTimeout(resolve, STATUS_POLL_MS); });
+                status = await (await fetch(url)).json();
+            }
+            setState({received: file.size, processing: false, active: false, done: status.done, error: status.error,
+                      datasetId: status.dataset_id});
+        } catch (err) {
+            setState({processing: false, active: false, error: "Upload failed: " + err.message});
+        }
+        sending = false;
+    }
+
+    document.addEventListener("click", function (event) {
+        if (!event.target.closest("#chunked-upload-button")) {
+            return;
+        }
+        var input = document.createElement("input");
+        input.type = "file";
+        input.accept = ".xlsx";
+        input.onchange = function () {
+            if (input.files.length) {
+                sendFile(input.files[0]);
+            }
+        };
+        // The progress is polled from the click on, until the upload ends or the dialog is closed
+        input.addEventListener("cancel", function () {
+            if (!sending) {
+                setState({active: false});
+            }
+        });
+        setState({active: true});
+        input.click();
+    });
+})();
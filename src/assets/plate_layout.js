@@ -0,0 +1,71 @@
+// Client-side playback of the plate-layout frames precomputed by plate_layout.plate_frames.
+// The frames are decoded once per dataset and channel, scrubbing never calls the server.
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    plateLayout: {
+        decoded: {key: null, codes: null},
+
+        decode: function (store) {
+            if (window.dash_clientside.plateLayout.decoded.key !== store.key) {
+                var bytes = Uint8Array.from(atob(store.frames), function (c) { return c.charCodeAt(0); });
+                window.dash_clientside.plateLayout.decoded = {key: store.key, codes: new Uint16Array(bytes.buffer)};
+            }
+            return window.dash_clientside.plateLayout.decoded.codes;
+        },
+
+        renderFrame: function (frameIndex, store) {
+            if (!store) {
+                return window.dash_clientside.no_update;
+            }
+            var codes = window.dash_clientside.plateLayout.decode(store);
+            var index = Math.min(frameIndex || 0, store.times.length - 1);
+            var offset = index * store.rows * store.cols;
+
+            var z = [];
+            for (var r = 0; r < store.rows; r++) {
+                var row = [];
+                for (var c = 0; c < store.cols; c++) {
+                    var code = codes[offset + r * store.cols + c];
+                    row.push(code === store.empty ? null : store.zmin + code * store.scale);
+                }
+                z.push(row);
+            }
+
+            return {
+                data: [{
+                    type: "heatmap",
+                    z: z,
+                    x: store.col_labels,
+                    y: store.row_labels,
+                    zmin: store.zmin,
+                    zmax: store.zmin + (store.empty - 1) * store.scale,
+                    colorscale: "Viridis",
+                    xgap: 1,
+                    ygap: 1,
+                    hovertemplate: "%{y}%{x}: %{z:.3g}<extra></extra>"
+                }],
+                layout: {
+                    // Six significant digits, like the "{:g} h" labels of the server-rendered figures
+                    title: {text: "Plate Layout (" + store.channel + ") at " + parseFloat(store.times[index].toPrecision(6)) + " h"},
+                    xaxis: {side: "top", type: "category"},
+                    yaxis: {autorange: "reversed", type: "category", scaleanchor: "x"},
+                    plot_bgcolor: "white",
+                    margin: {l: 40, r: 20, t: 80, b: 20},
+                    height: 500
+                }
+            };
+        },
+
+        // Advance the time slider on each animation tick, wrapping around at the end
+        step: function (nIntervals, frameIndex, store) {
+            if (!store) {
+                return window.dash_clientside.no_update;
+            }
+            return ((frameIndex || 0) + 1) % store.times.length;
+        },
+
+        togglePlay: function (nClicks) {
+            var playing = (nClicks || 0) % 2 === 1;
+            return [!playing, playing ? "Pause" : "Play"];
+        }
+    }
+});
@@ -0,0 +1,90 @@
+import functools
+import importlib
+import os
+import uuid
+
+from cache import CACHE_DIR
+
+# Run the heavy callbacks in background worker processes (opt-in, needs dash[diskcache])
+BACKGROUND_CALLBACKS = os.environ.get("BIOIMAGING_BACKGROUND_CALLBACKS", "0") == "1"
+
+# Local diskcache directory shared by the server and its workers, no external broker needed
+BACKGROUND_CACHE_DIR = os.environ.get("BIOIMAGING_CALLBACK_CACHE_DIR", os.path.join(CACHE_DIR, "callbacks"))
+
+# Memoized callback results expire after an hour
+BACKGROUND_RESULT_EXPIRE = 3600
+
+# Disk budget of the result caches and metrics the background jobs share (2 GB), least recently
+# stored entries are culled first
+BACKGROUND_SHARED_CACHE_BYTES = int(os.environ.get("BIOIMAGING_CALLBACK_SHARED_CACHE_BYTES", str(2 * 1024 ** 3)))
+
+# Modules the jobs import on first use. The dashboard defers them to start quickly, but every job is
+# forked from the server, so the server imports them once and the jobs start with them.
+JOB_MODULES = ["datasets", "tabs", "curve_fitting", "comparisons", "heatmap", "scipy.special",
+               "scipy.cluster.hierarchy", "plotly.express"]
+
+# Results from a previous server run must not be served again
+launch_uid = uuid.uuid4().hex
+
+background_manager = None
+
+
+# Function to create the diskcache-backed manager for background callbacks
+def create_background_manager():
+    import diskcache
+    from dash import DiskcacheManager
+
+    cache = diskcache.Cache(BACKGROUND_CACHE_DIR)
+    return DiskcacheManager(cache, cache_by=[lambda: launch_uid], expire=BACKGROUND_RESULT_EXPIRE)
+
+
+# Function to keep the result caches and the callback metrics in a diskcache store. Every background
+# job runs in a new process, so what it kept in memory would be gone for the next job. The parsed
+# plates are shared separately, as memory-mapped cubes (see shared_datasets).
+def share_with_jobs():
+    import diskcache
+
+    from cache import comparison_cache, figure_cache, fit_cache, kinetics_cache, qc_cache, trace_cache
+    from instrumentation import metrics
+
+    store = diskcache.Cache(os.path.join(BACKGROUND_CACHE_DIR, "shared"), size_limit=BACKGROUND_SHARED_CACHE_BYTES)
+    for name, result_cache in (("figures", figure_cache), ("traces", trace_cache), ("kinetics", kinetics_cache),
+                               ("fits", fit_cache), ("qc", qc_cache), ("comparisons", comparison_cache)):
+        result_cache.share(store, (launch_uid, name))
+    metrics.share(store, (launch_uid, "metrics"))
+
+
+# Function to import the modules of the jobs in the server process, before any job is forked
+def preload_job_modules():
+    for name in JOB_MODULES:
+        importlib.import_module(name)
+    # Plotly imports the validators of the figure template on its first use
+    importlib.import_module("plotly.graph_objects").Figure(layout_template="simple_white")
+
+
+if BACKGROUND_CALLBACKS:
+    background_manager = create_background_manager()
+    share_with_jobs()
+
+
+# Function to build the background keyword arguments of app.callback, empty when running synchronously
+def background_options(**options):
+    if not BACKGROUND_CALLBACKS:
+        return {}
+    return {"background": True, "manager": background_manager, **options}
+
+
+# Progress reporter used when callbacks run synchronously
+def ignore_progress(progress):
+    pass
+
+
+# Decorator for callbacks that take Dash's set_progress as first argument, so they also run synchronously
+def progress_callback(func):
+    if BACKGROUND_CALLBACKS:
+        return func
+
+    @functools.wraps(func)
+    def run(*args):
+        return func(ignore_progress, *args)
+    return run
@@ -0,0 +1,616 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+
+import openpyxl
+
+from advanced_data_loader import (load_dashboard_sheets, load_excel_tabs, parse_decimal_comma, process_microscopy_data,
+                                  process_platemap)
+from aggregation import grouped_stats
+from cache import comparison_cache
+from comparisons import compare_treatments
+from figures import create_heatmap_figure, create_line_figure, create_multi_line_figures
+from kinetics import well_kinetics
+from live import LIVE_PREFIX, LiveExport, list_exports, refresh_live_dataset
+from plate_cube import PlateCube, build_plate_cube
+from plate_layout import PLATE_FORMATS, row_letters
+from sidecar import read_sidecar, write_sidecar
+from qc import cube_qc
+from rendering import line_traces, lttb_indices, use_webgl
+
+EXAMPLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Example.xlsx")
+
+# Modules that create_app() must not import, they load on the first tab update or upload
+STARTUP_DEFERRED_MODULES = ["pandas", "plotly.express", "scipy", "openpyxl", "tabs", "figures", "datasets"]
+
+# Script timed by the startup benchmark in a fresh interpreter, prints the seconds and the deferred
+# modules that were imported anyway
+STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import dashboard
+dashboard.create_app(eager={eager})
+print(json.dumps([time.perf_counter() - start, [name for name in {modules!r} if name in sys.modules]]))
+"""
+
+
+# Function to time a callable, returning the best of several runs in seconds
+def best_time(func, repeat=3):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+# Function to scale a microscopy sheet of Example.xlsx up to the requested number of wells
+def scaled_example_sheet(sheet="phase", n_wells=1536, example_path=EXAMPLE_PATH):
+    df = pd.read_excel(example_path, sheet_name=sheet, index_col=0)
+    values = np.resize(df.to_numpy(dtype=float).T, (n_wells, len(df))).T
+    return pd.DataFrame(values, index=df.index, columns=[f"W{i}" for i in range(n_wells)])
+
+
+# Function to render a numeric sheet the way decimal-comma locales export it
+def to_decimal_comma(df):
+    return df.apply(lambda column: column.map(lambda x: f"{x:.5f}".replace(".", ",")))
+
+
+# Per-cell parser that process_microscopy_data used before the vectorized version
+def legacy_decimal_comma(df):
+    return df.map(lambda x: float(x.replace(',', '.')) if isinstance(x, str) else x)
+
+
+def bench_decimal_comma(args):
+    numeric = scaled_example_sheet(n_wells=args.wells)
+    strings = to_decimal_comma(numeric)
+    print(f"Sheet: {strings.shape[0]} timepoints x {strings.shape[1]} wells")
+
+    legacy_time, legacy = best_time(lambda: legacy_decimal_comma(strings), args.repeat)
+    vectorized_time, vectorized = best_time(lambda: parse_decimal_comma(strings), args.repeat)
+    legacy_numeric_time, _ = best_time(lambda: legacy_decimal_comma(numeric), args.repeat)
+    numeric_time, untouched = best_time(lambda: parse_decimal_comma(numeric), args.repeat)
+
+    assert np.allclose(legacy.to_numpy(dtype=float), vectorized.to_numpy(dtype=float), equal_nan=True)
+    assert untouched is numeric
+
+    print(f"{'per-cell lambda (strings)':<28}{legacy_time * 1000:10.1f} ms")
+    print(f"{'vectorized (strings)':<28}{vectorized_time * 1000:10.1f} ms  ({legacy_time / vectorized_time:.1f}x)")
+    print(f"{'per-cell lambda (numeric)':<28}{legacy_numeric_time * 1000:10.1f} ms")
+    print(f"{'vectorized (numeric)':<28}{numeric_time * 1000:10.1f} ms  "
+          f"({legacy_numeric_time / numeric_time:.0f}x, no copy)")
+
+
+# Function to assign a random treatment and cell type to every well of a sheet
+def random_platemap(wells, n_treatments=12, n_celltypes=4, seed=0):
+    rng = np.random.default_rng(seed)
+    treatments = pd.DataFrame({"Well": wells, "Treatment": [f"T{i}" for i in rng.integers(n_treatments, size=len(wells))]})
+    celltypes = pd.DataFrame({"Well": wells, "CellType": [f"C{i}" for i in rng.integers(n_celltypes, size=len(wells))]})
+    return treatments, celltypes
+
+
+# Melt/merge/groupby pipeline that create_plot used before the aggregation engine
+def legacy_grouped_stats(df, treatments, celltypes, selected_treatments, selected_celltypes):
+    df = df.rename_axis("Time").reset_index().melt(id_vars=["Time"], var_name="Well", value_name="Confluence")
+    df = df.merge(treatments, on="Well", how="left").merge(celltypes, on="Well", how="left")
+    df = df.dropna(subset=["Treatment", "CellType"])
+    df = df[df["Treatment"].isin(selected_treatments) & df["CellType"].isin(selected_celltypes)]
+    return df.groupby(["Time", "Treatment", "CellType"]).agg({"Confluence": ["mean", "std"]}).reset_index()
+
+
+def bench_aggregation(args):
+    df = scaled_example_sheet(n_wells=args.wells)
+    treatments, celltypes = random_platemap(df.columns)
+    selected_treatments = sorted(treatments["Treatment"].unique())
+    selected_celltypes = sorted(celltypes["CellType"].unique())
+    print(f"Matrix: {df.shape[0]} timepoints x {df.shape[1]} wells, "
+          f"{len(selected_treatments) * len(selected_celltypes)} groups")
+
+    # Integer group codes per well, as the plate cube stores them
+    treatment_codes = pd.Categorical(treatments["Treatment"], categories=selected_treatments).codes
+    celltype_codes = pd.Categorical(celltypes["CellType"], categories=selected_celltypes).codes
+    group_index = treatment_codes * len(selected_celltypes) + celltype_codes
+    values = df.to_numpy(dtype=np.float32)
+
+    legacy_time, legacy = best_time(
+        lambda: legacy_grouped_stats(df, treatments, celltypes, selected_treatments, selected_celltypes), args.repeat)
+    engine_time, stats = best_time(lambda: grouped_stats(values, group_index), args.repeat)
+    quantile_time, _ = best_time(lambda: grouped_stats(values, group_index, quantiles=True), args.repeat)
+
+    # The engine returns (group, time), the pandas path is sorted by time first
+    legacy_mean = legacy[("Confluence", "mean")].to_numpy().reshape(len(df), -1).T
+    assert np.allclose(legacy_mean, stats["mean"], rtol=1e-5, equal_nan=True)
+
+    print(f"{'pandas melt/merge/groupby':<28}{legacy_time * 1000:10.1f} ms")
+    print(f"{'grouped_stats':<28}{engine_time * 1000:10.1f} ms  ({legacy_time / engine_time:.1f}x)")
+    print(f"{'grouped_stats + median/IQR':<28}{quantile_time * 1000:10.1f} ms")
+
+
+# Trace construction that create_plot used before the rendering module (Python list bands)
+def legacy_line_figure(time, means, stds):
+    fig = go.Figure()
+    colors = px.colors.qualitative.Set1
+    for i, (mean, std) in enumerate(zip(means, stds)):
+        color = colors[i % len(colors)]
+        mean, std = pd.Series(mean), pd.Series(std)
+        fig.add_trace(go.Scatter(x=time, y=mean, mode='lines', name=f"Group {i}", line=dict(color=color)))
+        fig.add_trace(go.Scatter(
+            x=time.tolist() + time.tolist()[::-1],
+            y=(mean + std).tolist() + (mean - std).tolist()[::-1],
+            fill='toself',
+            fillcolor=f'rgba({color[4:-1]},0.2)',
+            line=dict(color='rgba(255,255,255,0)'),
+            showlegend=False
+        ))
+    return fig
+
+
+def line_figure(time, means, stds, max_points):
+    fig = go.Figure()
+    colors = px.colors.qualitative.Set1
+    webgl = use_webgl(2 * len(means), len(time), max_points)
+    keep = lttb_indices(time, means, max_points)
+    for i, (mean, std) in enumerate(zip(means, stds)):
+        fig.add_traces(line_traces(time, mean, std, f"Group {i}", colors[i % len(colors)],
+                                   keep=keep[i], webgl=webgl))
+    return fig
+
+
+def bench_rendering(args):
+    # Smooth growth curves with noise, one per group
+    rng = np.random.default_rng(0)
+    time = np.arange(args.timepoints, dtype=np.float64) * 0.5
+    means = 100 / (1 + np.exp(-(time - time.mean()) / (time.max() / 10))) + rng.normal(0, 1, (args.groups, len(time)))
+    stds = np.abs(rng.normal(5, 1, (args.groups, len(time))))
+    print(f"{args.groups} groups x {args.timepoints} timepoints")
+
+    print(f"{'':<28}{'build':>10}{'to_json':>12}{'payload':>12}")
+    cases = [("legacy Scatter + lists", lambda: legacy_line_figure(time, means, stds))]
+    cases += [(f"max_points={n}", lambda n=n: line_figure(time, means, stds, n)) for n in args.max_points]
+    for name, build in cases:
+        build_time, fig = best_time(build, args.repeat)
+        json_time, payload = best_time(fig.to_json, args.repeat)
+        kind = "gl" if isinstance(fig.data[0], go.Scattergl) else "svg"
+        print(f"{name + ' (' + kind + ')':<28}{build_time * 1000:8.1f} ms{json_time * 1000:9.1f} ms"
+              f"{len(payload) / 1e6:9.2f} MB")
+
+
+# Function to simulate noisy logistic growth curves, one column per well
+def synthetic_growth_curves(n_timepoints, n_wells, seed=0):
+    rng = np.random.default_rng(seed)
+    time = np.arange(n_timepoints, dtype=np.float64) * 0.5
+    midpoints = rng.uniform(0.3, 0.7, n_wells) * time[-1]
+    rates = rng.uniform(0.05, 0.3, n_wells)
+    curves = 5 + 95 / (1 + np.exp(-rates * (time[:, None] - midpoints)))
+    return time, (curves + rng.normal(0, 1, curves.shape)).clip(0.1).astype(np.float32)
+
+
+def bench_kinetics(args):
+    # Every channel of the plate is reduced in the same batch
+    columns = args.wells * args.channels
+    time, values = synthetic_growth_curves(args.timepoints, columns)
+    print(f"{args.wells} wells x {args.channels} channels x {args.timepoints} timepoints")
+
+    batch_time, _ = best_time(lambda: well_kinetics(time, values), args.repeat)
+
+    # A Python loop over wells, timed on a sample and scaled up
+    sample = min(columns, 256)
+    loop_time, _ = best_time(lambda: [well_kinetics(time, values[:, [i]]) for i in range(sample)], 1)
+    loop_time *= columns / sample
+
+    print(f"{'loop per well (estimated)':<28}{loop_time * 1000:10.1f} ms")
+    print(f"{'vectorized batch':<28}{batch_time * 1000:10.1f} ms  ({loop_time / batch_time:.0f}x)")
+    print(f"{'budget':<28}{args.budget:10.1f} ms  {'OK' if batch_time * 1000 <= args.budget else 'EXCEEDED'}")
+    return batch_time * 1000 <= args.budget
+
+
+# Function to build a plate cube of synthetic growth curves with replicate groups, a few outlier
+# wells and focus dropouts, named like a real plate (A1, A2, ...)
+def synthetic_plate_cube(n_wells, n_channels, n_timepoints, n_groups=96, seed=0):
+    rng = np.random.default_rng(seed)
+    n_cols = {96: 12, 384: 24}.get(n_wells, 48)
+    wells = np.array([f"{row_letters(i // n_cols)}{i % n_cols + 1}" for i in range(n_wells)], dtype=object)
+    time, curves = synthetic_growth_curves(n_timepoints, n_wells * n_channels, seed)
+    values = curves.T.reshape(n_channels, n_wells, n_timepoints).transpose(0, 2, 1).copy()
+
+    outliers = rng.choice(n_wells, n_wells // 100, replace=False)
+    values[:, :, outliers] *= 2
+    dropouts = rng.choice(n_wells, n_wells // 100, replace=False)
+    values[:, n_timepoints // 2, dropouts] = 0.0
+
+    groups = rng.integers(n_groups, size=n_wells).astype(np.int32)
+    channels = ["phase", "green", "red"][:n_channels] + [f"channel{i}" for i in range(3, n_channels)]
+    return PlateCube(channels, time, wells, values, groups, [f"T{i}" for i in range(n_groups)],
+                     np.zeros(n_wells, dtype=np.int32), ["C0"])
+
+
+def bench_qc(args):
+    cube = synthetic_plate_cube(args.wells, args.channels, args.timepoints)
+    print(f"{args.wells} wells x {args.channels} channels x {args.timepoints} timepoints")
+
+    qc_time, result = best_time(lambda: cube_qc(cube), args.repeat)
+
+    print(f"{'flagged wells':<28}{int(result['flagged'].sum()):10d}")
+    print(f"{'cube_qc':<28}{qc_time * 1000:10.1f} ms")
+    print(f"{'budget':<28}{args.budget:10.1f} ms  {'OK' if qc_time * 1000 <= args.budget else 'EXCEEDED'}")
+    return qc_time * 1000 <= args.budget
+
+
+def bench_statistics(args):
+    from scipy import stats
+
+    cube = synthetic_plate_cube(args.wells, 1, args.timepoints, n_groups=args.treatments)
+    treatments = cube.treatment_labels
+    print(f"{args.wells} wells x {args.timepoints} timepoints, {len(treatments) - 1} treatments vs T0, {args.test}")
+
+    def compare(selected):
+        return compare_treatments("bench", cube, "phase", "T0", selected, ["C0"], args.test, "fdr_bh", 0.5)
+
+    def cold():
+        comparison_cache.clear()
+        return compare(treatments)
+
+    compare(treatments)  # computes and caches the kinetics table
+    cold_time, _ = best_time(cold, args.repeat)
+    # Deselecting a treatment re-corrects the cached comparisons without testing any of them
+    toggle_time, _ = best_time(lambda: compare(treatments[:-1]), args.repeat)
+
+    # scipy.stats called per comparison and timepoint, timed on a few comparisons and scaled up
+    values = cube.channel("phase")
+    control = values[:, cube.treatment_codes == 0]
+    test = (lambda x, y: stats.ttest_ind(x, y, equal_var=False)) if args.test == "welch" \
+        else (lambda x, y: stats.mannwhitneyu(x, y, alternative="two-sided"))
+    sample = min(len(treatments) - 1, 4)
+    loop_time, _ = best_time(lambda: [test(values[t, cube.treatment_codes == code], control[t])
+                                      for code in range(1, sample + 1) for t in range(args.timepoints)], 1)
+    loop_time *= (len(treatments) - 1) / sample
+
+    print(f"{'scipy loop (estimated)':<28}{loop_time * 1000:10.1f} ms")
+    print(f"{'vectorized, uncached':<28}{cold_time * 1000:10.1f} ms  ({loop_time / cold_time:.0f}x)")
+    print(f"{'one treatment toggled':<28}{toggle_time * 1000:10.1f} ms")
+    print(f"{'budget':<28}{args.budget:10.1f} ms  {'OK' if cold_time * 1000 <= args.budget else 'EXCEEDED'}")
+    return cold_time * 1000 <= args.budget
+
+
+# Function to write a synthetic plate workbook laid out like an Incucyte export: grid platemaps
+# and one sheet per channel with an "Elapsed" column and one column per well
+def synthetic_workbook(path, n_wells=384, n_timepoints=150, n_channels=3, decimal_comma=False,
+                       n_treatments=12, n_celltypes=4, seed=0):
+    n_rows, n_cols = next(shape for shape in PLATE_FORMATS if shape[0] * shape[1] >= n_wells)
+    rows = [row_letters(i) for i in range(n_rows)]
+    wells = [f"{rows[i // n_cols]}{i % n_cols + 1}" for i in range(n_wells)]
+    treatments, celltypes = random_platemap(wells, n_treatments, n_celltypes, seed)
+    time, values = synthetic_growth_curves(n_timepoints, n_wells * n_channels, seed)
+
+    workbook = openpyxl.Workbook(write_only=True)
+    for name, platemap, column in (("treatments", treatments, "Treatment"), ("celltypes", celltypes, "CellType")):
+        sheet = workbook.create_sheet(name)
+        grid = dict(zip(platemap["Well"], platemap[column]))
+        sheet.append([None] + list(range(1, n_cols + 1)))
+        for row in rows:
+            sheet.append([row] + [grid.get(f"{row}{col}") for col in range(1, n_cols + 1)])
+
+    for i, channel in enumerate(["phase", "green", "red"][:n_channels]):
+        sheet = workbook.create_sheet(channel)
+        sheet.append(["Elapsed"] + wells)
+        block = values[:, i * n_wells:(i + 1) * n_wells]
+        for t, row in zip(time, block):
+            cells = [f"{x:.5f}".replace(".", ",") for x in row] if decimal_comma else row.tolist()
+            sheet.append([float(t)] + cells)
+    workbook.save(path)
+    return path
+
+
+# Function to time each stage of the upload and plotting pipeline on one synthetic plate.
+# Returns the best time of each stage in seconds and the payload sizes in bytes.
+def pipeline_stages(path, repeat=3):
+    stages, sizes = {}, {}
+
+    def timed(name, func, repeats=repeat):
+        stages[name], result = best_time(func, repeats)
+        return result
+
+    sizes["workbook"] = os.path.getsize(path)
+    # The legacy pandas reader is slow, once is enough to see the gap
+    timed("load_excel_tabs", lambda: load_excel_tabs(path), 1)
+    sheets = timed("load_dashboard_sheets", lambda: load_dashboard_sheets(path))
+    treatments = timed("process_platemap", lambda: process_platemap(sheets["treatments"], "Treatment"))
+    celltypes = process_platemap(sheets["celltypes"], "Cell type")
+    sizes["platemaps"] = int(treatments.memory_usage(deep=True).sum() + celltypes.memory_usage(deep=True).sum())
+    channels = [name for name in ("phase", "green", "red") if name in sheets]
+    timed("process_microscopy_data", lambda: [process_microscopy_data(sheets[name].copy()) for name in channels])
+    cube = timed("build_plate_cube", lambda: build_plate_cube(sheets, treatments, celltypes))
+    sizes["plate_cube"] = cube.nbytes
+
+    # Upload stores only carry the dataset key, the sheets are serialized to the sidecar instead
+    with tempfile.TemporaryDirectory() as cache_dir:
+        counter = iter(range(repeat))
+        timed("write_sidecar", lambda: write_sidecar(f"bench-{next(counter)}", sheets, cache_dir))
+        timed("read_sidecar", lambda: read_sidecar("bench-0", cache_dir))
+        sizes["sidecar"] = sum(os.path.getsize(os.path.join(root, name))
+                               for root, _, names in os.walk(cache_dir) for name in names) // repeat
+
+    selected_treatments, selected_celltypes = cube.treatment_labels, cube.celltype_labels
+    group_index = cube.group_index(cube.well_mask(selected_treatments, selected_celltypes))
+    timed("grouped_stats", lambda: grouped_stats(cube.channel("phase"), group_index))
+    line = timed("line_figure", lambda: create_line_figure(cube, "phase", selected_treatments, selected_celltypes))
+    line_json = timed("line_figure_json", line.to_json)
+    sizes["line_figure_json"] = len(line_json)
+    timed("multi_plot_figures", lambda: create_multi_line_figures(cube, selected_treatments, selected_celltypes))
+    heatmap = timed("heatmap_figure",
+                    lambda: create_heatmap_figure(cube, "phase", selected_treatments, selected_celltypes))[0][1]
+    heatmap_json = timed("heatmap_figure_json", heatmap.to_json)
+    sizes["heatmap_figure_json"] = len(heatmap_json)
+    return stages, sizes
+
+
+# Function to compare a suite run with a stored baseline. Stages slower by more than the tolerance
+# (and by more than min_seconds, to ignore timer noise) and payloads larger by more than the tolerance
+# are regressions.
+def compare_with_baseline(results, baseline, tolerance, min_seconds=0.005):
+    regressions = []
+    print(f"{'plate':<8}{'stage':<26}{'baseline':>12}{'current':>12}{'change':>9}")
+    for plate, current in results["plates"].items():
+        previous = baseline.get("plates", {}).get(plate)
+        if previous is None:
+            continue
+        for kind, unit, scale in (("stages", "ms", 1000), ("sizes", "kB", 1e-3)):
+            for name, value in current[kind].items():
+                old = previous[kind].get(name)
+                if not old:
+                    continue
+                change = value / old - 1
+                regressed = change > tolerance and (kind == "sizes" or value - old > min_seconds)
+                if regressed:
+                    regressions.append(f"{plate} {name}")
+                print(f"{plate:<8}{name:<26}{old * scale:9.1f} {unit}{value * scale:9.1f} {unit}{change:+8.0%}"
+                      f"{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def bench_suite(args):
+    results = {
+        "config": {"timepoints": args.timepoints, "channels": args.channels, "decimal_comma": args.decimal_comma,
+                   "repeat": args.repeat},
+        "environment": {"python": platform.python_version(), "numpy": np.__version__, "pandas": pd.__version__,
+                        "machine": platform.machine()},
+        "plates": {},
+    }
+    with tempfile.TemporaryDirectory() as workdir:
+        for n_wells in args.wells:
+            path = synthetic_workbook(os.path.join(workdir, f"plate-{n_wells}.xlsx"), n_wells, args.timepoints,
+                                      args.channels, args.decimal_comma)
+            stages, sizes = pipeline_stages(path, args.repeat)
+            results["plates"][str(n_wells)] = {"stages": stages, "sizes": sizes}
+            print(f"{n_wells} wells x {args.channels} channels x {args.timepoints} timepoints"
+                  f"{' (decimal comma)' if args.decimal_comma else ''}")
+            for name, seconds in stages.items():
+                print(f"  {name:<26}{seconds * 1000:10.1f} ms")
+            for name, size in sizes.items():
+                print(f"  {name:<26}{size / 1e3:10.1f} kB")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(results, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regressions above {args.tolerance:.0%}: " + ", ".join(regressions))
+            return False
+        print(f"No regressions above {args.tolerance:.0%}")
+
+
+# Function to time importing the dashboard and creating the app in a fresh interpreter
+def cold_start(eager=False):
+    script = STARTUP_SCRIPT.format(eager=eager, modules=STARTUP_DEFERRED_MODULES)
+    output = subprocess.run([sys.executable, "-c", script], cwd=os.path.dirname(os.path.abspath(__file__)),
+                            capture_output=True, text=True, check=True).stdout
+    seconds, imported = json.loads(output.strip().splitlines()[-1])
+    return seconds, imported
+
+
+def bench_startup(args):
+    # Best of several fresh interpreters, the first one also pays for cold .pyc and disk caches
+    runs = [cold_start() for _ in range(args.repeat)]
+    seconds = min(seconds for seconds, _ in runs)
+    imported = runs[0][1]
+    eager_seconds = min(cold_start(eager=True)[0] for _ in range(args.repeat))
+
+    print(f"{'create_app()':<28}{seconds * 1000:10.1f} ms")
+    print(f"{'create_app(eager=True)':<28}{eager_seconds * 1000:10.1f} ms")
+    print(f"{'deferred modules imported':<28}{', '.join(imported) or 'none':>10}")
+    print(f"{'budget':<28}{args.budget:10.1f} ms  {'OK' if seconds * 1000 <= args.budget else 'EXCEEDED'}")
+    return seconds * 1000 <= args.budget and not imported
+
+
+# Function to write the timepoints [start, stop) of a plate to a live export in the watched directory.
+# CSV exports are Incucyte-style tab-separated files with decimal commas, appended to; with
+# partial=True the phase file ends halfway through the next row, as while the imager is writing it.
+# Workbooks are saved again as a whole, like the imager does.
+def write_live_export(watch_dir, kind, wells, time, values, platemaps, start, stop, partial=False):
+    channels = ["phase", "green", "red"]
+
+    def line(channel, t):
+        cells = [f"{x:.5f}".replace(".", ",") for x in values[channels.index(channel)][t]]
+        return "\t".join(["2024-01-01 00:00", f"{time[t]:g}".replace(".", ",")] + cells) + "\n"
+
+    if kind == "xlsx":
+        workbook = openpyxl.Workbook(write_only=True)
+        for name, grid in platemaps.items():
+            sheet = workbook.create_sheet(name)
+            sheet.append([None] + list(grid.columns))
+            for row, labels in grid.iterrows():
+                sheet.append([row] + labels.tolist())
+        for i, channel in enumerate(channels):
+            sheet = workbook.create_sheet(channel)
+            sheet.append(["Elapsed"] + wells)
+            for t in range(stop):
+                sheet.append([float(time[t])] + values[i][t].tolist())
+        staging = os.path.join(watch_dir, ".plate.xlsx")
+        workbook.save(staging)
+        os.replace(staging, os.path.join(watch_dir, "plate.xlsx"))
+        return
+
+    if start == 0:
+        for name, grid in platemaps.items():
+            grid.to_csv(os.path.join(watch_dir, f"plate_{name}.csv"))
+    for channel in channels:
+        with open(os.path.join(watch_dir, f"plate_{channel}.txt"), "a") as f:
+            if start == 0:
+                f.write(f"Vessel Name: live benchmark\nMetric: {channel}\n\n"
+                        + "\t".join(["Date Time", "Elapsed"] + wells) + "\n")
+            text = "".join(line(channel, t) for t in range(start, stop))
+            if partial and channel == "phase":
+                # Finish the row cut short by the previous write and cut the next one short
+                if start:
+                    text = line(channel, start)[len(line(channel, start)) // 2:] + text[len(line(channel, start)):]
+                if stop < len(time):
+                    text += line(channel, stop)[:len(line(channel, stop)) // 2]
+            f.write(text)
+
+
+def bench_live(args):
+    n_rows, n_cols = next(shape for shape in PLATE_FORMATS if shape[0] * shape[1] >= args.wells)
+    rows = [row_letters(i) for i in range(n_rows)]
+    wells = [f"{rows[i // n_cols]}{i % n_cols + 1}" for i in range(args.wells)]
+    treatments, celltypes = random_platemap(wells)
+    platemaps = {
+        name: pd.DataFrame([[grid.get(f"{row}{col}") for col in range(1, n_cols + 1)] for row in rows],
+                           index=rows, columns=range(1, n_cols + 1))
+        for name, grid in (("treatments", dict(zip(treatments["Well"], treatments["Treatment"]))),
+                           ("celltypes", dict(zip(celltypes["Well"], celltypes["CellType"]))))
+    }
+    time, curves = synthetic_growth_curves(args.timepoints, args.wells * 3)
+    values = [curves[:, i * args.wells:(i + 1) * args.wells] for i in range(3)]
+    dataset_id = LIVE_PREFIX + "plate"
+    partial = args.format == "csv"
+    print(f"{args.format} export, {args.wells} wells x 3 channels, {args.initial} + {args.timepoints - args.initial}"
+          f" timepoints in batches of {args.batch}")
+
+    with tempfile.TemporaryDirectory() as watch_dir:
+        write_live_export(watch_dir, args.format, wells, time, values, platemaps, 0, args.initial, partial)
+        first_poll, (dataset, _) = best_time(lambda: refresh_live_dataset(dataset_id, watch_dir), 1)
+
+        poll_seconds = []
+        for start in range(args.initial, args.timepoints, args.batch):
+            stop = min(start + args.batch, args.timepoints)
+            write_live_export(watch_dir, args.format, wells, time, values, platemaps, start, stop, partial)
+            seconds, (dataset, _) = best_time(lambda: refresh_live_dataset(dataset_id, watch_dir), 1)
+            poll_seconds.append(seconds)
+        live_cube = dataset["cube"]
+
+        # The incremental cube must match a parse of the finished export
+        full_seconds, full_export = best_time(lambda: LiveExport("full", list_exports(watch_dir)["plate"]), 1)
+        full_seconds += best_time(full_export.poll, 1)[0]
+        full_cube = full_export.dataset["cube"]
+
+    matches = (np.array_equal(live_cube.times, full_cube.times) and len(live_cube.times) == args.timepoints
+               and np.array_equal(live_cube.values, full_cube.values, equal_nan=True)
+               and np.array_equal(live_cube.treatment_codes, full_cube.treatment_codes))
+    mean_poll = 1000 * np.mean(poll_seconds)
+    # Workbooks are zipped XML saved as a whole and are scanned again on every poll, they only have to
+    # beat a full parse
+    budget = args.budget or (50 if args.format == "csv" else full_seconds * 1000)
+    print(f"{'first poll':<28}{first_poll * 1000:10.1f} ms")
+    print(f"{'incremental poll (mean)':<28}{mean_poll:10.1f} ms")
+    print(f"{'incremental poll (max)':<28}{1000 * max(poll_seconds):10.1f} ms")
+    print(f"{'full parse':<28}{full_seconds * 1000:10.1f} ms")
+    print(f"{'matches full parse':<28}{'yes' if matches else 'NO':>10}")
+    print(f"{'budget':<28}{budget:10.1f} ms  {'OK' if mean_poll <= budget else 'EXCEEDED'}")
+    return matches and mean_poll <= budget
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Performance benchmarks for the BioImaging Dashboard")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    decimal_comma = subparsers.add_parser("decimal-comma", help="Decimal-comma parsing in process_microscopy_data")
+    decimal_comma.add_argument("--wells", type=int, default=1536)
+    decimal_comma.add_argument("--repeat", type=int, default=3)
+    decimal_comma.set_defaults(func=bench_decimal_comma)
+
+    aggregation = subparsers.add_parser("aggregation", help="Grouped mean/std used by every line plot")
+    aggregation.add_argument("--wells", type=int, default=1536)
+    aggregation.add_argument("--repeat", type=int, default=3)
+    aggregation.set_defaults(func=bench_aggregation)
+
+    rendering = subparsers.add_parser("rendering", help="Line plot trace building, WebGL and LTTB downsampling")
+    rendering.add_argument("--groups", type=int, default=24)
+    rendering.add_argument("--timepoints", type=int, default=5000)
+    rendering.add_argument("--max-points", type=int, nargs="+", default=[0, 2000, 1000, 500])
+    rendering.add_argument("--repeat", type=int, default=3)
+    rendering.set_defaults(func=bench_rendering)
+
+    kinetics = subparsers.add_parser("kinetics", help="Per-well AUC, growth rate, doubling time, lag and time to threshold")
+    kinetics.add_argument("--wells", type=int, default=1536)
+    kinetics.add_argument("--channels", type=int, default=4)
+    kinetics.add_argument("--timepoints", type=int, default=300)
+    kinetics.add_argument("--budget", type=float, default=1000, help="Time budget in ms")
+    kinetics.add_argument("--repeat", type=int, default=3)
+    kinetics.set_defaults(func=bench_kinetics)
+
+    qc = subparsers.add_parser("qc", help="Outlier-well, dropout, saturation and plate-effect checks")
+    qc.add_argument("--wells", type=int, default=1536)
+    qc.add_argument("--channels", type=int, default=3)
+    qc.add_argument("--timepoints", type=int, default=300)
+    qc.add_argument("--budget", type=float, default=1000, help="Time budget in ms")
+    qc.add_argument("--repeat", type=int, default=3)
+    qc.set_defaults(func=bench_qc)
+
+    statistics = subparsers.add_parser("statistics", help="Per-timepoint and kinetics tests of every treatment against a control")
+    statistics.add_argument("--wells", type=int, default=1536)
+    statistics.add_argument("--timepoints", type=int, default=300)
+    statistics.add_argument("--treatments", type=int, default=48)
+    statistics.add_argument("--test", choices=["welch", "mannwhitney"], default="welch")
+    statistics.add_argument("--budget", type=float, default=500, help="Time budget in ms")
+    statistics.add_argument("--repeat", type=int, default=3)
+    statistics.set_defaults(func=bench_statistics)
+
+    suite = subparsers.add_parser("suite", help="Every stage from workbook loading to figure JSON on synthetic plates")
+    suite.add_argument("--wells", type=int, nargs="+", default=[96, 384, 1536], choices=[96, 384, 1536])
+    suite.add_argument("--timepoints", type=int, default=150)
+    suite.add_argument("--channels", type=int, default=3, choices=[1, 2, 3])
+    suite.add_argument("--decimal-comma", action="store_true", help="Write the values as decimal-comma strings")
+    suite.add_argument("--output", help="Write the results to this JSON file")
+    suite.add_argument("--baseline", help="Compare with the results JSON of an earlier run")
+    suite.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown or growth, 0.25 = 25%%")
+    suite.add_argument("--repeat", type=int, default=3)
+    suite.set_defaults(func=bench_suite)
+
+    startup = subparsers.add_parser("startup", help="Importing the dashboard and creating the app, without heavy imports")
+    startup.add_argument("--budget", type=float, default=1000, help="Time budget in ms")
+    startup.add_argument("--repeat", type=int, default=3)
+    startup.set_defaults(func=bench_startup)
+
+    live = subparsers.add_parser("live", help="Polling a growing live export against a parse of the finished file")
+    live.add_argument("--format", choices=["csv", "xlsx"], default="csv")
+    live.add_argument("--wells", type=int, default=384)
+    live.add_argument("--timepoints", type=int, default=300)
+    live.add_argument("--initial", type=int, default=100, help="Timepoints written before the first poll")
+    live.add_argument("--batch", type=int, default=4, help="Timepoints written between two polls")
+    live.add_argument("--budget", type=float, help="Time budget of the mean poll in ms (CSV 50, workbooks the full parse)")
+    live.set_defaults(func=bench_live)
+
+    args = parser.parse_args()
+    # Benchmarks with a time budget fail the run when they exceed it
+    if args.func(args) is False:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
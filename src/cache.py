@@ -0,0 +1,272 @@
+import hashlib
+import os
+import pickle
+import re
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+# Directory holding the on-disk caches (sidecars, projects, callback results, profiles)
+CACHE_DIR = os.environ.get(
+    "BIOIMAGING_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "bioimaging-dashboard")
+)
+
+# Disk budget of the workbook sidecars, and separately of the shared plate cubes (20 GB each);
+# the least recently used entries are removed first
+DISK_CACHE_BYTES = int(os.environ.get("BIOIMAGING_DISK_CACHE_BYTES", str(20 * 1024 ** 3)))
+
+# Sidecars and shared plate cubes not opened for this many days are removed (0 keeps them)
+DISK_CACHE_MAX_AGE_DAYS = float(os.environ.get("BIOIMAGING_DISK_CACHE_MAX_AGE_DAYS", "30"))
+
+# On-disk cache entries are directories named <dataset id>.v<layout version>
+DISK_CACHE_ENTRY_PATTERN = re.compile(r"^[^.].*\.v(?P<version>\d+)$")
+
+# Staging directories older than this (in seconds) were left by a crashed writer
+STALE_STAGING_SECONDS = 24 * 3600
+
+# Marks a lookup that missed the shared store of a cache
+SHARED_MISSING = object()
+
+# Default memory budget for parsed datasets held on the server (512 MB)
+DATASET_CACHE_BYTES = 512 * 1024 * 1024
+
+# Number of rendered figure sets kept for repeat interactions
+FIGURE_CACHE_ENTRIES = 128
+
+# Number of single-group trace pairs kept for incremental figure updates
+TRACE_CACHE_ENTRIES = 1024
+
+# Number of per-well kinetics tables kept (one per dataset and threshold)
+KINETICS_CACHE_ENTRIES = 32
+
+# Number of per-well growth fits kept (one per channel data hash and model)
+FIT_CACHE_ENTRIES = 64
+
+# Number of QC results kept (one per dataset)
+QC_CACHE_ENTRIES = 32
+
+# Number of treatment-versus-control test results kept (one per comparison, channel and test)
+COMPARISON_CACHE_ENTRIES = 2048
+
+
+# Function to compute a content hash for an uploaded file
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+# Function to get the total size of the files in a directory tree
+def directory_bytes(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+# Function to bound an on-disk cache directory: entries of another layout version, entries unused
+# for max_age_days and then the least recently used ones beyond max_bytes are removed, as are
+# staging directories left by crashed writers. Entries are marked as used by touching them
+# (see touch_disk_cache_entry). The entry named keep is never removed. Returns the removed paths.
+def prune_disk_cache(directory, version, keep=None, max_bytes=None, max_age_days=None):
+    max_bytes = DISK_CACHE_BYTES if max_bytes is None else max_bytes
+    max_age_days = DISK_CACHE_MAX_AGE_DAYS if max_age_days is None else max_age_days
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return []
+
+    now = time.time()
+    removed, entries = [], []
+    for name in names:
+        path = os.path.join(directory, name)
+        try:
+            modified = os.stat(path).st_mtime
+        except OSError:
+            continue
+        if not os.path.isdir(path) or path == keep:
+            continue
+        if name.startswith(".staging-"):
+            if now - modified > STALE_STAGING_SECONDS:
+                removed.append(path)
+            continue
+        match = DISK_CACHE_ENTRY_PATTERN.match(name)
+        if match is None:
+            continue
+        if int(match["version"]) != version or (max_age_days and now - modified > max_age_days * 86400):
+            removed.append(path)
+        else:
+            entries.append((modified, directory_bytes(path), path))
+
+    # Oldest first until the rest (and the kept entry) fit the budget
+    total = sum(size for _, size, _ in entries) + (directory_bytes(keep) if keep else 0)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        removed.append(path)
+        total -= size
+
+    for path in removed:
+        shutil.rmtree(path, ignore_errors=True)
+    return removed
+
+
+# Function to mark an on-disk cache entry as just used, so pruning removes it last
+def touch_disk_cache_entry(path):
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+# Function to estimate how many bytes an object holds in memory
+def estimate_nbytes(obj):
+    import pandas as pd
+
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(index=True, deep=True).sum())
+    if isinstance(obj, pd.Series):
+        return int(obj.memory_usage(index=True, deep=True))
+    if hasattr(obj, "nbytes"):
+        return int(obj.nbytes)
+    if isinstance(obj, dict):
+        return sum(estimate_nbytes(value) for value in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sum(estimate_nbytes(value) for value in obj)
+    return 0
+
+
+# Least-recently-used cache bounded by an approximate byte budget and/or an entry count
+class LRUCache:
+    def __init__(self, max_bytes=None, max_entries=None, sizeof=estimate_nbytes):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.sizeof = sizeof
+        self._entries = OrderedDict()  # key -> (value, nbytes)
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        # Optional store shared with other processes, see share()
+        self.shared_store = None
+        self.shared_prefix = None
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    # Function to back the cache with a store shared across processes (a diskcache.Cache), for
+    # processes that live shorter than their results, like background callback jobs. Entries missing
+    # from memory are looked up there, new entries and the hit/miss counters are written through.
+    def share(self, store, prefix):
+        self.shared_store = store
+        self.shared_prefix = prefix
+
+    def get(self, key, default=None):
+        with self._lock:
+            found = key in self._entries
+            if found:
+                # Mark the entry as most recently used
+                self._entries.move_to_end(key)
+                value = self._entries[key][0]
+        if not found and self.shared_store is not None:
+            value = self.shared_store.get(self.shared_prefix + (key,), SHARED_MISSING)
+            found = value is not SHARED_MISSING
+            if found:
+                self._put_local(key, value)
+        self._count("hits" if found else "misses")
+        return value if found else default
+
+    def put(self, key, value):
+        self._put_local(key, value)
+        if self.shared_store is not None:
+            try:
+                self.shared_store.set(self.shared_prefix + (key,), value)
+            except (OSError, pickle.PickleError, TypeError) as e:
+                print(f"Could not share a cache entry with the other processes: {e}")
+        return value
+
+    def _put_local(self, key, value):
+        nbytes = self.sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, nbytes)
+            self.current_bytes += nbytes
+            # Evict the least recently used entries until we fit the budget,
+            # always keeping the entry that was just added
+            while self._over_budget() and len(self._entries) > 1:
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_bytes
+        return value
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+        if self.shared_store is not None:
+            self.shared_store.incr(self.shared_prefix + (counter,))
+
+    def _over_budget(self):
+        if self.max_bytes is not None and self.current_bytes > self.max_bytes:
+            return True
+        return self.max_entries is not None and len(self._entries) > self.max_entries
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            value, nbytes = self._entries.pop(key)
+            self.current_bytes -= nbytes
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    # Function to read a hit/miss counter, summed over all processes when the cache is shared
+    def shared_count(self, counter):
+        if self.shared_store is None:
+            return getattr(self, counter)
+        return self.shared_store.get(self.shared_prefix + (counter,), 0)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "max_entries": self.max_entries,
+                "hits": self.shared_count("hits"),
+                "misses": self.shared_count("misses"),
+            }
+
+
+# Server-side registry of parsed workbooks, keyed by the upload's content hash
+dataset_cache = LRUCache(max_bytes=DATASET_CACHE_BYTES)
+
+# Rendered figures keyed on (dataset, tab, data type, selected treatments, selected cell types)
+figure_cache = LRUCache(max_entries=FIGURE_CACHE_ENTRIES)
+
+# Line and band traces of single groups keyed on (dataset, data type, group, max points, WebGL)
+trace_cache = LRUCache(max_entries=TRACE_CACHE_ENTRIES)
+
+# Per-well kinetics tables keyed on (dataset, threshold fraction)
+kinetics_cache = LRUCache(max_entries=KINETICS_CACHE_ENTRIES)
+
+# Per-well growth-curve fits keyed on (hash of the times and values, model)
+fit_cache = LRUCache(max_entries=FIT_CACHE_ENTRIES)
+
+# QC tables and flagged-well masks keyed by dataset
+qc_cache = LRUCache(max_entries=QC_CACHE_ENTRIES)
+
+# Statistical tests of one treatment against the control keyed on
+# (kind, dataset, data type, test, [threshold], control, treatment, cell type)
+comparison_cache = LRUCache(max_entries=COMPARISON_CACHE_ENTRIES)
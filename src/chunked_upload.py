@@ -0,0 +1,202 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+
+from flask import jsonify, request
+
+
+# Directory where chunked uploads are spooled before parsing
+SPOOL_DIR = os.environ.get("BIOIMAGING_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "bioimaging-uploads"))
+
+# Upload ids are generated by the browser, keep them filesystem-safe
+UPLOAD_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{8,128}$")
+
+# Largest upload accepted, so a client cannot fill the spool disk (4 GB)
+MAX_UPLOAD_BYTES = int(os.environ.get("BIOIMAGING_MAX_UPLOAD_BYTES", str(4 * 1024 ** 3)))
+
+# Locks of the uploads handled by this process, keyed by upload id. Everything else about an upload
+# is read from its spool files, which every worker process shares: the chunks received so far
+# (<id>.part), the complete file while it is parsed (<id>.parsing) and the outcome (<id>.result.json).
+# Entries are dropped once the outcome was reported.
+uploads = {}
+uploads_lock = threading.Lock()
+
+
+# Function to compute the content hash of a spooled file without loading it in memory
+def file_hash(path, block_size=8 * 1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# Function to get how many bytes of an upload are spooled, by any worker process
+def spooled_bytes(path):
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+# Function to read the outcome of a parsed upload, None while it is not parsed
+def read_result(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# Function to write the outcome of a parsed upload, renamed into place so readers never see half of it
+def write_result(path, result):
+    staging = f"{path}.{os.getpid()}.{threading.get_ident()}"
+    with open(staging, "w") as f:
+        json.dump(result, f)
+    os.replace(staging, path)
+
+
+# Function to refresh an upload state from its spool files, another worker may have written chunks
+# or finished parsing since. A spool file left by an interrupted upload lets the browser resume.
+def refresh_state(state):
+    result = read_result(state["result_path"]) or {}
+    state["dataset_id"] = result.get("dataset_id")
+    state["error"] = result.get("error")
+    state["processing"] = not result and os.path.exists(state["parsing_path"])
+    if state["dataset_id"] is not None:
+        state["received"] = state["total"]
+    else:
+        state["received"] = spooled_bytes(state["parsing_path"] if state["processing"] else state["path"])
+
+
+# Function to get the state of an upload, refreshed from its spool files. A new state is only
+# registered when create is set (i.e. for a chunk), status requests do not add one.
+def upload_state(upload_id, total=None, filename=None, create=False):
+    with uploads_lock:
+        state = uploads.get(upload_id)
+        if state is None:
+            spool = os.path.join(SPOOL_DIR, upload_id)
+            state = {
+                "upload_id": upload_id,
+                "path": f"{spool}.part",
+                "parsing_path": f"{spool}.parsing",
+                "result_path": f"{spool}.result.json",
+                "filename": filename,
+                "total": total,
+                "lock": threading.Lock(),
+            }
+            if create:
+                uploads[upload_id] = state
+        if total is not None:
+            state["total"] = total
+        if filename:
+            state["filename"] = filename
+    refresh_state(state)
+    return state
+
+
+# Function to forget a finished or failed upload once its outcome was reported
+def release_upload(state):
+    if state["dataset_id"] is not None or state["error"]:
+        with uploads_lock:
+            uploads.pop(state["upload_id"], None)
+        if os.path.exists(state["result_path"]):
+            os.remove(state["result_path"])
+
+
+# Function to serialize the public part of an upload state
+def state_response(state, status=200):
+    return jsonify({
+        "upload_id": state["upload_id"],
+        "filename": state["filename"],
+        "received": state["received"],
+        "total": state["total"],
+        "processing": state["processing"],
+        "done": state["dataset_id"] is not None,
+        "dataset_id": state["dataset_id"],
+        "error": state["error"],
+    }), status
+
+
+# Function to hash, parse and register a completely received upload. Runs in a background thread,
+# so the last chunk's request returns at once and the browser polls the status until it is done.
+def finalize_upload(state):
+    # The parsers are only imported once the first upload completes
+    from datasets import register_dataset
+
+    try:
+        dataset_id = file_hash(state["parsing_path"])
+        # openpyxl only opens workbook paths with an Excel extension, the spool file is passed open
+        with open(state["parsing_path"], "rb") as f:
+            register_dataset(dataset_id, f)
+        result = {"dataset_id": dataset_id}
+    except Exception as e:
+        # The spool file is discarded, so a retry starts from the first chunk
+        result = {"error": f"Error processing file: {str(e)}"}
+    try:
+        write_result(state["result_path"], result)
+    finally:
+        os.remove(state["parsing_path"])
+
+
+# Function to add the resumable chunked upload routes to the Flask server behind the Dash app
+def register_upload_routes(server):
+    @server.route("/upload/<upload_id>", methods=["GET"])
+    def upload_status(upload_id):
+        if not UPLOAD_ID_PATTERN.match(upload_id):
+            return jsonify({"error": "Invalid upload id"}), 400
+        state = upload_state(upload_id)
+        response = state_response(state)
+        release_upload(state)
+        return response
+
+    @server.route("/upload/<upload_id>", methods=["POST"])
+    def upload_chunk(upload_id):
+        if not UPLOAD_ID_PATTERN.match(upload_id):
+            return jsonify({"error": "Invalid upload id"}), 400
+        try:
+            offset = int(request.args["offset"])
+            total = int(request.args["total"])
+        except (KeyError, ValueError):
+            return jsonify({"error": "offset and total are required"}), 400
+        if offset < 0 or total <= 0:
+            return jsonify({"error": "offset must not be negative and total must be positive"}), 400
+        if total > MAX_UPLOAD_BYTES:
+            return jsonify({"error": f"Uploads are limited to {MAX_UPLOAD_BYTES / 1e9:.1f} GB"}), 413
+        if request.content_length is not None and offset + request.content_length > total:
+            return jsonify({"error": "The chunk ends past the total size"}), 400
+
+        state = upload_state(upload_id, total=total, filename=request.args.get("filename"), create=True)
+        with state["lock"]:
+            # Chunks must arrive in order, a mismatch tells the client where to resume
+            refresh_state(state)
+            if state["processing"] or state["dataset_id"] is not None:
+                # The file is complete already, e.g. the last chunk was sent twice
+                response = state_response(state)
+                release_upload(state)
+                return response
+            if offset != state["received"]:
+                return state_response(state, 409)
+            if offset == 0 and state["error"]:
+                # Starting over after a failed parse
+                os.remove(state["result_path"])
+                state["error"] = None
+
+            os.makedirs(SPOOL_DIR, exist_ok=True)
+            # Written at the offset rather than appended, so a chunk sent twice never duplicates bytes
+            with open(state["path"], "r+b" if offset else "wb") as f:
+                f.seek(offset)
+                # Copy the request body to the spool file without buffering the whole chunk
+                for block in iter(lambda: request.stream.read(1024 * 1024), b""):
+                    if f.tell() + len(block) > total:
+                        f.truncate(offset)
+                        return jsonify({"error": "The chunk ends past the total size"}), 400
+                    f.write(block)
+            state["received"] = os.path.getsize(state["path"])
+
+            if state["received"] >= state["total"]:
+                # Parsed in the background, the status route reports when it is done
+                os.replace(state["path"], state["parsing_path"])
+                state["processing"] = True
+                threading.Thread(target=finalize_upload, args=(dict(state),), daemon=True).start()
+            return state_response(state)
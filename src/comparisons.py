@@ -0,0 +1,232 @@
+import functools
+import re
+
+import numpy as np
+
+from cache import comparison_cache
+
+# Two-sample tests of a treatment against the control, by the name shown on the Statistics tab
+STATISTICAL_TESTS = {
+    "welch": "Welch t-test",
+    "mannwhitney": "Mann-Whitney U",
+}
+
+# Multiple-testing corrections, applied over all the comparisons shown together
+P_VALUE_CORRECTIONS = {
+    "fdr_bh": "Benjamini-Hochberg (FDR)",
+    "holm": "Holm",
+    "bonferroni": "Bonferroni",
+    "none": "None",
+}
+
+# Treatments whose names look like a control are picked as the default control
+CONTROL_NAME_PATTERN = re.compile(r"control|vehicle|dmso|untreated|mock|ctrl", re.IGNORECASE)
+
+# Adjusted p-values below this count as significant
+SIGNIFICANCE_LEVEL = 0.05
+
+# Mann-Whitney p-values are exact when the smaller sample has at most this many wells and there
+# are no ties, the normal approximation is used otherwise (as scipy.stats.mannwhitneyu does)
+MANN_WHITNEY_EXACT_SIZE = 8
+
+# Fields of the per-comparison results, each shaped (comparison, timepoint or metric)
+RESULT_FIELDS = ["n_treated", "n_control", "mean_treated", "mean_control", "statistic", "p"]
+
+
+# Function to pick the default control of a plate: the first treatment named like a control,
+# otherwise the first treatment
+def default_control(treatments):
+    return next((t for t in treatments if CONTROL_NAME_PATTERN.search(str(t))), treatments[0] if treatments else None)
+
+
+# Function to gather the wells of every comparison from a (k, well) matrix into a NaN-padded
+# (comparison, well, k) array, so each test runs on all comparisons and columns at once
+def padded_samples(values, well_lists):
+    size = max((len(wells) for wells in well_lists), default=0)
+    index = np.full((len(well_lists), size), -1, dtype=np.int64)
+    for i, wells in enumerate(well_lists):
+        index[i, :len(wells)] = wells
+    samples = np.take(values, np.maximum(index, 0), axis=1).astype(np.float64).transpose(1, 2, 0)
+    samples[index < 0] = np.nan
+    return samples
+
+
+# Function to count, average and take the sample variance of every (comparison, k) sample, skipping NaNs
+def sample_moments(samples):
+    valid = ~np.isnan(samples)
+    n = valid.sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.where(valid, samples, 0.0).sum(axis=1) / n
+        deviations = np.where(valid, samples - mean[:, None], 0.0)
+        variance = (deviations ** 2).sum(axis=1) / (n - 1)
+    return n, mean, variance
+
+
+# Function to run Welch's unequal-variance t-test on every (comparison, k) pair of samples.
+# Returns the t statistics and two-sided p-values.
+def welch_t_test(treated, control):
+    from scipy.special import stdtr
+
+    n1, mean1, var1 = sample_moments(treated)
+    n2, mean2, var2 = sample_moments(control)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        se1, se2 = var1 / n1, var2 / n2
+        t = (mean1 - mean2) / np.sqrt(se1 + se2)
+        # Welch-Satterthwaite degrees of freedom
+        df = (se1 + se2) ** 2 / (se1 ** 2 / (n1 - 1) + se2 ** 2 / (n2 - 1))
+    tested = (n1 >= 2) & (n2 >= 2) & (se1 + se2 > 0)
+    t = np.where(tested, t, np.nan)
+    return t, np.where(tested, 2 * stdtr(np.where(tested, df, 1.0), -np.abs(t)), np.nan)
+
+
+# Function to rank every (comparison, k) column of the pooled samples along the well axis, ties
+# getting their average rank. Returns the ranks and the tie term sum(t^3 - t) of every column.
+def pooled_ranks(pooled):
+    order = np.argsort(pooled, axis=1, kind="stable")
+    ordered = np.take_along_axis(pooled, order, axis=1)
+    position = np.arange(pooled.shape[1])[None, :, None]
+
+    # Runs of equal values, NaNs sort last and never equal anything
+    new_run = np.ones(ordered.shape, dtype=bool)
+    new_run[:, 1:] = ordered[:, 1:] != ordered[:, :-1]
+    run_end = np.ones(ordered.shape, dtype=bool)
+    run_end[:, :-1] = new_run[:, 1:]
+    start = np.maximum.accumulate(np.where(new_run, position, 0), axis=1)
+    end = np.flip(np.minimum.accumulate(np.flip(np.where(run_end, position, pooled.shape[1]), axis=1), axis=1), axis=1)
+
+    ranks = np.empty_like(pooled)
+    np.put_along_axis(ranks, order, (start + end) / 2 + 1, axis=1)
+    run_length = (end - start + 1).astype(np.float64)
+    ties = np.where(np.isnan(ordered), 0.0, run_length ** 2 - 1).sum(axis=1)
+    return ranks, ties
+
+
+# Function to get the exact null distribution of the Mann-Whitney U statistic for sample sizes
+# n1 and n2 without ties, as P(U >= u) for u = 0 .. n1 * n2
+@functools.lru_cache(maxsize=256)
+def mann_whitney_exact_sf(n1, n2):
+    small, large = sorted((n1, n2))
+    # counts[n] is the number of orderings with each U for (m, n) samples, built up one m at a time:
+    # the largest value is either from the first sample (adding n to U) or from the second
+    counts = [np.ones(1) for _ in range(large + 1)]
+    for m in range(1, small + 1):
+        updated = [np.ones(1)]
+        for n in range(1, large + 1):
+            row = np.zeros(m * n + 1)
+            row[n:n + len(counts[n])] += counts[n]
+            row[:len(updated[n - 1])] += updated[n - 1]
+            updated.append(row)
+        counts = updated
+    distribution = counts[large]
+    return np.cumsum(distribution[::-1])[::-1] / distribution.sum()
+
+
+# Function to run the two-sided Mann-Whitney U test on every (comparison, k) pair of samples.
+# Returns the U statistics of the treated samples and the p-values.
+def mann_whitney_test(treated, control):
+    from scipy.special import ndtr
+
+    n1 = (~np.isnan(treated)).sum(axis=1)
+    n2 = (~np.isnan(control)).sum(axis=1)
+    ranks, ties = pooled_ranks(np.concatenate([treated, control], axis=1))
+    rank_sum = np.nansum(np.where(np.isnan(treated), np.nan, ranks[:, :treated.shape[1]]), axis=1)
+    u = rank_sum - n1 * (n1 + 1) / 2
+    u_max = np.maximum(u, n1 * n2 - u)
+
+    # Normal approximation with tie and continuity corrections
+    n = n1 + n2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sigma = np.sqrt(n1 * n2 / 12 * ((n + 1) - ties / (n * (n - 1))))
+        z = (u_max - n1 * n2 / 2 - 0.5) / sigma
+    p = np.minimum(2 * ndtr(-z), 1.0)
+
+    # Small samples without ties get their exact p-values, one null distribution per pair of sizes
+    exact = (ties == 0) & (np.minimum(n1, n2) <= MANN_WHITNEY_EXACT_SIZE) & (n1 > 0) & (n2 > 0)
+    for size1, size2 in set(zip(n1[exact].tolist(), n2[exact].tolist())):
+        sizes = exact & (n1 == size1) & (n2 == size2)
+        p[sizes] = np.minimum(2 * mann_whitney_exact_sf(size1, size2)[u_max[sizes].astype(np.int64)], 1.0)
+
+    tested = (n1 > 0) & (n2 > 0) & (sigma > 0)
+    return np.where(tested, u, np.nan), np.where(tested, p, np.nan)
+
+
+# Function to test the treated wells against the control wells of every comparison, on every
+# column of a (k, well) matrix at once. Returns the RESULT_FIELDS, each shaped (comparison, k).
+def compare_wells(values, treated_wells, control_wells, test):
+    treated = padded_samples(values, treated_wells)
+    control = padded_samples(values, control_wells)
+    n_treated, mean_treated, _ = sample_moments(treated)
+    n_control, mean_control, _ = sample_moments(control)
+    statistic, p = (mann_whitney_test if test == "mannwhitney" else welch_t_test)(treated, control)
+    return {"n_treated": n_treated, "n_control": n_control, "mean_treated": mean_treated,
+            "mean_control": mean_control, "statistic": statistic, "p": p}
+
+
+# Function to adjust p-values for multiple testing over the whole array, NaNs are left out
+def adjust_p_values(p, method="fdr_bh"):
+    p = np.asarray(p, dtype=np.float64)
+    tested = ~np.isnan(p)
+    m = int(tested.sum())
+    if method == "none" or m == 0:
+        return p.copy()
+
+    order = np.argsort(p[tested])
+    ordered = p[tested][order]
+    if method == "bonferroni":
+        adjusted = ordered * m
+    elif method == "holm":
+        adjusted = np.maximum.accumulate(ordered * (m - np.arange(m)))
+    else:
+        adjusted = np.minimum.accumulate((ordered * m / np.arange(1, m + 1))[::-1])[::-1]
+
+    result = np.full(p.shape, np.nan)
+    values = np.empty(m)
+    values[order] = np.minimum(adjusted, 1.0)
+    result[tested] = values
+    return result
+
+
+# Function to test every selected treatment against the control within every selected cell type,
+# at every timepoint of a channel and on the per-well kinetics metrics. Comparisons are cached one
+# by one, so a changed selection only tests the comparisons it adds. The p-values are corrected
+# over the comparisons shown. Returns the (treatment, cell type) labels and group ids of the
+# comparisons and, for "timecourse" and "kinetics", the RESULT_FIELDS and "p_adjusted".
+def compare_treatments(dataset_id, cube, data_type, control, selected_treatments, selected_celltypes,
+                       test, correction, threshold_fraction):
+    from kinetics import KINETICS_COLUMNS, dataset_kinetics
+
+    comparisons = [(treatment, celltype) for celltype in selected_celltypes for treatment in selected_treatments
+                   if treatment != control and treatment in cube.treatment_labels
+                   and celltype in cube.celltype_labels]
+
+    # Wells of each comparison's treated and control groups
+    def wells(treatment, celltype):
+        if treatment not in cube.treatment_labels:
+            return np.empty(0, dtype=np.int64)
+        return np.flatnonzero((cube.treatment_codes == cube.treatment_labels.index(treatment))
+                              & (cube.celltype_codes == cube.celltype_labels.index(celltype)))
+
+    def kinetics_values():
+        table = dataset_kinetics(dataset_id, cube, threshold_fraction)
+        return table.loc[table["Channel"] == data_type, KINETICS_COLUMNS].to_numpy(dtype=np.float64).T
+
+    results = {"comparisons": comparisons,
+               "groups": [cube.treatment_labels.index(t) * len(cube.celltype_labels) + cube.celltype_labels.index(c)
+                          for t, c in comparisons]}
+    for kind, values, key in (("timecourse", lambda: cube.channel(data_type), (dataset_id, data_type, test)),
+                              ("kinetics", kinetics_values, (dataset_id, data_type, test, threshold_fraction))):
+        keys = [(kind,) + key + (control, treatment, celltype) for treatment, celltype in comparisons]
+        cached = [comparison_cache.get(k) for k in keys]
+        missing = [i for i, result in enumerate(cached) if result is None]
+        if missing:
+            batch = compare_wells(values(), [wells(*comparisons[i]) for i in missing],
+                                  [wells(control, comparisons[i][1]) for i in missing], test)
+            for j, i in enumerate(missing):
+                cached[i] = comparison_cache.put(keys[i], {field: batch[field][j].copy() for field in RESULT_FIELDS})
+
+        n_columns = len(cube.times) if kind == "timecourse" else len(KINETICS_COLUMNS)
+        merged = {field: np.array([result[field] for result in cached]).reshape(len(comparisons), n_columns)
+                  for field in RESULT_FIELDS}
+        merged["p_adjusted"] = adjust_p_values(merged["p"], correction)
+        results[kind] = merged
+    return results
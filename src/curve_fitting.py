@@ -0,0 +1,235 @@
+import hashlib
+import re
+import warnings
+
+import numpy as np
+import pandas as pd
+from scipy.optimize import OptimizeWarning, curve_fit
+
+from workers import get_worker_pool
+
+# Parameters of the growth models (Zwietering et al. 1990 reparameterization plus a baseline)
+GROWTH_PARAMETERS = ["Baseline", "Amplitude", "Max Rate (1/h)", "Lag (h)"]
+
+# Parameters of the 4-parameter logistic dose-response model
+DOSE_RESPONSE_PARAMETERS = ["Bottom", "Top", "EC50 (uM)", "Hill"]
+
+# Relative tolerance of the least-squares fits
+FIT_TOLERANCE = 1e-6
+
+# Wells per worker task; each task fits a contiguous run of wells so warm starts stay local
+FIT_CHUNK_WELLS = 64
+
+# Smaller plates are fitted in the calling process, the pool start-up would dominate
+MIN_PARALLEL_WELLS = 2 * FIT_CHUNK_WELLS
+
+# Doses written in treatment names, e.g. "Torin 250 nM" or "MG132 1uM", converted to uM
+DOSE_PATTERN = re.compile(r"(\d+(?:[.,]\d+)?)\s*(pM|nM|uM|µM|μM|mM)\b")
+DOSE_UNITS_UM = {"pM": 1e-6, "nM": 1e-3, "uM": 1.0, "µM": 1.0, "μM": 1.0, "mM": 1e3}
+
+
+# Logistic growth: baseline + amplitude / (1 + exp(4 mu / A (lag - t) + 2))
+def logistic(t, baseline, amplitude, rate, lag):
+    with np.errstate(over="ignore", divide="ignore", invalid="ignore"):
+        return baseline + amplitude / (1 + np.exp(4 * rate / amplitude * (lag - t) + 2))
+
+
+# Gompertz growth: baseline + amplitude * exp(-exp(mu e / A (lag - t) + 1))
+def gompertz(t, baseline, amplitude, rate, lag):
+    with np.errstate(over="ignore", divide="ignore", invalid="ignore"):
+        return baseline + amplitude * np.exp(-np.exp(rate * np.e / amplitude * (lag - t) + 1))
+
+
+GROWTH_MODELS = {"logistic": logistic, "gompertz": gompertz}
+
+
+# Four-parameter logistic dose-response on log10 dose
+def four_parameter_logistic(log_dose, bottom, top, log_ec50, hill):
+    with np.errstate(over="ignore", invalid="ignore"):
+        return bottom + (top - bottom) / (1 + 10 ** ((log_ec50 - log_dose) * hill))
+
+
+# Function to hash the data a fit depends on, so cached fits are reused for identical curves
+def data_hash(*arrays):
+    digest = hashlib.sha256()
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        digest.update(str((array.dtype, array.shape)).encode())
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+
+# Function to order wells for fitting: replicates of the same group next to each other, in plate
+# order (row letter, then column number) within a group, so each fit can start from a neighbour
+def fitting_order(wells, groups=None):
+    def position(well):
+        match = re.match(r"^([A-Za-z]+)(\d+)$", str(well))
+        return (match.group(1).upper(), int(match.group(2))) if match else (str(well), 0)
+    groups = np.zeros(len(wells), dtype=np.int64) if groups is None else np.asarray(groups)
+    return np.array(sorted(range(len(wells)), key=lambda i: (groups[i], position(wells[i]))), dtype=np.int64)
+
+
+# Function to get the parameter bounds of a growth fit from the observed curve
+def growth_bounds(x, y):
+    span = max(x[-1] - x[0], 1e-9)
+    value_range = max(np.ptp(y), 1e-9)
+    lower = np.array([y.min() - value_range, 1e-9 * value_range, 1e-9 * value_range / span, x[0] - span])
+    upper = np.array([y.max() + value_range, 4 * value_range, 400 * value_range / span, x[-1] + span])
+    return lower, upper
+
+
+# Function to estimate starting parameters for every column of a (time, well) matrix at once:
+# baseline from the first points, amplitude from the range, rate from the steepest step and lag
+# from where that tangent leaves the baseline
+def initial_growth_parameters(times, values):
+    times = np.asarray(times, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    columns = np.arange(values.shape[1])
+
+    baseline = np.fmin.reduce(values[:max(3, len(times) // 10)], axis=0)
+    amplitude = np.fmax.reduce(values, axis=0) - baseline
+    with np.errstate(invalid="ignore", divide="ignore"):
+        slopes = np.diff(values, axis=0) / np.diff(times)[:, None]
+    steepest = np.where(np.isnan(slopes), -np.inf, slopes).argmax(axis=0)
+    rate = slopes[steepest, columns]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        lag = times[steepest] - (values[steepest, columns] - baseline) / rate
+
+    span = max(times[-1] - times[0], 1.0)
+    return np.column_stack([
+        np.nan_to_num(baseline),
+        np.where(amplitude > 0, amplitude, 1.0),
+        np.where(rate > 0, rate, 1.0 / span),
+        np.clip(np.nan_to_num(lag, nan=times[0]), times[0], times[-1]),
+    ])
+
+
+# Function to fit one curve, returning the parameters or None when the fit does not converge.
+# With bounds the bounded trust-region solver is used, otherwise Levenberg-Marquardt.
+def fit_curve(model, x, y, p0, bounds=None, max_evaluations=100):
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", OptimizeWarning)
+            # Single-precision measurements do not warrant tighter tolerances
+            if bounds is None:
+                parameters, _ = curve_fit(model, x, y, p0=p0, maxfev=4 * max_evaluations,
+                                          ftol=FIT_TOLERANCE, xtol=FIT_TOLERANCE)
+            else:
+                parameters, _ = curve_fit(model, x, y, p0=p0, bounds=bounds, max_nfev=max_evaluations,
+                                          ftol=FIT_TOLERANCE, xtol=FIT_TOLERANCE)
+    except (RuntimeError, ValueError, TypeError):
+        return None
+    return parameters if np.all(np.isfinite(parameters)) else None
+
+
+# Function to fit a growth model to a run of wells in fitting order. Each fit starts from the
+# previous well's solution when it matches this well better than the heuristic guess; the fast
+# unbounded solver is tried first and the bounded one only when it leaves the plausible range.
+# Returns the (well, parameter) array and the RMSE of each well (NaN when the fit failed).
+def fit_growth_chunk(times, values, model_name):
+    model = GROWTH_MODELS[model_name]
+    times = np.asarray(times, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    guesses = initial_growth_parameters(times, values)
+
+    parameters = np.full((values.shape[1], len(GROWTH_PARAMETERS)), np.nan)
+    rmse = np.full(values.shape[1], np.nan)
+    previous = None
+    for i in range(values.shape[1]):
+        measured = ~np.isnan(values[:, i])
+        if measured.sum() <= len(GROWTH_PARAMETERS):
+            continue
+        x, y = times[measured], values[measured, i]
+        lower, upper = growth_bounds(x, y)
+
+        starts = [guesses[i]] if previous is None else [guesses[i], previous]
+        starts = [np.clip(start, lower, upper) for start in starts]
+        p0 = min(starts, key=lambda start: np.nansum((model(x, *start) - y) ** 2))
+
+        fitted = fit_curve(model, x, y, p0)
+        if fitted is None or np.any(fitted < lower) or np.any(fitted > upper):
+            fitted = fit_curve(model, x, y, p0, bounds=(lower, upper))
+        if fitted is None:
+            continue
+
+        parameters[i] = fitted
+        rmse[i] = np.sqrt(np.mean((model(x, *fitted) - y) ** 2))
+        previous = fitted
+    return parameters, rmse
+
+
+# Function to fit a growth model to every column of a (time, well) matrix. Wells are fitted in
+# fitting order, split into contiguous chunks that run in parallel on the worker pool.
+def fit_growth_curves(times, values, wells, model_name="logistic", groups=None):
+    values = np.asarray(values, dtype=np.float32)
+    order = fitting_order(wells, groups)
+    chunks = [order[start:start + FIT_CHUNK_WELLS] for start in range(0, len(order), FIT_CHUNK_WELLS)]
+
+    if len(order) < MIN_PARALLEL_WELLS:
+        results = [fit_growth_chunk(times, values[:, chunk], model_name) for chunk in chunks]
+    else:
+        pool = get_worker_pool()
+        futures = [pool.submit(fit_growth_chunk, times, values[:, chunk], model_name) for chunk in chunks]
+        results = [future.result() for future in futures]
+
+    parameters = np.full((len(order), len(GROWTH_PARAMETERS)), np.nan)
+    rmse = np.full(len(order), np.nan)
+    for chunk, (chunk_parameters, chunk_rmse) in zip(chunks, results):
+        parameters[chunk] = chunk_parameters
+        rmse[chunk] = chunk_rmse
+    return parameters, rmse
+
+
+# Function to tabulate the fitted parameters of every well of a plate cube
+def growth_fit_table(cube, parameters, rmse):
+    treatments = np.array(cube.treatment_labels + [None], dtype=object)[cube.treatment_codes]
+    celltypes = np.array(cube.celltype_labels + [None], dtype=object)[cube.celltype_codes]
+    table = pd.DataFrame({"Well": cube.wells, "Treatment": treatments, "Cell type": celltypes})
+    for i, column in enumerate(GROWTH_PARAMETERS):
+        table[column] = parameters[:, i]
+    table["RMSE"] = rmse
+    return table
+
+
+# Function to split a treatment name into its series name and dose (in uM).
+# Treatments without a dose, e.g. "DMSO", return a dose of None.
+def parse_dose(treatment):
+    match = DOSE_PATTERN.search(str(treatment))
+    if match is None:
+        return str(treatment), None
+    dose = float(match.group(1).replace(",", ".")) * DOSE_UNITS_UM[match.group(2)]
+    series = " ".join((str(treatment)[:match.start()] + str(treatment)[match.end():]).split()).strip(" +-_")
+    return series, dose
+
+
+# Function to fit 4-parameter dose-response curves to a per-well response (e.g. AUC), one curve
+# per (treatment series, cell type) with at least four positive doses
+def fit_dose_response(responses, response_column):
+    doses = responses["Treatment"].map(parse_dose)
+    responses = responses.assign(Series=doses.str[0], Dose=doses.str[1]).dropna(subset=["Dose", response_column])
+    responses = responses[responses["Dose"] > 0]
+
+    rows = []
+    for (series, celltype), group in responses.groupby(["Series", "Cell type"], sort=True):
+        if group["Dose"].nunique() < 4:
+            continue
+        log_dose = np.log10(group["Dose"].to_numpy(dtype=np.float64))
+        y = group[response_column].to_numpy(dtype=np.float64)
+        # Start from the observed extremes and the middle of the dose range, keeping the EC50
+        # within two decades of the tested doses
+        value_range = max(np.ptp(y), 1e-9)
+        lower = [y.min() - value_range, y.min() - value_range, log_dose.min() - 2, -10]
+        upper = [y.max() + value_range, y.max() + value_range, log_dose.max() + 2, 10]
+        p0 = [y.min(), y.max(), np.median(log_dose), 1.0]
+        # There are few series, so they can afford more iterations than the per-well fits
+        fitted = fit_curve(four_parameter_logistic, log_dose, y, p0, bounds=(lower, upper), max_evaluations=1000)
+        rows.append({
+            "Series": series,
+            "Cell type": celltype,
+            "Doses": group["Dose"].nunique(),
+            "Bottom": fitted[0] if fitted is not None else np.nan,
+            "Top": fitted[1] if fitted is not None else np.nan,
+            "EC50 (uM)": 10 ** fitted[2] if fitted is not None else np.nan,
+            "Hill": fitted[3] if fitted is not None else np.nan,
+        })
+    return responses, pd.DataFrame(rows, columns=["Series", "Cell type", "Doses"] + DOSE_RESPONSE_PARAMETERS)
@@ -1,205 +1,453 @@
 import base64
+import functools
+import importlib
 import io
+
 import dash
 import dash_bootstrap_components as dbc
-import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
-from dash import dcc, html
-from dash.dependencies import Input, Output, State
-from advanced_data_loader import load_excel_tabs, process_platemap, process_microscopy_data
-import numpy as np
-
-# Initialize Dash app with the MATERIA theme
-app = dash.Dash(__name__, external_stylesheets=[dbc.themes.MATERIA])  # Changed theme to MATERIA
-
-# Define the Navbar
-navbar = dbc.NavbarSimple(
-    children=[],
-    brand="BioImaging Dashboard",
-    brand_href="#",  # Link to home or refresh
-    color="dark",  # Use a dark background for the navbar
-    dark=True,  # Set to True for light text on dark background
-    sticky="top",  # Makes the navbar stick to the top when scrolling
-    fluid=True,  # Make the navbar span the full width of the page
-    className="mb-4"  # Add bottom margin for spacing
-)
+from dash import callback, dcc, html
+from dash.dependencies import ClientsideFunction, Input, Output, State
+from background import BACKGROUND_CALLBACKS, background_options, preload_job_modules, progress_callback
+from cache import content_hash
+from chunked_upload import register_upload_routes
+from instrumentation import count_bytes, instrument, register_metrics_route, stage
+
+# Only Dash and the components are imported at startup. The data and figure modules (pandas,
+# Plotly Express, SciPy, openpyxl) load on first use: the tab builders in tabs.py on the first
+# tab update, the parsers on the first upload.
+
+
+# Function to create the Navbar
+def create_navbar():
+    return dbc.NavbarSimple(
+        children=[],
+        brand="BioImaging Dashboard",
+        brand_href="#",  # Link to home or refresh
+        color="dark",  # Use a dark background for the navbar
+        dark=True,  # Set to True for light text on dark background
+        sticky="top",  # Makes the navbar stick to the top when scrolling
+        fluid=True,  # Make the navbar span the full width of the page
+        className="mb-4"  # Add bottom margin for spacing
+    )
 
-# Define the control card
-control_card = dbc.Card(
-    [
-        dbc.CardHeader("Controls"), # Optional: Adds a header to the card
-        dbc.CardBody(
-            [
-                # File Upload Component (Moved here)
-                dcc.Upload(
-                    id="upload-data",
-                    children=html.Div([
-                        'Drag and Drop or ',
-                        html.A('Select Excel File') # More conventional text
-                    ]),
-                    style={ # Basic styling for the upload zone
-                        'width': '100%',
-                        'height': '60px',
-                        'lineHeight': '60px',
-                        'borderWidth': '1px',
-                        'borderStyle': 'dashed',
-                        'borderRadius': '5px',
-                        'textAlign': 'center',
-                        'margin-bottom': '10px'
-                    },
-                    multiple=False
-                ),
-                # Use dbc.Alert for status messages for better styling
-                dbc.Alert(id="upload-status", color="info", dismissable=True, is_open=False), # Start closed
-
-                # Accordion for selection options
-                dbc.Accordion(
-                    [
-                        dbc.AccordionItem(
-                            [
-                                # Removed the Label, RadioItems usually suffice
-                                dcc.RadioItems(
-                                    id="data_type_selector",
-                                    options=[
-                                        {"label": "Phase", "value": "phase"},
-                                        {"label": "Green", "value": "green"},
-                                        {"label": "Red", "value": "red"},
-                                        {"label": "Green/Red Ratio", "value": "ratio"}
-                                    ],
-                                    value="phase",
-                                    inputStyle={"marginRight": "5px"},
-                                    labelStyle={'display': 'block', 'marginBottom': '5px'} # Style labels
-                                )
-                            ], title="Data Type", item_id="item-data-type" # Added item_id
-                        ),
-                        dbc.AccordionItem(
-                            [
-                                # Removed the Label
-                                dcc.Checklist(
-                                    id="treatment_selector",
-                                    inputStyle={"marginRight": "5px"},
-                                    labelStyle={'display': 'block', 'marginBottom': '5px'} # Style labels
-                                 )
-                            ], title="Treatments", item_id="item-treatments" # Added item_id
-                        ),
-                        dbc.AccordionItem(
-                            [
-                                # Removed the Label
-                                dcc.Checklist(
-                                    id="celltype_selector",
-                                    inputStyle={"marginRight": "5px"},
-                                    labelStyle={'display': 'block', 'marginBottom': '5px'} # Style labels
-                                )
-                            ], title="Cell Types", item_id="item-cell-types" # Added item_id
-                        ),
-                    ],
-                    # active_item="item-treatments", # Use item_id here
-                    always_open=True, # Optional: Keep multiple sections open
-                    className="mb-3" # Margin below accordion
-                ),
-
-                # Export Format Dropdown (Moved here)
-                dbc.Label("Select Export Format:", html_for="export_format_selector", className="fw-bold"),
-                dcc.Dropdown(
-                    id="export_format_selector",
-                    options=[
-                        {"label": "SVG", "value": "svg"},
-                        {"label": "PNG", "value": "png"}
-                    ],
-                    value="svg",
-                    clearable=False
-                ),
-                dbc.Label("Export Filename:", html_for="export_filename_input", className="fw-bold mt-3"),
-                dcc.Input(
-                    id="export_filename_input",
-                    type="text",
-                    placeholder="Enter filename",
-                    value="custom_image",  # Default filename
-                    debounce=True,  # Update value only when the user stops typing
-                    style={"width": "100%"}
-                )
-            ]
-        )
-    ],
-    className="mb-4" # Margin below the card
-)
+# Function to create the control card
+def create_control_card():
+    from comparisons import P_VALUE_CORRECTIONS, STATISTICAL_TESTS
+    from heatmap import HEATMAP_NORMALIZATIONS
+    from kinetics import DEFAULT_THRESHOLD_FRACTION
+    from live import WATCH_DIR
+    from rendering import DEFAULT_MAX_POINTS
+
+    return dbc.Card(
+        [
+            dbc.CardHeader("Controls"), # Optional: Adds a header to the card
+            dbc.CardBody(
+                [
+                    # File Upload Component (Moved here)
+                    dcc.Upload(
+                        id="upload-data",
+                        children=html.Div([
+                            'Drag and Drop or ',
+                            html.A('Select Excel File') # More conventional text
+                        ]),
+                        style={ # Basic styling for the upload zone
+                            'width': '100%',
+                            'height': '60px',
+                            'lineHeight': '60px',
+                            'borderWidth': '1px',
+                            'borderStyle': 'dashed',
+                            'borderRadius': '5px',
+                            'textAlign': 'center',
+                            'margin-bottom': '10px'
+                        },
+                        multiple=False
+                    ),
+                    # Large exports are sent in chunks by assets/chunked_upload.js
+                    dbc.Button(
+                        "Upload Large File (Chunked)",
+                        id="chunked-upload-button",
+                        color="secondary",
+                        outline=True,
+                        size="sm",
+                        className="mb-2",
+                        style={"width": "100%"}
+                    ),
+                    # Project mode: many plate workbooks or directories on the server's disk
+                    dcc.Textarea(
+                        id="project_paths_input",
+                        placeholder="Project: workbook paths or directories under BIOIMAGING_PROJECT_ROOT, one per line",
+                        style={"width": "100%", "height": "60px"}
+                    ),
+                    dbc.Button(
+                        "Load Project",
+                        id="load-project-button",
+                        color="secondary",
+                        outline=True,
+                        size="sm",
+                        className="mb-2",
+                        style={"width": "100%"}
+                    ),
+                    # Live mode: exports growing in the watched directory, new timepoints are appended as they arrive
+                    dcc.Dropdown(
+                        id="live_export_selector",
+                        placeholder="Watch a live export" if WATCH_DIR else "Live mode off (set BIOIMAGING_WATCH_DIR)",
+                        disabled=not WATCH_DIR,
+                        className="mb-2"
+                    ),
+                    # Use dbc.Alert for status messages for better styling
+                    dbc.Alert(id="upload-status", color="info", dismissable=True, is_open=False), # Start closed
+
+                    # Accordion for selection options
+                    dbc.Accordion(
+                        [
+                            dbc.AccordionItem(
+                                [
+                                    # Removed the Label, RadioItems usually suffice
+                                    dcc.RadioItems(
+                                        id="data_type_selector",
+                                        options=[
+                                            {"label": "Phase", "value": "phase"},
+                                            {"label": "Green", "value": "green"},
+                                            {"label": "Red", "value": "red"},
+                                            {"label": "Green/Red Ratio", "value": "ratio"}
+                                        ],
+                                        value="phase",
+                                        inputStyle={"marginRight": "5px"},
+                                        labelStyle={'display': 'block', 'marginBottom': '5px'} # Style labels
+                                    )
+                                ], title="Data Type", item_id="item-data-type" # Added item_id
+                            ),
+                            dbc.AccordionItem(
+                                [
+                                    # Removed the Label
+                                    dcc.Checklist(
+                                        id="treatment_selector",
+                                        inputStyle={"marginRight": "5px"},
+                                        labelStyle={'display': 'block', 'marginBottom': '5px'} # Style labels
+                                     )
+                                ], title="Treatments", item_id="item-treatments" # Added item_id
+                            ),
+                            dbc.AccordionItem(
+                                [
+                                    # Removed the Label
+                                    dcc.Checklist(
+                                        id="celltype_selector",
+                                        inputStyle={"marginRight": "5px"},
+                                        labelStyle={'display': 'block', 'marginBottom': '5px'} # Style labels
+                                    )
+                                ], title="Cell Types", item_id="item-cell-types" # Added item_id
+                            ),
+                        ],
+                        # active_item="item-treatments", # Use item_id here
+                        always_open=True, # Optional: Keep multiple sections open
+                        className="mb-3" # Margin below accordion
+                    ),
+
+                    # Export Format Dropdown (Moved here)
+                    dbc.Label("Select Export Format:", html_for="export_format_selector", className="fw-bold"),
+                    dcc.Dropdown(
+                        id="export_format_selector",
+                        options=[
+                            {"label": "SVG", "value": "svg"},
+                            {"label": "PNG", "value": "png"}
+                        ],
+                        value="svg",
+                        clearable=False
+                    ),
+                    dbc.Label("Export Filename:", html_for="export_filename_input", className="fw-bold mt-3"),
+                    dcc.Input(
+                        id="export_filename_input",
+                        type="text",
+                        placeholder="Enter filename",
+                        value="custom_image",  # Default filename
+                        debounce=True,  # Update value only when the user stops typing
+                        style={"width": "100%"}
+                    ),
+                    dbc.Label("Max Points per Trace:", html_for="max_points_input", className="fw-bold mt-3"),
+                    dcc.Input(
+                        id="max_points_input",
+                        type="number",
+                        min=0,
+                        step=100,
+                        value=DEFAULT_MAX_POINTS,  # 0 keeps every timepoint
+                        debounce=True,
+                        style={"width": "100%"}
+                    ),
+                    dbc.Label("Kinetics Threshold (% of Well Max):", html_for="kinetics_threshold_input", className="fw-bold mt-3"),
+                    dcc.Input(
+                        id="kinetics_threshold_input",
+                        type="number",
+                        min=1,
+                        max=100,
+                        value=100 * DEFAULT_THRESHOLD_FRACTION,  # Used by the time-to-threshold metric
+                        debounce=True,
+                        style={"width": "100%"}
+                    ),
+                    dbc.Label("Growth Model:", html_for="growth_model_selector", className="fw-bold mt-3"),
+                    dcc.Dropdown(
+                        id="growth_model_selector",
+                        options=[
+                            {"label": "Logistic", "value": "logistic"},
+                            {"label": "Gompertz", "value": "gompertz"}
+                        ],
+                        value="logistic",
+                        clearable=False
+                    ),
+                    # Every selected treatment is tested against the control within each cell type
+                    dbc.Label("Statistics Control:", html_for="stats_control_selector", className="fw-bold mt-3"),
+                    dcc.Dropdown(
+                        id="stats_control_selector",
+                        placeholder="Control treatment",
+                        clearable=False
+                    ),
+                    dbc.Label("Statistical Test:", html_for="stats_test_selector", className="fw-bold mt-3"),
+                    dcc.Dropdown(
+                        id="stats_test_selector",
+                        options=[{"label": label, "value": value} for value, label in STATISTICAL_TESTS.items()],
+                        value="welch",
+                        clearable=False
+                    ),
+                    dbc.Label("Multiple-Testing Correction:", html_for="stats_correction_selector", className="fw-bold mt-3"),
+                    dcc.Dropdown(
+                        id="stats_correction_selector",
+                        options=[{"label": label, "value": value} for value, label in P_VALUE_CORRECTIONS.items()],
+                        value="fdr_bh",
+                        clearable=False
+                    ),
+                    # Heatmap columns are binned on the server, empty fields use the whole run and
+                    # a bin width that fits the graph
+                    dbc.Label("Heatmap Time Window (h):", html_for="heatmap_start_input", className="fw-bold mt-3"),
+                    html.Div(
+                        [
+                            dcc.Input(id="heatmap_start_input", type="number", placeholder="Start", debounce=True,
+                                      style={"width": "50%"}),
+                            dcc.Input(id="heatmap_end_input", type="number", placeholder="End", debounce=True,
+                                      style={"width": "50%"})
+                        ],
+                        style={"display": "flex"}
+                    ),
+                    dbc.Label("Heatmap Bin Width (h):", html_for="heatmap_bin_width_input", className="fw-bold mt-3"),
+                    dcc.Input(
+                        id="heatmap_bin_width_input",
+                        type="number",
+                        min=0,
+                        placeholder="Auto",
+                        debounce=True,
+                        style={"width": "100%"}
+                    ),
+                    dbc.Label("Heatmap Normalization:", html_for="heatmap_normalization_selector", className="fw-bold mt-3"),
+                    dcc.Dropdown(
+                        id="heatmap_normalization_selector",
+                        options=[{"label": label, "value": value} for value, label in HEATMAP_NORMALIZATIONS.items()],
+                        value="none",
+                        clearable=False
+                    ),
+                    dcc.Checklist(
+                        id="heatmap_cluster_selector",
+                        options=[{"label": "Cluster heatmap rows", "value": "cluster"}],
+                        value=[],
+                        inputStyle={"marginRight": "5px"},
+                        className="mt-2"
+                    ),
+                    # Wells flagged by the QC checks on the Diagnostics tab are left out of every plot
+                    dcc.Checklist(
+                        id="qc_exclude_selector",
+                        options=[{"label": "Exclude QC-flagged wells", "value": "exclude"}],
+                        value=[],
+                        inputStyle={"marginRight": "5px"},
+                        className="mt-3"
+                    )
+                ]
+            )
+        ],
+        className="mb-4" # Margin below the card
+    )
+
+# Function to create the page layout with improved scrolling behavior
+def create_layout():
+    from live import LIVE_POLL_SECONDS, WATCH_DIR
+
+    return html.Div(
+        style={
+            "height": "100vh",  # Full viewport height
+            "overflow": "auto",  # Allow scrolling when needed
+            "display": "flex",  # Use flexbox for layout
+            "flexDirection": "column",  # Stack elements vertically
+            "margin": "0",  # Remove default margins
+            "padding": "0",  # Remove default padding
+        },
+        children=[
+            create_navbar(),
+            dbc.Container(
+                [
+                    dcc.Store(id='stored-data'),  # Dataset (or project) id and file name, the data stays on the server
+                    dcc.Store(id='processed-data'),  # Dataset id of the parsed plate cube
+                    dcc.Store(id='rendered-figures'),  # What the graphs currently show, for incremental updates
+                    dcc.Store(id='chunked-upload-state'),  # Progress of the chunked upload
+                    # Polls the upload progress client-side, only while an upload is active
+                    dcc.Interval(id='chunked-upload-poll', interval=500, disabled=True),
+                    dcc.Store(id='live-update'),  # Revision of the live export after a poll appended timepoints
+                    dcc.Interval(id='live-poll', interval=LIVE_POLL_SECONDS * 1000, disabled=not WATCH_DIR),
+                    dbc.Row(
+                        [
+                            # Sidebar column
+                            dbc.Col(
+                                [
+                                    dbc.Button(
+                                        id="toggle-sidebar",
+                                        color="light",  # Use a light button to contrast with the dark background
+                                        className="mb-3",
+                                        n_clicks=0,
+                                        style={"width": "100%", "marginTop": "10px"}  # Add margin at the top
+                                    ),
+                                    html.Div(
+                                        id="sidebar-content",
+                                        children=create_control_card(),  # Default: show the control card
+                                        style={"width": "100%"}
+                                    )
+                                ],
+                                id="sidebar",
+                                width=3,  # Default width when open
+                                style={
+                                    "transition": "width 0.3s ease",
+                                    "height": "100vh",  # Make the sidebar span the full height of the viewport
+                                    "padding": "10px",  # Restore padding for better spacing
+                                    "margin": "0",  # Remove external margins
+                                    "overflow": "auto",  # Allow scrolling within the sidebar if needed
+                                }
+                            ),
+                            # Main content column
+                            dbc.Col(
+                                [
+                                    dbc.Tabs(
+                                        id="graph_tabs",
+                                        active_tab="individual",
+                                        children=[
+                                            dbc.Tab(label="Individual", tab_id="individual"),
+                                            dbc.Tab(label="Multi Plot", tab_id="multi_plot"),
+                                            dbc.Tab(label="Heatmaps", tab_id="heatmaps"),  # Move Heatmaps to the third position
+                                            dbc.Tab(label="Kinetics", tab_id="kinetics"),
+                                            dbc.Tab(label="Curve Fits", tab_id="curve_fits"),
+                                            dbc.Tab(label="Statistics", tab_id="statistics"),
+                                            dbc.Tab(label="Diagnostics", tab_id="diagnostics")  # Move Diagnostics to the last position
+                                        ],
+                                        className="mb-3"
+                                    ),
+                                    # Background callbacks report their progress, synchronous ones show a spinner
+                                    html.Div(
+                                        dbc.Progress(id="graph-progress", value=0, striped=True, animated=True),
+                                        id="graph-progress-container",
+                                        style={"display": "none"},
+                                        className="mb-3"
+                                    ),
+                                    html.Div(id="graph_content") if BACKGROUND_CALLBACKS
+                                    else dbc.Spinner(html.Div(id="graph_content"))
+                                ],
+                                id="main-content",
+                                width=9,  # Default width when sidebar is open
+                                style={"transition": "width 0.3s ease"}  # Smooth transition for width changes
+                            )
+                        ]
+                    )
+                ],
+                fluid=True,
+                style={"flex": "1", "overflow": "auto"}  # Allow scrolling when needed
+            )
+        ]
+    )
+
+
+# Function to build the layout once, on the first page load, and serve the same tree afterwards
+@functools.lru_cache(maxsize=None)
+def serve_layout():
+    return create_layout()
+
+
+# Function to register the callbacks that run in the browser
+def register_clientside_callbacks(app):
+    # Copy the chunked upload progress into a store whenever it changes, without a server round-trip.
+    # The upload button starts the polling, it stops once the upload is no longer active.
+    app.clientside_callback(
+        """
+        function(n_clicks, n_intervals, current) {
+            var noUpdate = window.dash_clientside.no_update;
+            var triggered = window.dash_clientside.callback_context.triggered.map(function (t) { return t.prop_id; });
+            if (triggered.indexOf("chunked-upload-button.n_clicks") !== -1) {
+                return [noUpdate, false];
+            }
+            var state = window.bioimagingUpload;
+            var disabled = !(state && state.active);
+            if (!state || !state.id || (current && current.version === state.version)) {
+                return [noUpdate, disabled];
+            }
+            return [state, disabled];
+        }
+        """,
+        Output("chunked-upload-state", "data"),
+        Output("chunked-upload-poll", "disabled"),
+        Input("chunked-upload-button", "n_clicks"),
+        Input("chunked-upload-poll", "n_intervals"),
+        State("chunked-upload-state", "data"),
+        prevent_initial_call=True
+    )
+
+    # Draw the plate layout frame under the slider
+    app.clientside_callback(
+        ClientsideFunction(namespace="plateLayout", function_name="renderFrame"),
+        Output("plate-layout-graph", "figure"),
+        Input("plate-layout-slider", "value"),
+        State("plate-layout-frames", "data")
+    )
+
+    # Advance the slider while the plate layout is playing
+    app.clientside_callback(
+        ClientsideFunction(namespace="plateLayout", function_name="step"),
+        Output("plate-layout-slider", "value"),
+        Input("plate-layout-interval", "n_intervals"),
+        State("plate-layout-slider", "value"),
+        State("plate-layout-frames", "data"),
+        prevent_initial_call=True
+    )
+
+    # Start and pause the plate layout animation
+    app.clientside_callback(
+        ClientsideFunction(namespace="plateLayout", function_name="togglePlay"),
+        Output("plate-layout-interval", "disabled"),
+        Output("plate-layout-play", "children"),
+        Input("plate-layout-play", "n_clicks"),
+        prevent_initial_call=True
+    )
+
+
+# Function to create the Dash app. eager=True imports the tab builders and builds the layout up
+# front, so servers that fork workers from a preloaded app (gunicorn --preload) share them. Background
+# callbacks fork a process per job, so they always start eagerly and preload what the jobs import.
+def create_app(eager=False):
+    # Initialize Dash app with the MATERIA theme
+    # The plate layout controls only exist while the Diagnostics tab is shown
+    app = dash.Dash(__name__, external_stylesheets=[dbc.themes.MATERIA],  # Changed theme to MATERIA
+                    suppress_callback_exceptions=True)
+    app.layout = serve_layout
+    register_clientside_callbacks(app)
+
+    # Resumable chunked uploads for large plate exports bypass dcc.Upload
+    register_upload_routes(app.server)
+
+    # Callback metrics in the Prometheus text format, for local scrapers
+    register_metrics_route(app.server)
+
+    if eager or BACKGROUND_CALLBACKS:
+        importlib.import_module("tabs")
+        serve_layout()
+        # Plotly imports its JSON encoder on first use, which concurrent requests would race for
+        importlib.import_module("plotly.io").to_json({})
+    if BACKGROUND_CALLBACKS:
+        preload_job_modules()
+    return app
 
-# Update the layout with improved scrolling behavior
-app.layout = html.Div(
-    style={
-        "height": "100vh",  # Full viewport height
-        "overflow": "auto",  # Allow scrolling when needed
-        "display": "flex",  # Use flexbox for layout
-        "flexDirection": "column",  # Stack elements vertically
-        "margin": "0",  # Remove default margins
-        "padding": "0",  # Remove default padding
-    },
-    children=[
-        navbar,
-        dbc.Container(
-            [
-                dcc.Store(id='stored-data'),  # For sheets data
-                dcc.Store(id='processed-data'),  # For processed treatments and celltypes
-                dbc.Row(
-                    [
-                        # Sidebar column
-                        dbc.Col(
-                            [
-                                dbc.Button(
-                                    id="toggle-sidebar",
-                                    color="light",  # Use a light button to contrast with the dark background
-                                    className="mb-3",
-                                    n_clicks=0,
-                                    style={"width": "100%", "marginTop": "10px"}  # Add margin at the top
-                                ),
-                                html.Div(
-                                    id="sidebar-content",
-                                    children=control_card,  # Default: show the control card
-                                    style={"width": "100%"}
-                                )
-                            ],
-                            id="sidebar",
-                            width=3,  # Default width when open
-                            style={
-                                "transition": "width 0.3s ease",
-                                "height": "100vh",  # Make the sidebar span the full height of the viewport
-                                "padding": "10px",  # Restore padding for better spacing
-                                "margin": "0",  # Remove external margins
-                                "overflow": "auto",  # Allow scrolling within the sidebar if needed
-                            }
-                        ),
-                        # Main content column
-                        dbc.Col(
-                            [
-                                dbc.Tabs(
-                                    id="graph_tabs",
-                                    active_tab="individual",
-                                    children=[
-                                        dbc.Tab(label="Individual", tab_id="individual"),
-                                        dbc.Tab(label="Multi Plot", tab_id="multi_plot"),
-                                        dbc.Tab(label="Heatmaps", tab_id="heatmaps"),  # Move Heatmaps to the third position
-                                        dbc.Tab(label="Diagnostics", tab_id="diagnostics")  # Move Diagnostics to the last position
-                                    ],
-                                    className="mb-3"
-                                ),
-                                dbc.Spinner(html.Div(id="graph_content"))
-                            ],
-                            id="main-content",
-                            width=9,  # Default width when sidebar is open
-                            style={"transition": "width 0.3s ease"}  # Smooth transition for width changes
-                        )
-                    ]
-                )
-            ],
-            fluid=True,
-            style={"flex": "1", "overflow": "auto"}  # Allow scrolling when needed
-        )
-    ]
-)
 
 # Callback to toggle the sidebar
-@app.callback(
+@callback(
     [Output("sidebar", "width"),
      Output("main-content", "width"),
      Output("sidebar-content", "style"),
@@ -213,7 +461,198 @@ def toggle_sidebar(n_clicks, sidebar_width):
     else:  # Even clicks: expand the sidebar
         return 3, 9, {"display": "block"}, "Hide Controls"  # Show contents, restore button text
 
-@app.callback(
+# Callback to offer every treatment of the plate as the statistics control, keeping the chosen one
+@callback(
+    [Output("stats_control_selector", "options"),
+     Output("stats_control_selector", "value")],
+    Input("treatment_selector", "options"),
+    State("stats_control_selector", "value")
+)
+def update_control_options(options, control):
+    from comparisons import default_control
+
+    treatments = [option["value"] for option in options or []]
+    return options or [], control if control in treatments else default_control(treatments)
+
+# Function to build the load_file outputs for a registered dataset
+def dataset_loaded_outputs(dataset_id, dataset, filename):
+    from datasets import available_annotations
+
+    available_treatments, available_celltypes = available_annotations(dataset)
+
+    # Only the dataset key travels to the browser, the frames stay on the server
+    stored_data = {"dataset_id": dataset_id, "filename": filename}
+    processed_data = {"dataset_id": dataset_id}
+    # Live exports also record the revision loaded, so a poll answered by any worker can tell it grew
+    if "revision" in dataset:
+        processed_data["revision"] = dataset["revision"]
+
+    return (
+        f"File '{filename}' uploaded successfully!",  # message
+        "success",  # color
+        True,  # is_open
+        [{"label": t, "value": t} for t in available_treatments],  # treatment options
+        [{"label": c, "value": c} for c in available_celltypes],  # celltype options
+        available_treatments[:1],  # selected treatment
+        available_celltypes[:1],  # selected celltype
+        stored_data,  # dataset id and file name
+        processed_data  # dataset id of the plate cube
+    )
+
+# Function to build the load_file outputs while a chunked upload is in flight or once it is done
+def chunked_upload_outputs(upload):
+    if upload.get("error"):
+        return upload["error"], "danger", True, [], [], [], [], None, None
+
+    if upload.get("done"):
+        from datasets import get_dataset
+
+        dataset = get_dataset(upload.get("datasetId"))
+        if dataset is None:
+            return "The uploaded file could not be found on the server.", "danger", True, [], [], [], [], None, None
+        return dataset_loaded_outputs(upload["datasetId"], dataset, upload["filename"])
+
+    # Show the transfer progress in the status alert
+    total = upload.get("total") or 1
+    received = upload.get("received") or 0
+    message = [
+        html.Div(f"Processing '{upload['filename']}'..." if upload.get("processing")
+                 else f"Uploading '{upload['filename']}' ({received / 1e6:.0f} / {total / 1e6:.0f} MB)"),
+        dbc.Progress(value=100 * received / total, striped=True, animated=True, className="mt-2")
+    ]
+    return (message, "info", True) + (dash.no_update,) * 6
+
+# Callback to follow a chunked upload, the Flask route has already parsed the file when it is done
+@callback(
+    [Output("upload-status", "children", allow_duplicate=True),
+     Output("upload-status", "color", allow_duplicate=True),
+     Output("upload-status", "is_open", allow_duplicate=True),
+     Output("treatment_selector", "options", allow_duplicate=True),
+     Output("celltype_selector", "options", allow_duplicate=True),
+     Output("treatment_selector", "value", allow_duplicate=True),
+     Output("celltype_selector", "value", allow_duplicate=True),
+     Output("stored-data", "data", allow_duplicate=True),
+     Output("processed-data", "data", allow_duplicate=True)],
+    Input("chunked-upload-state", "data"),
+    prevent_initial_call=True
+)
+def show_chunked_upload(chunked_upload):
+    if not chunked_upload:
+        raise dash.exceptions.PreventUpdate
+    return chunked_upload_outputs(chunked_upload)
+
+# Callback to index a multi-plate project, the plate cubes are only loaded when plotted
+@callback(
+    [Output("upload-status", "children", allow_duplicate=True),
+     Output("upload-status", "color", allow_duplicate=True),
+     Output("upload-status", "is_open", allow_duplicate=True),
+     Output("treatment_selector", "options", allow_duplicate=True),
+     Output("celltype_selector", "options", allow_duplicate=True),
+     Output("treatment_selector", "value", allow_duplicate=True),
+     Output("celltype_selector", "value", allow_duplicate=True),
+     Output("stored-data", "data", allow_duplicate=True),
+     Output("processed-data", "data", allow_duplicate=True)],
+    Input("load-project-button", "n_clicks"),
+    State("project_paths_input", "value"),
+    prevent_initial_call=True
+)
+@instrument("load_project")
+def load_project(n_clicks, paths):
+    from project import PROJECT_ROOT, create_project
+
+    # Browser users type the paths, so only the project directory configured on the server is read
+    if not PROJECT_ROOT:
+        return ("Project mode is off. Set BIOIMAGING_PROJECT_ROOT to the directory holding the plate workbooks.",
+                "warning", True, [], [], [], [], None, None)
+    paths = [path for path in (paths or "").splitlines() if path.strip()]
+    if not paths:
+        return "Enter at least one workbook path or directory.", "warning", True, [], [], [], [], None, None
+
+    try:
+        project = create_project(paths, PROJECT_ROOT)
+    except Exception as e:
+        return f"Error indexing project: {str(e)}", "danger", True, [], [], [], [], None, None
+    if not project["plates"]:
+        return "No plate workbooks found. " + " ".join(project["errors"]), "danger", True, [], [], [], [], None, None
+
+    message = f"Project with {len(project['plates'])} plates indexed."
+    if project["errors"]:
+        message += f" Skipped {len(project['errors'])}: " + "; ".join(project["errors"])
+    project_key = {"project_id": project["project_id"]}
+    return (
+        message,
+        "warning" if project["errors"] else "success",
+        True,
+        [{"label": t, "value": t} for t in project["treatments"]],
+        [{"label": c, "value": c} for c in project["celltypes"]],
+        project["treatments"][:1],
+        project["celltypes"][:1],
+        project_key,
+        project_key
+    )
+
+# Callback to list the exports of the watched directory and append the new timepoints of the live export
+# being shown. live-update only changes when the export has timepoints the browser was not told about
+# (appended by this poll, or by another worker since), update_graph then extends the figures.
+@callback(
+    [Output("live_export_selector", "options"),
+     Output("live-update", "data")],
+    Input("live-poll", "n_intervals"),
+    State("live_export_selector", "options"),
+    State("stored-data", "data"),
+    State("processed-data", "data"),
+    State("live-update", "data")
+)
+@instrument("poll_live_exports")
+def poll_live_exports(n_intervals, current_options, stored_data, processed_data, notified):
+    from live import LIVE_PREFIX, list_exports, refresh_live_dataset
+
+    options = [{"label": name, "value": LIVE_PREFIX + name} for name in list_exports()]
+    dataset_id = (stored_data or {}).get("dataset_id") or ""
+    live_update = dash.no_update
+    if dataset_id.startswith(LIVE_PREFIX):
+        with stage("poll"):
+            dataset, appended = refresh_live_dataset(dataset_id)
+        # The revision the browser has: the last one notified, otherwise the one it loaded
+        known = (notified if (notified or {}).get("dataset_id") == dataset_id else processed_data or {}).get("revision")
+        if dataset is not None and (appended or dataset["revision"] != known):
+            live_update = {"dataset_id": dataset_id, "revision": dataset["revision"]}
+    return (options if options != current_options else dash.no_update), live_update
+
+# Callback to open a live export of the watched directory, reading everything it holds so far
+@callback(
+    [Output("upload-status", "children", allow_duplicate=True),
+     Output("upload-status", "color", allow_duplicate=True),
+     Output("upload-status", "is_open", allow_duplicate=True),
+     Output("treatment_selector", "options", allow_duplicate=True),
+     Output("celltype_selector", "options", allow_duplicate=True),
+     Output("treatment_selector", "value", allow_duplicate=True),
+     Output("celltype_selector", "value", allow_duplicate=True),
+     Output("stored-data", "data", allow_duplicate=True),
+     Output("processed-data", "data", allow_duplicate=True)],
+    Input("live_export_selector", "value"),
+    prevent_initial_call=True
+)
+@instrument("load_live_export")
+def load_live_export(dataset_id):
+    if not dataset_id:
+        raise dash.exceptions.PreventUpdate
+
+    from live import LIVE_PREFIX, refresh_live_dataset
+
+    name = dataset_id[len(LIVE_PREFIX):]
+    try:
+        with stage("parse"):
+            dataset, _ = refresh_live_dataset(dataset_id)
+    except Exception as e:
+        return f"Error reading live export: {str(e)}", "danger", True, [], [], [], [], None, None
+    if dataset is None:
+        return f"The live export '{name}' cannot be read yet.", "warning", True, [], [], [], [], None, None
+
+    outputs = dataset_loaded_outputs(dataset_id, dataset, name)
+    return (f"Watching '{name}': {len(dataset['cube'].times)} timepoints so far.",) + outputs[1:]
+
+@callback(
     [Output("upload-status", "children"),
      Output("upload-status", "color"),
      Output("upload-status", "is_open"),
@@ -221,50 +660,33 @@ def toggle_sidebar(n_clicks, sidebar_width):
      Output("celltype_selector", "options"),
      Output("treatment_selector", "value"),
      Output("celltype_selector", "value"),
-     Output("stored-data", "data"),  # New output for sheets
-     Output("processed-data", "data")],  # New output for processed data
+     Output("stored-data", "data"),  # Dataset id and file name
+     Output("processed-data", "data")],  # Dataset id of the plate cube
     Input("upload-data", "contents"),
-    State("upload-data", "filename")
+    State("upload-data", "filename"),
+    # Parsing runs in a worker process when background callbacks are enabled
+    **background_options()
 )
+@instrument("load_file")
 def load_file(contents, filename):
     if contents is None:
         return dash.no_update, dash.no_update, False, \
                dash.no_update, dash.no_update, dash.no_update, \
                dash.no_update, dash.no_update, dash.no_update
 
-    content_type, content_string = contents.split(",")
-    decoded = base64.b64decode(content_string)
-    file_io = io.BytesIO(decoded)
+    with stage("decode"):
+        content_type, content_string = contents.split(",")
+        decoded = base64.b64decode(content_string)
+    count_bytes("upload", len(contents))
 
-    try:
-        # Load data
-        sheets = load_excel_tabs(file_io)
-        
-        # Process treatments and cell types
-        treatments = process_platemap(sheets.get("treatments"), "Treatment") if "treatments" in sheets else pd.DataFrame()
-        celltypes = process_platemap(sheets.get("celltypes"), "Cell type") if "celltypes" in sheets else pd.DataFrame()
-
-        available_treatments = sorted(treatments["Treatment"].dropna().unique()) if not treatments.empty else []
-        available_celltypes = sorted(celltypes["Cell type"].dropna().unique()) if not celltypes.empty else []
-
-        # Convert DataFrames to dictionaries for storage
-        stored_sheets = {name: df.to_dict('split') for name, df in sheets.items()}
-        processed_data = {
-            'treatments': treatments.to_dict('split'),
-            'celltypes': celltypes.to_dict('split')
-        }
+    from datasets import register_dataset
 
-        return (
-            f"File '{filename}' uploaded successfully!",  # message
-            "success",  # color
-            True,  # is_open
-            [{"label": t, "value": t} for t in available_treatments],  # treatment options
-            [{"label": c, "value": c} for c in available_celltypes],  # celltype options
-            available_treatments[:1],  # selected treatment
-            available_celltypes[:1],  # selected celltype
-            stored_sheets,  # stored sheets data
-            processed_data  # processed data
-        )
+    try:
+        # Re-use the parsed dataset if the same file was uploaded before
+        with stage("parse"):
+            dataset_id = content_hash(decoded)
+            dataset = register_dataset(dataset_id, io.BytesIO(decoded))
+        return dataset_loaded_outputs(dataset_id, dataset, filename)
 
     except Exception as e:
         return (
@@ -275,10 +697,10 @@ def load_file(contents, filename):
             None, None
         )
 
-
 # Callback to update the content of the tabs
-@app.callback(
-    Output("graph_content", "children"),
+@callback(
+    [Output("graph_content", "children"),
+     Output("rendered-figures", "data")],
     [
         Input("graph_tabs", "active_tab"),
         Input("treatment_selector", "value"),
@@ -286,363 +708,44 @@ def load_file(contents, filename):
         Input("data_type_selector", "value"),
         Input("export_format_selector", "value"),
         Input("export_filename_input", "value"),
+        Input("max_points_input", "value"),
+        Input("kinetics_threshold_input", "value"),
+        Input("growth_model_selector", "value"),
+        Input("heatmap_start_input", "value"),
+        Input("heatmap_end_input", "value"),
+        Input("heatmap_bin_width_input", "value"),
+        Input("heatmap_normalization_selector", "value"),
+        Input("heatmap_cluster_selector", "value"),
+        Input("stats_control_selector", "value"),
+        Input("stats_test_selector", "value"),
+        Input("stats_correction_selector", "value"),
+        Input("qc_exclude_selector", "value"),
         Input("stored-data", "data"),
-        Input("processed-data", "data")
-    ]
-)
-def update_graph(active_tab, selected_treatments, selected_celltypes, selected_data_type, export_format, export_filename, stored_data, processed_data):
-    if not stored_data or not processed_data:
-        return html.P("Please upload data first.")
-
-    # Convert stored data back to DataFrames
-    sheets = {name: pd.DataFrame(data=df_dict['data'], columns=df_dict['columns'], index=df_dict['index']) 
-              for name, df_dict in stored_data.items()}
-    treatments = pd.DataFrame(data=processed_data['treatments']['data'], 
-                              columns=processed_data['treatments']['columns'], 
-                              index=processed_data['treatments']['index'])
-    celltypes = pd.DataFrame(data=processed_data['celltypes']['data'], 
-                             columns=processed_data['celltypes']['columns'], 
-                             index=processed_data['celltypes']['index'])
-
-    if active_tab == "individual":
-        return create_individual_plot(selected_treatments, selected_celltypes, selected_data_type, 
-                                      export_format, export_filename, sheets, treatments, celltypes)
-    elif active_tab == "multi_plot":
-        return create_multi_plot(selected_treatments, selected_celltypes, selected_data_type, 
-                                 export_format, export_filename, sheets, treatments, celltypes)
-    elif active_tab == "diagnostics":
-        return create_diagnostics_content(sheets)
-    elif active_tab == "heatmaps":
-        return create_heatmap(selected_treatments, selected_celltypes, selected_data_type, sheets, treatments, celltypes, export_format, export_filename)
-
-    return html.P("Select a tab.")
-
-def generate_plot(data_type, selected_treatments, selected_celltypes, export_format, export_filename, sheets, treatments, celltypes, is_multi_plot=False):
-    # Load data
-    data_files = {
-        "phase": process_microscopy_data(sheets["phase"]) if "phase" in sheets else None,
-        "green": process_microscopy_data(sheets["green"]) if "green" in sheets else None,
-        "red": process_microscopy_data(sheets["red"]) if "red" in sheets else None,
-    }
-
-    # Compute ratio if needed
-    if "green" in sheets and "red" in sheets:
-        data_files["ratio"] = data_files["green"] / data_files["red"]
-
-    y_axis_titles = {
-        "phase": "Confluence (%)",
-        "green": "Green Fluorescence (AU)",
-        "red": "Red Fluorescence (AU)",
-        "ratio": "Green/Red Fluorescence Ratio"
-    }
-    graph_titles = {
-        "phase": "Confluence Over Time",
-        "green": "Green Fluorescence Over Time",
-        "red": "Red Fluorescence Over Time",
-        "ratio": "Green/Red Fluorescence Ratio Over Time"
-    }
-
-    config = {
-        'toImageButtonOptions': {
-            'format': export_format,
-            'filename': export_filename,
-            'scale': 2
-        }
-    }
-
-    def create_plot(data_type):
-        df = data_files.get(data_type)
-        if df is None:
-            return go.Figure(layout_title_text=f"No data available for {data_type}")
-
-        # Compute ratio if needed
-        if data_type == "ratio":
-            green_df = data_files.get("green")
-            red_df = data_files.get("red")
-            if green_df is None or red_df is None:
-                return go.Figure(layout_title_text="Green or Red data missing for Ratio calculation")
-            red_df_safe = red_df.replace(0, np.nan)
-            df = green_df / red_df_safe
-
-        # Reshape and merge data
-        df = df.reset_index().melt(id_vars=["Time"], var_name="Well", value_name="Confluence")
-        df["Well"] = df["Well"].str.strip().str.upper()
-        treatments["Well"] = treatments["Well"].str.strip().str.upper()
-        celltypes["Well"] = celltypes["Well"].str.strip().str.upper()
-
-        treatments.rename(columns={"Treatment": "Treatment"}, inplace=True)
-        celltypes.rename(columns={"Cell type": "CellType"}, inplace=True)
-
-        df = df.merge(treatments, on="Well", how="left")
-        df = df.merge(celltypes, on="Well", how="left")
-
-        if "Treatment" not in df.columns or "CellType" not in df.columns:
-            return go.Figure(layout_title_text="Missing columns: Treatment or CellType")
-
-        # Filter based on selections
-        df = df.dropna(subset=['Treatment', 'CellType'])
-        df = df[df["Treatment"].isin(selected_treatments) & df["CellType"].isin(selected_celltypes)]
-
-        grouped = df.groupby(["Time", "Treatment", "CellType"]).agg({"Confluence": ["mean", "std"]}).reset_index()
-        grouped.columns = ["Time", "Treatment", "CellType", "Mean Confluence", "Std Confluence"]
-
-        fig = go.Figure()
-        colors = px.colors.qualitative.Set1
-        color_map = {(t, c): colors[i % len(colors)] for i, (t, c) in
-                     enumerate(grouped.groupby(["Treatment", "CellType"]).groups.keys())}
-
-        for (t, c), subset in grouped.groupby(["Treatment", "CellType"]):
-            color = color_map[(t, c)]
-            fig.add_trace(go.Scatter(
-                x=subset["Time"],
-                y=subset["Mean Confluence"],
-                mode='lines',
-                name=f"{t} ({c})",
-                line=dict(color=color)
-            ))
-
-            fig.add_trace(go.Scatter(
-                x=subset["Time"].tolist() + subset["Time"].tolist()[::-1],
-                y=(subset["Mean Confluence"] + subset["Std Confluence"]).tolist() +
-                  (subset["Mean Confluence"] - subset["Std Confluence"]).tolist()[::-1],
-                fill='toself',
-                fillcolor=f'rgba({color[4:-1]},0.2)',
-                line=dict(color='rgba(255,255,255,0)'),
-                showlegend=False
-            ))
-
-        fig.update_layout(
-            title=graph_titles.get(data_type, f"{data_type.capitalize()} Over Time"),
-            xaxis_title="Time (hours)",
-            yaxis_title=y_axis_titles.get(data_type, "Value"),
-            template="simple_white",
-            legend_title_text="Treatment (Cell Type)"
-        )
-        return fig
-
-    if is_multi_plot:
-        # Prioritize the order of graphs: phase and ratio first
-        ordered_data_types = ["phase", "ratio", "green", "red"]
-        return html.Div([
-            dbc.Card(
-                [
-                    dbc.CardHeader(graph_titles.get(dt, f"{dt.capitalize()} Plot")),
-                    dbc.CardBody(
-                        dcc.Graph(figure=create_plot(dt), config=config)
-                    )
-                ],
-                className="mb-4"
-            ) for dt in ordered_data_types if data_files.get(dt) is not None
-        ], style={"display": "grid", "gridTemplateColumns": "repeat(2, 1fr)", "gap": "20px"})
-    else:
-        # Generate a single plot for individual view
-        figure_object = create_plot(data_type)
-        return dbc.Card(
-            [
-                dbc.CardHeader(graph_titles.get(data_type, f"{data_type.capitalize()} Plot")),
-                dbc.CardBody(
-                    dcc.Graph(
-                        id="confluence_graph",
-                        figure=figure_object,
-                        config=config
-                    )
-                )
-            ],
-            className="mt-3"
-        )
-
-
-# Function to create diagnostics content
-def create_diagnostics_content(sheets):
-    diagnostics = []
-
-    # Extract phase data
-    phase_data = sheets.get("phase", pd.DataFrame())
-
-    # Ensure "Time" is treated as a column
-    if phase_data.index.name is None:
-        phase_data.index.name = "Time"  # Explicitly name the index as "Time"
-    phase_data = phase_data.reset_index()  # Reset index to make "Time" a column
-
-    # Debugging: Check the structure of phase_data
-    print("Phase DataFrame structure after resetting index:")
-    print(phase_data.head())
-    print(phase_data.columns)
-
-    if "Time" not in phase_data.columns:
-        diagnostics.append(html.Div("No 'Time' column found in phase data.", className="text-danger"))
-    else:
-        # Filter rows where Time == 0
-        timepoint_0_data = phase_data[phase_data["Time"] == 0]
-
-        if timepoint_0_data.empty:
-            diagnostics.append(html.Div("No phase data available at timepoint 0.", className="text-danger"))
-        else:
-            # Drop NaN values and reshape data
-            timepoint_0_data = timepoint_0_data.drop(columns=["Time"]).dropna(axis=1)
-            melted_data = timepoint_0_data.melt(value_vars=timepoint_0_data.columns, var_name="Well", value_name="Phase Value")
-
-            # Create histogram
-            histogram_fig = px.histogram(
-                melted_data,
-                x="Phase Value",
-                nbins=200,
-                labels={"x": "Phase Value", "y": "Count"},
-                title="Cell Seeding Check: Phase Data Distribution at Timepoint 0"
-            )
-            histogram_fig.update_layout(
-                template="simple_white",
-                height=400,
-                width=1000,  # Set a fixed height for the histogram
-                margin=dict(l=40, r=20, t=40, b=40)  # Adjust margins if needed
-            )
-
-            # Create bar chart
-            bar_chart_fig = px.bar(
-                melted_data,
-                x="Well",
-                y="Phase Value",
-                labels={"Well": "Well", "Phase Value": "Phase Value"},
-                title="Phase Values Across Wells at Timepoint 0"
-            )
-            bar_chart_fig.update_layout(
-                template="simple_white",
-                xaxis=dict(tickangle=45, title=dict(standoff=10)),  # Rotate X-axis labels for compactness
-                yaxis=dict(title="Phase Value"),
-                margin=dict(l=40, r=20, t=40, b=80),  # Compact margins
-                height=300  # Compact height
-            )
-
-            # Add histogram and bar chart to diagnostics
-            diagnostics.append(
-                dbc.AccordionItem(
-                    [
-                        dcc.Graph(figure=histogram_fig),
-                        dcc.Graph(figure=bar_chart_fig)
-                    ],
-                    title="Phase Data Visualizations"
-                )
-            )
-
-    # Display available sheets
-    diagnostics.append(
-        dbc.AccordionItem(
-            [
-                html.H5("Available Sheets"),
-                html.Ul([html.Li(sheet) for sheet in sheets.keys()])
-            ],
-            title="Available Sheets"
-        )
-    )
-
-    # Wrap diagnostics in an Accordion
-    return dbc.Accordion(diagnostics, always_open=True)
-
-
-def create_individual_plot(selected_treatments, selected_celltypes, selected_data_type, export_format, export_filename, sheets, treatments, celltypes):
-    return generate_plot(selected_data_type, selected_treatments, selected_celltypes, export_format, export_filename, sheets, treatments, celltypes, is_multi_plot=False)
-
-def create_multi_plot(selected_treatments, selected_celltypes, selected_data_type, export_format, export_filename, sheets, treatments, celltypes):
-    return generate_plot(selected_data_type, selected_treatments, selected_celltypes, export_format, export_filename, sheets, treatments, celltypes, is_multi_plot=True)
-
-def create_heatmap(selected_treatments, selected_celltypes, selected_data_type, sheets, treatments, celltypes, export_format, export_filename):
-    # Load the selected data type
-    data_files = {
-        "phase": process_microscopy_data(sheets["phase"]) if "phase" in sheets else None,
-        "green": process_microscopy_data(sheets["green"]) if "green" in sheets else None,
-        "red": process_microscopy_data(sheets["red"]) if "red" in sheets else None,
-    }
-
-    # Compute ratio if needed
-    if "green" in sheets and "red" in sheets:
-        data_files["ratio"] = data_files["green"] / data_files["red"]
-
-    df = data_files.get(selected_data_type)
-    if df is None:
-        return html.P(f"No data available for {selected_data_type}.")
-
-    # Reshape and merge data
-    df = df.reset_index().melt(id_vars=["Time"], var_name="Well", value_name="Value")
-    df["Well"] = df["Well"].str.strip().str.upper()
-    treatments["Well"] = treatments["Well"].str.strip().str.upper()
-    celltypes["Well"] = celltypes["Well"].str.strip().str.upper()
-
-    treatments.rename(columns={"Treatment": "Treatment"}, inplace=True)
-    celltypes.rename(columns={"Cell type": "CellType"}, inplace=True)
-
-    df = df.merge(treatments, on="Well", how="left")
-    df = df.merge(celltypes, on="Well", how="left")
-
-    if "Treatment" not in df.columns or "CellType" not in df.columns:
-        return html.P("Missing columns: Treatment or CellType.")
-
-    # Filter based on selections
-    df = df.dropna(subset=['Treatment', 'CellType'])
-    df = df[df["Treatment"].isin(selected_treatments) & df["CellType"].isin(selected_celltypes)]
-
-    if df.empty:
-        return html.P("No data available for the selected treatments and cell types.")
-
-    # Combine Treatment and CellType into a single identifier
-    df["Treatment_CellType"] = df["Treatment"] + " (" + df["CellType"] + ")"
-
-    # Pivot the data for heatmap (flip x and y axes)
-    heatmap_data = df.pivot_table(index="Treatment_CellType", columns="Time", values="Value", aggfunc="mean")
-
-    # Reorder the rows of the heatmap to group by cell type first, then by treatment
-    combined_order = [
-        f"{treatment} ({celltype})"
-        for celltype in selected_celltypes
-        for treatment in selected_treatments
-    ]
-    heatmap_data = heatmap_data.loc[combined_order]
-
-    # Generate a proper title for the heatmap
-    data_type_titles = {
-        "phase": "Confluence",
-        "green": "Green Fluorescence",
-        "red": "Red Fluorescence",
-        "ratio": "Green/Red Ratio"
-    }
-    heatmap_title = f"{data_type_titles.get(selected_data_type, selected_data_type.capitalize())} Over Time"
-
-    # Create the heatmap
-    fig = px.imshow(
-        heatmap_data,
-        labels={"x": "Time", "y": "Treatment (CellType)", "color": data_type_titles.get(selected_data_type, selected_data_type.capitalize())},
-        color_continuous_scale="RdYlGn",  # Green-to-red color scale
-        title=heatmap_title
-    )
-    fig.update_layout(
-        template="simple_white",
-        xaxis_title="Time (hours)",
-        yaxis_title="Treatment (CellType)",
-        height=600
+        Input("processed-data", "data"),
+        Input("live-update", "data")
+    ],
+    State("rendered-figures", "data"),
+    # Figures are built in a worker process when background callbacks are enabled,
+    # a newer selection terminates the stale job
+    **background_options(
+        progress=[Output("graph-progress", "value"), Output("graph-progress", "label")],
+        progress_default=[0, ""],
+        running=[(Output("graph-progress-container", "style"), {"display": "block"}, {"display": "none"})],
+        cancel=[Input("upload-data", "contents"), Input("load-project-button", "n_clicks")]
     )
+)
+@progress_callback
+@instrument("update_graph", label=lambda set_progress, active_tab, *args: active_tab or "")
+def update_graph(set_progress, active_tab, selected_treatments, selected_celltypes, selected_data_type, export_format, export_filename, max_points, kinetics_threshold, growth_model, heatmap_start, heatmap_end, heatmap_bin_width, heatmap_normalization, heatmap_cluster, stats_control, stats_test, stats_correction, qc_exclude, stored_data, processed_data, live_update, rendered):
+    # The tab builders and the libraries they need are imported on the first update
+    from tabs import build_tab_content
 
-    # Configure download options
-    config = {
-        'toImageButtonOptions': {
-            'format': export_format,  # Use the user-selected format (e.g., 'svg', 'png')
-            'filename': export_filename,  # Use the user-provided filename
-            'scale': 2  # Adjust the scale for higher resolution
-        }
-    }
-
-    return dbc.Card(
-        [
-            dbc.CardHeader(heatmap_title),
-            dbc.CardBody(
-                dcc.Graph(
-                    id="heatmap_graph",
-                    figure=fig,
-                    config=config  # Add the config for download options
-                )
-            )
-        ],
-        className="mt-3"
-    )
+    return build_tab_content(set_progress, active_tab, selected_treatments, selected_celltypes, selected_data_type,
+                             export_format, export_filename, max_points, kinetics_threshold, growth_model,
+                             heatmap_start, heatmap_end, heatmap_bin_width, heatmap_normalization, heatmap_cluster,
+                             stats_control, stats_test, stats_correction, qc_exclude, stored_data, processed_data,
+                             live_update, rendered)
 
 
 if __name__ == "__main__":
-    app.run(debug=True)
+    create_app().run(debug=True)
@@ -0,0 +1,86 @@
+import pandas as pd
+
+from advanced_data_loader import load_dashboard_sheets, process_platemap
+from cache import dataset_cache
+from live import LIVE_PREFIX, get_live_dataset
+from plate_cube import build_plate_cube
+from shared_datasets import SHARED_DATASETS, attach_dataset, publish_dataset
+from sidecar import read_sidecar, write_sidecar
+
+
+# Function to build the dataset entry (sheet names and plate cube) from loaded sheets, the platemaps
+# only live on as the cube's annotation codes
+def build_dataset(sheets):
+    # Process treatments and cell types
+    treatments = process_platemap(sheets.get("treatments"), "Treatment") if "treatments" in sheets else pd.DataFrame()
+    celltypes = process_platemap(sheets.get("celltypes"), "Cell type") if "celltypes" in sheets else pd.DataFrame()
+
+    # Build the columnar plate cube shared by every tab
+    cube = build_plate_cube(sheets, treatments, celltypes)
+
+    return {"sheet_names": list(sheets), "cube": cube}
+
+
+# Function to parse a workbook (path or file-like object) into a dataset entry
+def parse_dataset(dataset_id, source):
+    # Re-open the binary sidecar of a known workbook, otherwise stream the XLSX once and convert it
+    sheets = read_sidecar(dataset_id)
+    if sheets is None:
+        sheets = load_dashboard_sheets(source)
+        try:
+            write_sidecar(dataset_id, sheets)
+        except OSError as e:
+            print(f"Could not write the sidecar for {dataset_id}: {e}")
+    return build_dataset(sheets)
+
+
+# Function to publish a parsed dataset for the other worker processes when datasets are shared.
+# Returns the published copy, so the parsed arrays are freed and this worker maps the same pages.
+def share_dataset(dataset_id, dataset):
+    if not SHARED_DATASETS:
+        return dataset
+    try:
+        publish_dataset(dataset_id, dataset)
+    except OSError as e:
+        print(f"Could not publish {dataset_id} for the other workers: {e}")
+        return dataset
+    return attach_dataset(dataset_id) or dataset
+
+
+# Function to register a workbook in the server-side dataset cache, parsing it only once.
+# With shared datasets a plate parsed by any worker is attached instead of parsed again.
+def register_dataset(dataset_id, source):
+    dataset = dataset_cache.get(dataset_id)
+    if dataset is None:
+        dataset = attach_dataset(dataset_id) if SHARED_DATASETS else None
+        if dataset is None:
+            dataset = share_dataset(dataset_id, parse_dataset(dataset_id, source))
+        dataset = dataset_cache.put(dataset_id, dataset)
+    return dataset
+
+
+# Function to look up a registered dataset by id, e.g. from a session's store. After a cache eviction
+# (or in another worker) the shared cube is attached or the sidecar re-opened. Live exports are read
+# from the watched directory instead. Returns None for unknown datasets.
+def get_dataset(dataset_id):
+    if not dataset_id:
+        return None
+    if dataset_id.startswith(LIVE_PREFIX):
+        return get_live_dataset(dataset_id)
+    dataset = dataset_cache.get(dataset_id)
+    if dataset is None:
+        dataset = attach_dataset(dataset_id) if SHARED_DATASETS else None
+        if dataset is None:
+            sheets = read_sidecar(dataset_id)
+            if sheets is None:
+                return None
+            dataset = share_dataset(dataset_id, build_dataset(sheets))
+        dataset = dataset_cache.put(dataset_id, dataset)
+    return dataset
+
+
+# Function to list the treatments and cell types available in a dataset
+def available_annotations(dataset):
+    # The annotation labels are the sorted categories of the platemaps
+    cube = dataset["cube"]
+    return list(cube.treatment_labels), list(cube.celltype_labels)
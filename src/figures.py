@@ -0,0 +1,167 @@
+import numpy as np
+import plotly.colors
+import plotly.graph_objects as go
+
+from aggregation import grouped_stats
+from heatmap import DEFAULT_HEATMAP_OPTIONS, HEATMAP_NORMALIZATIONS, heatmap_matrix
+from rendering import DEFAULT_MAX_POINTS, line_traces, lttb_indices, use_webgl
+
+# Titles of the line plots and heatmaps
+Y_AXIS_TITLES = {
+    "phase": "Confluence (%)",
+    "green": "Green Fluorescence (AU)",
+    "red": "Red Fluorescence (AU)",
+    "ratio": "Green/Red Fluorescence Ratio"
+}
+GRAPH_TITLES = {
+    "phase": "Confluence Over Time",
+    "green": "Green Fluorescence Over Time",
+    "red": "Red Fluorescence Over Time",
+    "ratio": "Green/Red Fluorescence Ratio Over Time"
+}
+HEATMAP_TITLES = {
+    "phase": "Confluence",
+    "green": "Green Fluorescence",
+    "red": "Red Fluorescence",
+    "ratio": "Green/Red Ratio"
+}
+
+# Prioritize the order of graphs in the Multi Plot: phase and ratio first
+MULTI_PLOT_DATA_TYPES = ["phase", "ratio", "green", "red"]
+
+
+# Function to compute grouped statistics for the selected treatments and cell types
+def selected_group_stats(cube, data_type, selected_treatments, selected_celltypes):
+    group_index = cube.group_index(cube.well_mask(selected_treatments, selected_celltypes))
+    stats = grouped_stats(cube.channel(data_type), group_index)
+    labels = [cube.group_labels(group) for group in stats["groups"]]
+    return labels, stats
+
+
+# Function to pick a group's colour, fixed by group id so patched figures keep their colours
+def group_color(group):
+    colors = plotly.colors.qualitative.Set1
+    return colors[group % len(colors)]
+
+
+# Function to build the (title, figure) pairs of a tab, or a message when there is nothing to plot
+def build_figures(active_tab, cube, data_type, selected_treatments, selected_celltypes, max_points=DEFAULT_MAX_POINTS,
+                  heatmap_options=DEFAULT_HEATMAP_OPTIONS):
+    if active_tab == "individual":
+        return [(GRAPH_TITLES.get(data_type, f"{data_type.capitalize()} Plot"),
+                 create_line_figure(cube, data_type, selected_treatments, selected_celltypes, max_points))]
+    if active_tab == "multi_plot":
+        return create_multi_line_figures(cube, selected_treatments, selected_celltypes, max_points)
+    return create_heatmap_figure(cube, data_type, selected_treatments, selected_celltypes, heatmap_options)
+
+
+# Function to create the mean +/- std line plot of a data type
+def create_line_figure(cube, data_type, selected_treatments, selected_celltypes, max_points=DEFAULT_MAX_POINTS):
+    if data_type == "ratio" and not cube.has_channel("ratio"):
+        return go.Figure(layout_title_text="Green or Red data missing for Ratio calculation")
+    if not cube.has_channel(data_type):
+        return go.Figure(layout_title_text=f"No data available for {data_type}")
+
+    labels, stats = selected_group_stats(cube, data_type, selected_treatments, selected_celltypes)
+    return line_figure(data_type, cube.times, stats["groups"], labels, stats, max_points)
+
+
+# Function to create the line plots of the Multi Plot. The selected wells and their group labels are
+# resolved once for every channel; the statistics are reduced channel by channel, which keeps the
+# float64 working copy cache-sized (a single pass over the whole cube is slower on long time courses).
+def create_multi_line_figures(cube, selected_treatments, selected_celltypes, max_points=DEFAULT_MAX_POINTS):
+    group_index = cube.group_index(cube.well_mask(selected_treatments, selected_celltypes))
+    groups = np.unique(group_index[group_index >= 0])
+    labels = [cube.group_labels(group) for group in groups]
+
+    figures = []
+    for data_type in MULTI_PLOT_DATA_TYPES:
+        if cube.has_channel(data_type):
+            stats = grouped_stats(cube.channel(data_type), group_index)
+            figures.append((GRAPH_TITLES.get(data_type, f"{data_type.capitalize()} Plot"),
+                            line_figure(data_type, cube.times, groups, labels, stats, max_points)))
+    return figures
+
+
+# Function to draw one mean +/- std line per group from grouped statistics
+def line_figure(data_type, times, groups, labels, stats, max_points=DEFAULT_MAX_POINTS):
+    fig = go.Figure()
+    # Dense figures switch to WebGL, long series are downsampled to max_points
+    webgl = use_webgl(2 * len(labels), len(times), max_points)
+    keep = lttb_indices(times, stats["mean"], max_points)
+
+    for i, (group, (t, c)) in enumerate(zip(groups, labels)):
+        fig.add_traces(line_traces(times, stats["mean"][i], stats["std"][i], f"{t} ({c})", group_color(group),
+                                   keep=keep[i], webgl=webgl))
+
+    fig.update_layout(
+        title=GRAPH_TITLES.get(data_type, f"{data_type.capitalize()} Over Time"),
+        xaxis_title="Time (hours)",
+        yaxis_title=Y_AXIS_TITLES.get(data_type, "Value"),
+        template="simple_white",
+        legend_title_text="Treatment (Cell Type)"
+    )
+    return fig
+
+
+# Function to create the (group x time bin) heatmap of a data type
+def create_heatmap_figure(cube, selected_data_type, selected_treatments, selected_celltypes,
+                          options=DEFAULT_HEATMAP_OPTIONS):
+    if not cube.has_channel(selected_data_type):
+        return f"No data available for {selected_data_type}."
+
+    labels, stats = selected_group_stats(cube, selected_data_type, selected_treatments, selected_celltypes)
+    return heatmap_figure(selected_data_type, cube.times, labels, stats["n"], stats["mean"],
+                          selected_treatments, selected_celltypes, options)
+
+
+# Function to draw the heatmap of the mean time course of each (treatment, cell type) group from its
+# per-timepoint well counts and means, binned and normalized on the server (see heatmap.py)
+def heatmap_figure(selected_data_type, times, labels, n, mean, selected_treatments, selected_celltypes,
+                   options=DEFAULT_HEATMAP_OPTIONS):
+    if not len(labels):
+        return "No data available for the selected treatments and cell types."
+
+    # Order the rows of the heatmap to group by cell type first, then by treatment,
+    # skipping combinations without any wells
+    rows = {tuple(label): i for i, label in enumerate(labels)}
+    combined_order = [
+        (treatment, celltype)
+        for celltype in selected_celltypes
+        for treatment in selected_treatments
+        if (treatment, celltype) in rows
+    ]
+    if not combined_order:
+        return "No data available for the selected treatments and cell types."
+    selected_rows = [rows[key] for key in combined_order]
+    matrix, bin_times, order = heatmap_matrix(times, np.asarray(n)[selected_rows], np.asarray(mean)[selected_rows],
+                                              options)
+    if not len(bin_times):
+        return "No timepoints in the selected time window."
+
+    # Generate a proper title for the heatmap
+    value_title = HEATMAP_TITLES.get(selected_data_type, selected_data_type.capitalize())
+    heatmap_title = f"{value_title} Over Time"
+    normalization = options[3]
+    color_title = value_title if normalization == "none" else HEATMAP_NORMALIZATIONS[normalization]
+
+    # Create the heatmap, the first row at the top
+    fig = go.Figure(go.Heatmap(
+        z=matrix[order],
+        x=bin_times,
+        y=[f"{treatment} ({celltype})" for treatment, celltype in (combined_order[i] for i in order)],
+        colorscale="RdYlGn",  # Green-to-red color scale
+        # Normalized rows diverge around their reference level
+        zmid={"baseline": 1.0, "zscore": 0.0}.get(normalization),
+        colorbar={"title": {"text": color_title}},
+        hovertemplate="Time: %{x:.2f} h<br>%{y}<br>" + color_title + ": %{z:.3g}<extra></extra>"
+    ))
+    fig.update_layout(
+        title=heatmap_title,
+        template="simple_white",
+        xaxis_title="Time (hours)",
+        yaxis_title="Treatment (CellType)",
+        yaxis_autorange="reversed",
+        height=600
+    )
+    return [(heatmap_title, fig)]
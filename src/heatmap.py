@@ -0,0 +1,118 @@
+import warnings
+
+import numpy as np
+
+# Columns a heatmap keeps at most when the bin width is automatic, about one per 4 px of a full-width graph
+HEATMAP_MAX_BINS = 300
+
+# Row normalizations of the heatmap, with the colour bar title they show
+HEATMAP_NORMALIZATIONS = {
+    "none": "None",
+    "baseline": "Relative to Baseline",
+    "zscore": "Z-score per Row",
+}
+
+# Rows are only clustered when there are at least this many
+MIN_CLUSTER_ROWS = 3
+
+
+# Function to turn the heatmap controls into a hashable tuple for the figure caches:
+# (window start, window end, bin width, normalization, cluster rows), None for the automatic values
+def heatmap_settings(start=None, end=None, bin_width=None, normalization="none", cluster=False):
+    return (
+        None if start is None else float(start),
+        None if end is None else float(end),
+        float(bin_width) if bin_width else None,
+        normalization if normalization in HEATMAP_NORMALIZATIONS else "none",
+        bool(cluster),
+    )
+
+
+DEFAULT_HEATMAP_OPTIONS = heatmap_settings()
+
+
+# Function to assign every timepoint to a time bin inside the [start, end] window. With a bin width
+# the bins are bin_width hours wide; without one every timepoint keeps its own column when the
+# window has at most max_bins of them, otherwise the window is split into max_bins equal bins.
+# Returns the bin of every timepoint (-1 outside the window) and the mean time of every bin.
+def time_bins(times, start=None, end=None, bin_width=None, max_bins=HEATMAP_MAX_BINS):
+    times = np.asarray(times, dtype=np.float64)
+    inside = np.isfinite(times)
+    if start is not None:
+        inside &= times >= start
+    if end is not None:
+        inside &= times <= end
+    if not inside.any():
+        return np.full(len(times), -1, dtype=np.int64), np.empty(0)
+
+    first = times[inside].min()
+    span = times[inside].max() - first
+    if bin_width:
+        index = np.floor((times - first) / bin_width)
+    elif inside.sum() <= max_bins or span == 0:
+        index = np.cumsum(inside) - 1
+    else:
+        index = np.minimum(np.floor((times - first) / (span / max_bins)), max_bins - 1)
+
+    # Bins without any timepoint are dropped, the heatmap columns stay dense
+    _, bins = np.unique(index[inside].astype(np.int64), return_inverse=True)
+    index = np.full(len(times), -1, dtype=np.int64)
+    index[inside] = bins
+    centres = np.bincount(bins, weights=times[inside]) / np.bincount(bins)
+    return index, centres
+
+
+# Function to average (row, time) group statistics into (row, bin) means. Every timepoint is weighted
+# by its number of measured wells, so each bin is the mean of all the measurements that fall in it.
+def binned_means(n, mean, bins):
+    inside = bins >= 0
+    n_bins = bins.max(initial=-1) + 1
+    weights = np.where(np.isnan(mean), 0.0, n)[:, inside]
+    totals = np.where(weights > 0, mean[:, inside] * weights, 0.0)
+
+    # One (time, bin) indicator matrix sums every row's timepoints into its bins at once
+    indicator = np.zeros((int(inside.sum()), n_bins))
+    indicator[np.arange(indicator.shape[0]), bins[inside]] = 1.0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (totals @ indicator) / (weights @ indicator)
+
+
+# Function to normalize every row of a heatmap: relative to its first measured bin ("baseline",
+# 1 is the starting level) or as z-scores over the row ("zscore")
+def normalize_rows(matrix, normalization):
+    with warnings.catch_warnings(), np.errstate(divide="ignore", invalid="ignore"):
+        warnings.simplefilter("ignore", RuntimeWarning)
+        if normalization == "baseline":
+            measured = ~np.isnan(matrix)
+            first = measured.argmax(axis=1)
+            baseline = matrix[np.arange(len(matrix)), first]
+            return matrix / np.where(baseline == 0, np.nan, baseline)[:, None]
+        if normalization == "zscore":
+            mean = np.nanmean(matrix, axis=1, keepdims=True)
+            std = np.nanstd(matrix, axis=1, keepdims=True)
+            return np.where(std > 0, (matrix - mean) / std, np.nan)
+    return matrix
+
+
+# Function to order the rows of a heatmap by average-linkage hierarchical clustering, so rows with
+# similar time courses sit next to each other. Missing bins are filled with the row mean.
+def cluster_order(matrix):
+    if len(matrix) < MIN_CLUSTER_ROWS:
+        return np.arange(len(matrix))
+    from scipy.cluster.hierarchy import leaves_list, linkage
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        row_means = np.nan_to_num(np.nanmean(matrix, axis=1, keepdims=True))
+    filled = np.where(np.isnan(matrix), row_means, matrix)
+    return leaves_list(linkage(filled, method="average", metric="euclidean"))
+
+
+# Function to build the heatmap of (row, time) group statistics for the given options.
+# Returns the (row, bin) matrix, the bin times and the order of the rows.
+def heatmap_matrix(times, n, mean, options=DEFAULT_HEATMAP_OPTIONS):
+    start, end, bin_width, normalization, cluster = options
+    bins, centres = time_bins(times, start, end, bin_width)
+    matrix = normalize_rows(binned_means(np.asarray(n), np.asarray(mean), bins), normalization)
+    order = cluster_order(matrix) if cluster else np.arange(len(matrix))
+    return matrix, centres, order
@@ -0,0 +1,261 @@
+import contextlib
+import contextvars
+import cProfile
+import functools
+import importlib.util
+import os
+import threading
+import time
+from collections import defaultdict, deque
+
+import numpy as np
+import plotly.io
+from flask import Response, abort, request
+
+from cache import CACHE_DIR
+
+# Record per-stage timings and payload sizes of the callbacks (opt-in, it costs an extra JSON encoding)
+INSTRUMENTATION = os.environ.get("BIOIMAGING_INSTRUMENTATION", "0") == "1"
+
+# Profile every instrumented request with "cprofile" or "pyinstrument", empty to disable
+PROFILER = os.environ.get("BIOIMAGING_PROFILER", "")
+PROFILE_DIR = os.environ.get("BIOIMAGING_PROFILE_DIR", os.path.join(CACHE_DIR, "profiles"))
+
+# Number of recent requests per (callback, tab) kept for the latency percentiles
+LATENCY_WINDOW = 500
+
+# Prometheus text endpoint, only answered for requests from this machine
+METRICS_ROUTE = "/metrics"
+LOCAL_ADDRESSES = ("127.0.0.1", "::1")
+
+# Stage timings and payload sizes of the request being handled
+current_request = contextvars.ContextVar("current_request", default=None)
+
+
+# Rolling latencies and cumulative stage/payload totals of the instrumented callbacks
+class CallbackMetrics:
+    def __init__(self, window=LATENCY_WINDOW):
+        self.window = window
+        self.latencies = defaultdict(lambda: deque(maxlen=self.window))  # (callback, tab) -> seconds
+        self.counts = defaultdict(int)
+        self.total_seconds = defaultdict(float)
+        self.stage_seconds = defaultdict(float)  # (callback, stage) -> seconds
+        self.payload_bytes = defaultdict(int)  # (callback, payload) -> bytes
+        self._lock = threading.Lock()
+        # Optional store shared with other processes, see share()
+        self.shared_store = None
+        self.shared_key = None
+
+    # Function to keep the metrics in a store shared across processes (a diskcache.Cache), so the
+    # requests handled by short-lived background callback jobs are counted together
+    def share(self, store, key):
+        self.shared_store = store
+        self.shared_key = key
+
+    # Context manager holding the lock, and with a shared store a transaction: the metrics are read
+    # from the store first and, when write is set, written back afterwards
+    @contextlib.contextmanager
+    def _synced(self, write=False):
+        with self._lock:
+            if self.shared_store is None:
+                yield
+                return
+            with self.shared_store.transact():
+                self._load(self.shared_store.get(self.shared_key) or {})
+                yield
+                if write:
+                    self.shared_store.set(self.shared_key, self._state())
+
+    # Function to get the metrics as plain (picklable) dicts
+    def _state(self):
+        return {"latencies": {key: list(latencies) for key, latencies in self.latencies.items()},
+                "counts": dict(self.counts), "total_seconds": dict(self.total_seconds),
+                "stage_seconds": dict(self.stage_seconds), "payload_bytes": dict(self.payload_bytes)}
+
+    def _load(self, state):
+        self.latencies = defaultdict(lambda: deque(maxlen=self.window), {
+            key: deque(latencies, maxlen=self.window) for key, latencies in state.get("latencies", {}).items()})
+        self.counts = defaultdict(int, state.get("counts", {}))
+        self.total_seconds = defaultdict(float, state.get("total_seconds", {}))
+        self.stage_seconds = defaultdict(float, state.get("stage_seconds", {}))
+        self.payload_bytes = defaultdict(int, state.get("payload_bytes", {}))
+
+    def record(self, callback, tab, seconds, stages, sizes):
+        with self._synced(write=True):
+            self.latencies[(callback, tab)].append(seconds)
+            self.counts[(callback, tab)] += 1
+            self.total_seconds[(callback, tab)] += seconds
+            for name, stage_seconds in stages.items():
+                self.stage_seconds[(callback, name)] += stage_seconds
+            for name, nbytes in sizes.items():
+                self.payload_bytes[(callback, name)] += nbytes
+
+    # Returns one row per (callback, tab) with the request count and latency percentiles in seconds
+    def summary(self):
+        with self._synced():
+            return [
+                {
+                    "callback": callback,
+                    "tab": tab,
+                    "count": self.counts[(callback, tab)],
+                    "p50": float(np.percentile(latencies, 50)),
+                    "p95": float(np.percentile(latencies, 95)),
+                    "max": max(latencies),
+                }
+                for (callback, tab), latencies in sorted(self.latencies.items())
+            ]
+
+    # Returns the (callback, name) -> total of the stage seconds and payload bytes
+    def totals(self):
+        with self._synced():
+            return dict(self.stage_seconds), dict(self.payload_bytes)
+
+    def prometheus(self):
+        lines = [
+            "# HELP bioimaging_callback_latency_seconds Callback latency, quantiles over the recent requests",
+            "# TYPE bioimaging_callback_latency_seconds summary",
+        ]
+        with self._synced():
+            for (callback, tab), latencies in sorted(self.latencies.items()):
+                labels = f'callback="{callback}",tab="{tab}"'
+                for quantile in (0.5, 0.95):
+                    value = np.percentile(latencies, 100 * quantile)
+                    lines.append(f'bioimaging_callback_latency_seconds{{{labels},quantile="{quantile}"}} {value:.6f}')
+                lines.append(f"bioimaging_callback_latency_seconds_sum{{{labels}}} {self.total_seconds[(callback, tab)]:.6f}")
+                lines.append(f"bioimaging_callback_latency_seconds_count{{{labels}}} {self.counts[(callback, tab)]}")
+
+            lines += [
+                "# HELP bioimaging_callback_stage_seconds_total Time spent in each stage of a callback",
+                "# TYPE bioimaging_callback_stage_seconds_total counter",
+            ]
+            lines += [f'bioimaging_callback_stage_seconds_total{{callback="{callback}",stage="{name}"}} {seconds:.6f}'
+                      for (callback, name), seconds in sorted(self.stage_seconds.items())]
+            lines += [
+                "# HELP bioimaging_callback_payload_bytes_total Bytes received or returned by a callback",
+                "# TYPE bioimaging_callback_payload_bytes_total counter",
+            ]
+            lines += [f'bioimaging_callback_payload_bytes_total{{callback="{callback}",payload="{name}"}} {nbytes}'
+                      for (callback, name), nbytes in sorted(self.payload_bytes.items())]
+        return "\n".join(lines) + "\n"
+
+
+metrics = CallbackMetrics()
+
+
+# Context manager timing one stage of the request being handled, a no-op outside instrumented callbacks
+@contextlib.contextmanager
+def stage(name):
+    timings = current_request.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings["stages"][name] += time.perf_counter() - start
+
+
+# Function to add a payload size (in bytes) to the request being handled
+def count_bytes(name, nbytes):
+    timings = current_request.get()
+    if timings is not None:
+        timings["sizes"][name] += nbytes
+
+
+# Function to measure how many bytes a callback result takes once Dash encodes it
+def payload_size(result):
+    try:
+        return len(plotly.io.json.to_json_plotly(result))
+    except (TypeError, ValueError):
+        return 0
+
+
+# Function to check the configured profiler once, falling back to no profiling when it is unknown or
+# not installed
+def configured_profiler(name):
+    if name not in ("", "cprofile", "pyinstrument"):
+        print(f"Unknown profiler {name!r}, profiling is off")
+        return ""
+    if name == "pyinstrument" and importlib.util.find_spec("pyinstrument") is None:
+        print("pyinstrument is not installed, profiling is off")
+        return ""
+    return name
+
+
+PROFILER = configured_profiler(PROFILER)
+
+
+# Function to start the configured profiler for one request. Returns None when profiling is off or
+# the profiler cannot start, e.g. while another request is being profiled (one profiler per process).
+def start_profiler():
+    try:
+        if PROFILER == "pyinstrument":
+            from pyinstrument import Profiler
+
+            profiler = Profiler()
+            profiler.start()
+            return profiler
+        if PROFILER == "cprofile":
+            profiler = cProfile.Profile()
+            profiler.enable()
+            return profiler
+    except (RuntimeError, ValueError) as e:
+        print(f"Could not start the profiler: {e}")
+    return None
+
+
+# Function to stop a profiler and write its report to PROFILE_DIR
+def save_profile(profiler, callback, tab):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    name = f"{callback}-{tab or 'all'}-{time.strftime('%Y%m%d-%H%M%S')}-{time.perf_counter_ns() % 10 ** 6:06d}"
+    if isinstance(profiler, cProfile.Profile):
+        profiler.disable()
+        profiler.dump_stats(os.path.join(PROFILE_DIR, f"{name}.prof"))
+    else:
+        profiler.stop()
+        with open(os.path.join(PROFILE_DIR, f"{name}.html"), "w") as f:
+            f.write(profiler.output_html())
+
+
+# Decorator recording the latency, stage timings and response size of a callback. label picks the
+# tab (or other breakdown) from the callback arguments. Returns the callback unchanged when off.
+def instrument(callback, label=None):
+    def decorate(func):
+        if not INSTRUMENTATION:
+            return func
+
+        @functools.wraps(func)
+        def run(*args):
+            tab = label(*args) if label else ""
+            timings = {"stages": defaultdict(float), "sizes": defaultdict(int)}
+            token = current_request.set(timings)
+            profiler = None
+            start = time.perf_counter()
+            try:
+                profiler = start_profiler()
+                result = func(*args)
+                # Dash encodes the result after the callback returns, time that too
+                with stage("json_encode"):
+                    count_bytes("response", payload_size(result))
+                return result
+            finally:
+                elapsed = time.perf_counter() - start
+                current_request.reset(token)
+                if profiler is not None:
+                    try:
+                        save_profile(profiler, callback, tab)
+                    except (OSError, RuntimeError) as e:
+                        print(f"Could not save the profile of {callback}: {e}")
+                metrics.record(callback, tab, elapsed, timings["stages"], timings["sizes"])
+        return run
+    return decorate
+
+
+# Function to serve the metrics in the Prometheus text format on the Flask server
+def register_metrics_route(server):
+    @server.route(METRICS_ROUTE)
+    def prometheus_metrics():
+        if request.remote_addr not in LOCAL_ADDRESSES:
+            abort(403)
+        return Response(metrics.prometheus(), mimetype="text/plain; version=0.0.4")
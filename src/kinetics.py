@@ -0,0 +1,139 @@
+import numpy as np
+import pandas as pd
+
+from cache import kinetics_cache
+
+# Number of consecutive timepoints in each log-linear fit used for the growth rate
+GROWTH_WINDOW = 5
+
+# Default threshold for the time-to-threshold metric, as a fraction of each well's maximum
+DEFAULT_THRESHOLD_FRACTION = 0.5
+
+# Growth rates below this (per hour) count as no growth, flat curves would otherwise get huge doubling times
+MIN_GROWTH_RATE = 1e-6
+
+# Columns of the per-well kinetics table, in display order
+KINETICS_COLUMNS = ["AUC", "Max Growth Rate (1/h)", "Doubling Time (h)", "Lag (h)", "Time to Threshold (h)"]
+
+
+# Function to integrate every column of values over time with the trapezoidal rule,
+# skipping the intervals next to missing timepoints
+def trapezoid_auc(times, values):
+    segments = np.diff(times)[:, None] * (values[1:] + values[:-1]) / 2
+    valid = ~np.isnan(segments)
+    auc = np.where(valid, segments, 0.0).sum(axis=0)
+    return np.where(valid.any(axis=0), auc, np.nan)
+
+
+# Function to fit a least-squares line to every window of consecutive timepoints of every column
+# at once, using running sums. Returns the slopes and intercepts, shaped (window position, column).
+def rolling_linear_fit(times, values, window):
+    valid = ~np.isnan(values)
+    t = np.where(valid, times[:, None], 0.0)
+    y = np.where(valid, values, 0.0)
+
+    def window_sums(a):
+        sums = np.cumsum(a, axis=0, dtype=np.float64)
+        sums = np.vstack([np.zeros((1, a.shape[1])), sums])
+        return sums[window:] - sums[:-window]
+
+    n = window_sums(valid)
+    sum_t, sum_y = window_sums(t), window_sums(y)
+    sum_tt, sum_ty = window_sums(t * t), window_sums(t * y)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        denominator = n * sum_tt - sum_t ** 2
+        slope = (n * sum_ty - sum_t * sum_y) / denominator
+        intercept = (sum_y - slope * sum_t) / n
+    # A line needs at least three points to be meaningful here
+    fitted = (n >= 3) & (denominator > 0)
+    return np.where(fitted, slope, np.nan), np.where(fitted, intercept, np.nan)
+
+
+# Function to compute the kinetics metrics of every column of a (time, well) matrix in one pass:
+# area under the curve, maximum specific growth rate (slope of ln(value)), doubling time,
+# lag (where the tangent at maximum growth crosses the initial level) and the first time the
+# value reaches threshold_fraction of the well's maximum
+def well_kinetics(times, values, threshold_fraction=DEFAULT_THRESHOLD_FRACTION, window=GROWTH_WINDOW):
+    times = np.asarray(times, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    n_times, n_wells = values.shape
+    columns = np.arange(n_wells)
+    # Shift the time origin to keep the running sums well conditioned
+    t0 = times[0] if n_times else 0.0
+    shifted = times - t0
+
+    metrics = {"AUC": trapezoid_auc(times, values) if n_times > 1 else np.full(n_wells, np.nan)}
+
+    # Maximum growth rate from sliding log-linear fits
+    with np.errstate(divide="ignore", invalid="ignore"):
+        log_values = np.log(np.where(values > 0, values, np.nan))
+    if n_times >= window:
+        slope, intercept = rolling_linear_fit(shifted, log_values, window)
+        best = np.where(np.isnan(slope), -np.inf, slope).argmax(axis=0)
+        rate = slope[best, columns]
+        rate_intercept = intercept[best, columns]
+    else:
+        rate = rate_intercept = np.full(n_wells, np.nan)
+
+    # Initial level: the first measured timepoint of each well
+    measured = ~np.isnan(log_values)
+    first = measured.argmax(axis=0)
+    initial_log = np.where(measured.any(axis=0), log_values[first, columns], np.nan)
+
+    growing = rate > MIN_GROWTH_RATE
+    with np.errstate(divide="ignore", invalid="ignore"):
+        metrics["Max Growth Rate (1/h)"] = rate
+        metrics["Doubling Time (h)"] = np.where(growing, np.log(2) / rate, np.nan)
+        lag = t0 + (initial_log - rate_intercept) / rate
+        metrics["Lag (h)"] = np.where(growing, np.maximum(lag, t0), np.nan)
+
+    # Time to threshold, linearly interpolated between the timepoints around the crossing
+    level = threshold_fraction * np.fmax.reduce(values, axis=0) if n_times else np.full(n_wells, np.nan)
+    with np.errstate(invalid="ignore"):
+        above = values >= level
+    crossing = above.argmax(axis=0)
+    before = np.maximum(crossing - 1, 0)
+    v0, v1 = values[before, columns], values[crossing, columns]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        interpolated = times[before] + (level - v0) * (times[crossing] - times[before]) / (v1 - v0)
+    time_to_threshold = np.where((crossing > 0) & ~np.isnan(interpolated), interpolated, times[crossing])
+    metrics["Time to Threshold (h)"] = np.where(above.any(axis=0), time_to_threshold, np.nan)
+
+    return metrics
+
+
+# Function to tabulate the kinetics of every well and channel of a plate cube, all channels
+# are computed together as one wide (time, channel x well) matrix
+def cube_kinetics(cube, threshold_fraction=DEFAULT_THRESHOLD_FRACTION, channels=None):
+    channels = cube.channels if channels is None else [c for c in channels if cube.has_channel(c)]
+    if channels == cube.channels:
+        values = cube.values
+    else:
+        values = np.stack([cube.channel(channel) for channel in channels]) if channels \
+            else np.empty((0, len(cube.times), len(cube.wells)), dtype=np.float32)
+    n_channels, n_times, n_wells = values.shape
+    wide = values.transpose(1, 0, 2).reshape(n_times, n_channels * n_wells)
+    metrics = well_kinetics(cube.times, wide, threshold_fraction)
+
+    treatments = np.array(cube.treatment_labels + [None], dtype=object)[cube.treatment_codes]
+    celltypes = np.array(cube.celltype_labels + [None], dtype=object)[cube.celltype_codes]
+    table = pd.DataFrame({
+        "Channel": np.repeat(channels, n_wells),
+        "Well": np.tile(cube.wells, n_channels),
+        "Treatment": np.tile(treatments, n_channels),
+        "Cell type": np.tile(celltypes, n_channels),
+    })
+    for column in KINETICS_COLUMNS:
+        table[column] = metrics[column]
+    return table
+
+
+# Function to get (or compute) the kinetics table of a dataset, every channel is computed in one
+# batch and cached, switching the data type is a lookup
+def dataset_kinetics(dataset_id, cube, threshold_fraction=DEFAULT_THRESHOLD_FRACTION):
+    key = (dataset_id, threshold_fraction)
+    table = kinetics_cache.get(key)
+    if table is None:
+        table = kinetics_cache.put(key, cube_kinetics(cube, threshold_fraction))
+    return table
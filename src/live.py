@@ -0,0 +1,316 @@
+import contextlib
+import hashlib
+import os
+import pickle
+import re
+import shutil
+import threading
+import uuid
+import zipfile
+
+import numpy as np
+
+from cache import CACHE_DIR
+
+# Local directory watched for growing plate exports, empty disables the live mode
+WATCH_DIR = os.environ.get("BIOIMAGING_WATCH_DIR", "")
+
+# Seconds between two polls of the watched directory
+LIVE_POLL_SECONDS = float(os.environ.get("BIOIMAGING_LIVE_POLL_SECONDS", "30"))
+
+# Dataset ids of live exports are this prefix followed by the export name
+LIVE_PREFIX = "live:"
+
+# Reader state of the live exports, shared by the server processes when datasets are shared
+# (gunicorn workers, background callback jobs); the cubes are published with the shared datasets
+LIVE_STATE_DIR = os.path.join(CACHE_DIR, "live")
+
+# Per-channel CSV exports are named <experiment>_<sheet>.csv (or .txt), e.g. plate1_phase.csv,
+# with the platemap grids in plate1_treatments.csv and plate1_celltypes.csv
+CSV_EXPORT_PATTERN = re.compile(r"^(?P<name>.+)_(?P<sheet>phase|green|red|treatments|celltypes)\.(csv|txt)$",
+                                re.IGNORECASE)
+CSV_CHANNELS = ("phase", "green", "red")
+
+# Errors raised by exports the imager is still writing, they are read again on the next poll
+PARTIAL_WRITE_ERRORS = (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile)
+
+
+# Raised when an export no longer continues what was read from it (rewritten, truncated or out of order)
+class ExportRewritten(Exception):
+    pass
+
+
+# Function to list the exports of the watched directory: workbooks by file name and per-channel
+# CSV exports grouped by experiment. Returns name -> {"kind": "xlsx", "path"} or {"kind": "csv", "files"}.
+def list_exports(watch_dir=WATCH_DIR):
+    if not watch_dir or not os.path.isdir(watch_dir):
+        return {}
+
+    exports = {}
+    csv_exports = {}
+    for file_name in sorted(os.listdir(watch_dir)):
+        path = os.path.join(watch_dir, file_name)
+        # Excel keeps a ~$ lock file next to open workbooks
+        if file_name.lower().endswith(".xlsx") and not file_name.startswith("~$"):
+            exports[os.path.splitext(file_name)[0]] = {"kind": "xlsx", "path": path}
+            continue
+        match = CSV_EXPORT_PATTERN.match(file_name)
+        if match:
+            csv_exports.setdefault(match["name"], {})[match["sheet"].lower()] = path
+
+    for name, files in csv_exports.items():
+        if any(sheet in files for sheet in CSV_CHANNELS):
+            exports.setdefault(name, {"kind": "csv", "files": files})
+    return exports
+
+
+# Incremental reader of one export. Each poll reads only what was appended since the previous one
+# (CSV exports from their byte offset, workbooks from their row count) and appends the timepoints
+# every channel has reached to the plate cube. With shared datasets the state is kept on disk for
+# every process: a poll first catches up with the polls of the other processes, so none of them
+# parses the whole export again, and the cube is published as a memory-mapped dataset.
+class LiveExport:
+    def __init__(self, name, export):
+        self.name = name
+        self.export = export
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.cube_id = None  # shared dataset id of the published cube
+        self.state_signature = None  # modification time and size of the shared state last read
+        self.reset()
+
+    # Forget what was read, the next poll parses the whole export again
+    def reset(self):
+        self.generation += 1
+        self.cursors = {}  # sheet -> (CSV columns, delimiter, byte offset) or (workbook header, rows read)
+        self.pending = {}  # channel -> rows read but not published, waiting for the other channels
+        self.signature = None  # sizes and modification times of the files at the last poll
+        self.dataset = None
+
+    def files(self):
+        return [self.export["path"]] if self.export["kind"] == "xlsx" else list(self.export["files"].values())
+
+    def file_signature(self):
+        return tuple((stat.st_size, stat.st_mtime_ns) for stat in map(os.stat, self.files()))
+
+    # Function to read the rows appended to every channel. Returns the new rows and the cursors
+    # to keep once they are published.
+    def read_rows(self):
+        from advanced_data_loader import read_appended_sheet_rows, read_csv_export_header, read_csv_export_rows
+
+        rows, cursors = {}, dict(self.cursors)
+        if self.export["kind"] == "xlsx":
+            rows_read = {sheet: cursor[1] for sheet, cursor in self.cursors.items()}
+            for sheet, (header, n_new, frame) in read_appended_sheet_rows(self.export["path"], rows_read).items():
+                if header is None:
+                    continue
+                if sheet in self.cursors and self.cursors[sheet][0] != header:
+                    raise ExportRewritten(sheet)
+                cursors[sheet] = (header, rows_read.get(sheet, 0) + n_new)
+                rows[sheet] = frame
+            return rows, cursors
+
+        for sheet, path in self.export["files"].items():
+            if sheet not in CSV_CHANNELS:
+                continue
+            header = read_csv_export_header(path)
+            if header is None:
+                continue
+            columns, delimiter, offset = header
+            if sheet in self.cursors:
+                if self.cursors[sheet][:2] != (columns, delimiter) or os.path.getsize(path) < self.cursors[sheet][2]:
+                    raise ExportRewritten(sheet)
+                offset = self.cursors[sheet][2]
+            rows[sheet], offset = read_csv_export_rows(path, columns, delimiter, offset)
+            cursors[sheet] = (columns, delimiter, offset)
+        return rows, cursors
+
+    # Function to read the platemaps, they are fixed for the whole acquisition
+    def platemaps(self):
+        import pandas as pd
+
+        from advanced_data_loader import PLATEMAP_SHEETS, load_dashboard_sheets
+
+        if self.export["kind"] == "xlsx":
+            return load_dashboard_sheets(self.export["path"], PLATEMAP_SHEETS)
+        return {sheet: pd.read_csv(path, index_col=0, sep=None, engine="python")
+                for sheet, path in self.export["files"].items() if sheet in PLATEMAP_SHEETS}
+
+    # Function to publish the timepoints every channel has reached: the first poll builds the dataset,
+    # later ones append to its cube. Returns True when the dataset changed.
+    def publish(self, rows, cursors):
+        import pandas as pd
+
+        from datasets import build_dataset
+        from plate_cube import append_timepoints
+
+        pending = {sheet: pd.concat([self.pending[sheet], frame]) if sheet in self.pending else frame
+                   for sheet, frame in rows.items()}
+        pending = dict(self.pending, **pending)
+        if not pending:
+            return False
+
+        cube = self.dataset["cube"] if self.dataset is not None else None
+        published = cube.times[-1] if cube is not None and len(cube.times) else -np.inf
+        if any((frame.index <= published).any() for frame in pending.values()):
+            raise ExportRewritten(self.name)
+
+        # A timepoint is published once every channel has reached it, the cube is then only appended to
+        cutoff = min(frame.index.max() if len(frame) else published for frame in pending.values())
+        ready = {}
+        for sheet, frame in pending.items():
+            frame = frame[~frame.index.duplicated()].sort_index()
+            ready[sheet] = frame[frame.index <= cutoff]
+            pending[sheet] = frame[frame.index > cutoff]
+        if cube is not None and cutoff <= published:
+            self.pending, self.cursors = pending, cursors
+            return False
+
+        if cube is None:
+            dataset = build_dataset(dict(self.platemaps(), **ready))
+        else:
+            dataset = dict(self.dataset, cube=append_timepoints(cube, ready))
+
+        # The generation tells rewrites apart in the caches
+        n_times = len(dataset["cube"].times)
+        dataset["revision"] = [self.generation, n_times]
+        dataset["revision_id"] = f"{LIVE_PREFIX}{self.name}@{self.generation}.{n_times}"
+        self.pending, self.cursors, self.dataset = pending, cursors, dataset
+        return True
+
+    # Context manager locking the shared state of the export across processes. Yields the path of
+    # the state file, None when datasets are not shared and the state lives in this process.
+    @contextlib.contextmanager
+    def shared_state(self):
+        from shared_datasets import SHARED_DATASETS
+
+        if not SHARED_DATASETS:
+            yield None
+            return
+        import fcntl
+
+        path = os.path.join(LIVE_STATE_DIR, hashlib.sha256(self.name.encode()).hexdigest()[:32])
+        os.makedirs(LIVE_STATE_DIR, exist_ok=True)
+        with open(f"{path}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield path
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    # Function to take over what another process read from the export since this one last looked
+    def load_state(self, path):
+        from shared_datasets import attach_dataset
+
+        try:
+            stat = os.stat(f"{path}.pkl")
+            if (stat.st_mtime_ns, stat.st_size) == self.state_signature:
+                return
+            with open(f"{path}.pkl", "rb") as f:
+                state = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return
+        self.state_signature = (stat.st_mtime_ns, stat.st_size)
+        if state["export"] != self.export:
+            # Written for other files, the export is read again under a new generation
+            self.generation = max(self.generation, state["generation"] + 1)
+            return
+
+        dataset = attach_dataset(state["cube_id"]) if state["cube_id"] else None
+        if state["cube_id"] and dataset is None:
+            return
+        self.generation, self.cursors, self.pending, self.signature, self.cube_id = (
+            state["generation"], state["cursors"], state["pending"], state["signature"], state["cube_id"])
+        self.dataset = None if dataset is None else dict(dataset, revision=state["revision"],
+                                                         revision_id=state["revision_id"])
+
+    # Function to share what this process read, publishing the cube when timepoints were added
+    def save_state(self, path, published):
+        from shared_datasets import publish_dataset, shared_dataset_path
+
+        previous = self.cube_id
+        if published:
+            self.cube_id = f"live-{uuid.uuid4().hex}"
+            publish_dataset(self.cube_id, self.dataset)
+        state = {"export": self.export, "generation": self.generation, "cursors": self.cursors,
+                 "pending": self.pending, "signature": self.signature, "cube_id": self.cube_id,
+                 "revision": None if self.dataset is None else self.dataset["revision"],
+                 "revision_id": None if self.dataset is None else self.dataset["revision_id"]}
+        with open(f"{path}.tmp", "wb") as f:
+            pickle.dump(state, f)
+        os.replace(f"{path}.tmp", f"{path}.pkl")
+        stat = os.stat(f"{path}.pkl")
+        self.state_signature = (stat.st_mtime_ns, stat.st_size)
+        # Processes still mapping the previous cube keep their pages until they let go of it
+        if published and previous:
+            shutil.rmtree(shared_dataset_path(previous), ignore_errors=True)
+
+    # Function to catch up with the other processes, without reading the export
+    def sync(self):
+        with self.lock, self.shared_state() as path:
+            if path is not None:
+                self.load_state(path)
+            return self.dataset
+
+    # Function to read what was appended since the last poll. Returns True when new timepoints were published.
+    def poll(self):
+        with self.lock, self.shared_state() as path:
+            if path is not None:
+                self.load_state(path)
+            try:
+                signature = self.file_signature()
+                if signature == self.signature:
+                    return False
+                try:
+                    changed = self.publish(*self.read_rows())
+                except ExportRewritten:
+                    self.reset()
+                    changed = self.publish(*self.read_rows())
+            except PARTIAL_WRITE_ERRORS as e:
+                print(f"Live export {self.name} is not readable yet: {e}")
+                return False
+            self.signature = signature
+            if path is not None:
+                try:
+                    self.save_state(path, changed)
+                except OSError as e:
+                    print(f"Could not share the live export {self.name} with the other processes: {e}")
+            return changed
+
+
+# Readers of the live exports used by this process, keyed by name
+live_exports = {}
+live_exports_lock = threading.Lock()
+
+
+# Function to get the reader of an export in the watched directory, a new one when its files changed.
+# Returns None when the export is gone.
+def live_export(name, watch_dir=WATCH_DIR):
+    exports = list_exports(watch_dir)
+    with live_exports_lock:
+        if name not in exports:
+            live_exports.pop(name, None)
+            return None
+        export = live_exports.get(name)
+        if export is None or export.export != exports[name]:
+            export = live_exports[name] = LiveExport(name, exports[name])
+    return export
+
+
+# Function to poll a live dataset. Returns the dataset (None when the export is gone or unreadable)
+# and whether new timepoints were appended.
+def refresh_live_dataset(dataset_id, watch_dir=WATCH_DIR):
+    export = live_export(dataset_id[len(LIVE_PREFIX):], watch_dir)
+    if export is None:
+        return None, False
+    appended = export.poll()
+    return export.dataset, appended
+
+
+# Function to look up a live dataset as it was last polled (by any process), reading the export on first use
+def get_live_dataset(dataset_id, watch_dir=WATCH_DIR):
+    export = live_exports.get(dataset_id[len(LIVE_PREFIX):])
+    dataset = export.sync() if export is not None else None
+    if dataset is None:
+        return refresh_live_dataset(dataset_id, watch_dir)[0]
+    return dataset
@@ -0,0 +1,162 @@
+import argparse
+import json
+import os
+import time
+import urllib.parse
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from advanced_data_loader import PLATEMAP_SHEETS, load_dashboard_sheets, process_platemap
+
+EXAMPLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Example.xlsx")
+
+# The callback every session exercises: the tab content and what the graphs show
+GRAPH_OUTPUT = "..graph_content.children...rendered-figures.data.."
+
+# Chunk size of the upload, as assets/chunked_upload.js sends it
+UPLOAD_CHUNK_BYTES = 8 * 1024 * 1024
+
+# Steps every session repeats, like a user clicking through the dashboard: the changed input and
+# the tab shown. Selection changes drop the last treatment, or add it back.
+SESSION_STEPS = [
+    ("graph_tabs.active_tab", "individual"),
+    ("treatment_selector.value", "individual"),
+    ("graph_tabs.active_tab", "multi_plot"),
+    ("treatment_selector.value", "multi_plot"),
+    ("graph_tabs.active_tab", "heatmaps"),
+    ("graph_tabs.active_tab", "kinetics"),
+]
+
+
+# Function to send a request to the server and decode its JSON answer
+def request_json(url, data=None, method=None, content_type="application/json"):
+    request = urllib.request.Request(url, data=data, method=method, headers={"Content-Type": content_type})
+    with urllib.request.urlopen(request, timeout=300) as response:
+        body = response.read()
+    return json.loads(body), len(body)
+
+
+# Function to upload a workbook through the chunked upload route. Returns its dataset id.
+def upload_workbook(url, path):
+    upload_id = uuid.uuid4().hex
+    total = os.path.getsize(path)
+    with open(path, "rb") as f:
+        for offset in range(0, total, UPLOAD_CHUNK_BYTES):
+            query = urllib.parse.urlencode({"offset": offset, "total": total, "filename": os.path.basename(path)})
+            state, _ = request_json(f"{url}/upload/{upload_id}?{query}", f.read(UPLOAD_CHUNK_BYTES), "POST",
+                                    "application/octet-stream")
+    if not state["done"]:
+        raise RuntimeError(state["error"] or "The upload did not complete")
+    return state["dataset_id"]
+
+
+# Function to read the treatments and cell types of a workbook, as the upload callback lists them
+def workbook_annotations(path):
+    sheets = load_dashboard_sheets(path, PLATEMAP_SHEETS)
+    return [list(process_platemap(sheets[name], value_name)[value_name].cat.categories)
+            if name in sheets else [] for name, value_name in (("treatments", "Treatment"), ("celltypes", "Cell type"))]
+
+
+# Function to find the inputs and states of the graph callback in the app's dependency list
+def graph_callback(url):
+    dependencies, _ = request_json(f"{url}/_dash-dependencies")
+    callback = next(dependency for dependency in dependencies if dependency["output"] == GRAPH_OUTPUT)
+    outputs = [dict(zip(("id", "property"), output.rsplit(".", 1))) for output in GRAPH_OUTPUT.strip(".").split("...")]
+    return outputs, callback["inputs"], callback["state"]
+
+
+# Function to run one session: a browser that references the dataset by id and clicks through the
+# steps, sending back what the graphs show like the dcc.Store does. Returns the latency and
+# response size of every request and the number of failed ones.
+def run_session(url, callback, dataset_id, treatments, celltypes, n_requests):
+    outputs, inputs, states = callback
+    values = {
+        "treatment_selector.value": treatments,
+        "celltype_selector.value": celltypes,
+        "data_type_selector.value": "phase",
+        "export_format_selector.value": "svg",
+        "export_filename_input.value": "custom_image",
+        "max_points_input.value": 1000,
+        "kinetics_threshold_input.value": 50,
+        "growth_model_selector.value": "logistic",
+        "heatmap_normalization_selector.value": "none",
+        "heatmap_cluster_selector.value": [],
+        "qc_exclude_selector.value": [],
+        "stored-data.data": {"dataset_id": dataset_id, "filename": "loadtest"},
+        "processed-data.data": {"dataset_id": dataset_id},
+    }
+
+    latencies, sizes, errors = [], [], 0
+    for i in range(n_requests):
+        changed, tab = SESSION_STEPS[i % len(SESSION_STEPS)]
+        values["graph_tabs.active_tab"] = tab
+        if changed == "treatment_selector.value":
+            selected = values["treatment_selector.value"]
+            values["treatment_selector.value"] = treatments if len(selected) < len(treatments) else treatments[:-1]
+
+        payload = {
+            "output": GRAPH_OUTPUT,
+            "outputs": outputs,
+            "inputs": [dict(item, value=values.get(f"{item['id']}.{item['property']}")) for item in inputs],
+            "state": [dict(item, value=values.get(f"{item['id']}.{item['property']}")) for item in states],
+            "changedPropIds": [changed],
+        }
+        start = time.perf_counter()
+        try:
+            result, size = request_json(f"{url}/_dash-update-component", json.dumps(payload).encode())
+        except OSError:
+            errors += 1
+            continue
+        latencies.append(time.perf_counter() - start)
+        sizes.append(size)
+        # Keep what the graphs show for the next request, unless the callback left it unchanged
+        rendered = result.get("response", {}).get("rendered-figures")
+        if rendered is not None:
+            values["rendered-figures.data"] = rendered["data"]
+    return latencies, sizes, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the throughput of a running dashboard with concurrent sessions")
+    parser.add_argument("--url", nargs="+", default=["http://127.0.0.1:8050"],
+                        help="Server URLs, sessions are spread over them round-robin (e.g. one per worker)")
+    parser.add_argument("--workbook", default=EXAMPLE_PATH, help="Workbook uploaded once and shared by every session")
+    parser.add_argument("--sessions", type=int, default=8, help="Concurrent sessions")
+    parser.add_argument("--requests", type=int, default=24, help="Graph updates sent by each session")
+    parser.add_argument("--min-throughput", type=float, default=0, help="Fail below this many requests per second")
+    args = parser.parse_args()
+    urls = [url.rstrip("/") for url in args.url]
+
+    # Every session references the same dataset by id, whichever server it talks to
+    dataset_id = upload_workbook(urls[0], args.workbook)
+    treatments, celltypes = workbook_annotations(args.workbook)
+    callback = graph_callback(urls[0])
+    print(f"Dataset {dataset_id[:12]}: {len(treatments)} treatments, {len(celltypes)} cell types")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.sessions) as executor:
+        sessions = list(executor.map(
+            lambda i: run_session(urls[i % len(urls)], callback, dataset_id, treatments, celltypes, args.requests),
+            range(args.sessions)))
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array([latency for session in sessions for latency in session[0]])
+    sizes = [size for session in sessions for size in session[1]]
+    errors = sum(session[2] for session in sessions)
+    throughput = len(latencies) / elapsed
+    print(f"{'sessions':<28}{args.sessions:10d}")
+    print(f"{'requests':<28}{len(latencies):10d}  ({errors} failed)")
+    print(f"{'throughput':<28}{throughput:10.1f} req/s")
+    if len(latencies):
+        print(f"{'latency p50':<28}{np.percentile(latencies, 50) * 1000:10.1f} ms")
+        print(f"{'latency p95':<28}{np.percentile(latencies, 95) * 1000:10.1f} ms")
+        print(f"{'response size (mean)':<28}{np.mean(sizes) / 1e3:10.1f} kB")
+    if errors or throughput < args.min_throughput:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
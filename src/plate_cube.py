@@ -0,0 +1,179 @@
+import functools
+
+import numpy as np
+import pandas as pd
+
+from advanced_data_loader import normalize_wells, process_microscopy_data
+from plate_layout import plate_geometry
+
+# Microscopy channels read from the workbook, in cube order
+MICROSCOPY_CHANNELS = ["phase", "green", "red"]
+
+
+# Function to integer-code a platemap annotation by well, from the categorical columns of
+# process_platemap (well identifiers are already normalized)
+def encode_annotation(platemap, value_name, wells):
+    if platemap is None or platemap.empty or value_name not in platemap.columns:
+        return np.full(len(wells), -1, dtype=np.int32), []
+
+    # Annotation code of every platemap well, the first entry wins for repeated wells
+    well_codes = platemap["Well"].cat.codes.to_numpy()
+    annotation_codes = platemap[value_name].cat.codes.to_numpy()
+    _, first = np.unique(well_codes, return_index=True)
+    codes_by_well = np.full(len(platemap["Well"].cat.categories), -1, dtype=np.int32)
+    codes_by_well[well_codes[first]] = annotation_codes[first]
+
+    # Wells without an annotation get code -1
+    positions = platemap["Well"].cat.categories.get_indexer(wells)
+    codes = np.where(positions >= 0, codes_by_well[positions], -1).astype(np.int32)
+    return codes, list(platemap[value_name].cat.categories)
+
+
+# Columnar view of a whole plate: one float32 value per (channel, time, well)
+class PlateCube:
+    def __init__(self, channels, times, wells, values, treatment_codes, treatment_labels,
+                 celltype_codes, celltype_labels):
+        self.channels = list(channels)
+        self.times = np.asarray(times)
+        self.wells = np.asarray(wells)
+        self.values = values  # shape (channel, time, well)
+        self.treatment_codes = treatment_codes  # shape (well,), -1 when unannotated
+        self.treatment_labels = list(treatment_labels)
+        self.celltype_codes = celltype_codes  # shape (well,), -1 when unannotated
+        self.celltype_labels = list(celltype_labels)
+        self._channel_index = {name: i for i, name in enumerate(self.channels)}
+
+    @property
+    def nbytes(self):
+        return int(self.values.nbytes + self.times.nbytes + self.wells.nbytes
+                   + self.treatment_codes.nbytes + self.celltype_codes.nbytes)
+
+    # Plate format and the 0-based (row, column) of every well, parsed once per cube:
+    # (n_rows, n_cols, rows, cols) with -1 for wells that are not plate positions
+    @functools.cached_property
+    def geometry(self):
+        return plate_geometry(self.wells)
+
+    @property
+    def n_groups(self):
+        return len(self.treatment_labels) * len(self.celltype_labels)
+
+    def has_channel(self, channel):
+        return channel in self._channel_index
+
+    # Returns the (time, well) matrix of a channel
+    def channel(self, channel):
+        return self.values[self._channel_index[channel]]
+
+    # Boolean mask of the wells matching the selected treatments and cell types
+    def well_mask(self, selected_treatments, selected_celltypes):
+        treatment_codes = [self.treatment_labels.index(t) for t in selected_treatments or []
+                           if t in self.treatment_labels]
+        celltype_codes = [self.celltype_labels.index(c) for c in selected_celltypes or []
+                          if c in self.celltype_labels]
+        return np.isin(self.treatment_codes, treatment_codes) & np.isin(self.celltype_codes, celltype_codes)
+
+    # Group id (treatment code * n_celltypes + celltype code) per well, -1 outside the mask
+    def group_index(self, mask=None):
+        groups = self.treatment_codes * len(self.celltype_labels) + self.celltype_codes
+        annotated = (self.treatment_codes >= 0) & (self.celltype_codes >= 0)
+        if mask is not None:
+            annotated &= mask
+        return np.where(annotated, groups, -1).astype(np.int32)
+
+    # Returns a cube without the masked wells: their values stay but their annotations are dropped,
+    # so every grouping skips them
+    def without_wells(self, mask):
+        cube = PlateCube(self.channels, self.times, self.wells, self.values,
+                         np.where(mask, -1, self.treatment_codes).astype(np.int32), self.treatment_labels,
+                         np.where(mask, -1, self.celltype_codes).astype(np.int32), self.celltype_labels)
+        if "geometry" in self.__dict__:
+            cube.geometry = self.geometry
+        return cube
+
+    # Returns the (treatment, cell type) labels of a group id
+    def group_labels(self, group):
+        treatment_code, celltype_code = divmod(int(group), len(self.celltype_labels))
+        return self.treatment_labels[treatment_code], self.celltype_labels[celltype_code]
+
+
+# Function to parse the microscopy sheets into (time, well) frames with normalized, unique wells
+def channel_frames(sheets):
+    frames = {}
+    for channel in MICROSCOPY_CHANNELS:
+        if channel in sheets:
+            frame = process_microscopy_data(sheets[channel])
+            frame.columns = normalize_wells(frame.columns)
+            frames[channel] = frame.loc[:, ~frame.columns.duplicated()]
+    return frames
+
+
+# Function to compute the green/red ratio of a (channel, time, well) block in place,
+# zero red signal has no defined ratio
+def fill_ratio(values, channels):
+    if "ratio" in channels:
+        green = values[channels.index("green")]
+        red = values[channels.index("red")]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            values[channels.index("ratio")] = np.where(red == 0, np.nan, green / red)
+
+
+# Function to build the plate cube once per upload
+def build_plate_cube(sheets, treatments, celltypes):
+    frames = channel_frames(sheets)
+
+    # Align every channel on the union of timepoints and wells
+    times = pd.Index([])
+    wells = pd.Index([])
+    for frame in frames.values():
+        times = times.union(frame.index) if len(times) else frame.index
+        wells = wells.append(frame.columns.difference(wells, sort=False)) if len(wells) else frame.columns
+
+    channels = list(frames)
+    if "green" in frames and "red" in frames:
+        channels.append("ratio")
+
+    values = np.full((len(channels), len(times), len(wells)), np.nan, dtype=np.float32)
+    for i, channel in enumerate(frames):
+        values[i] = frames[channel].reindex(index=times, columns=wells).to_numpy(dtype=np.float32)
+
+    # Compute the green/red ratio up front
+    fill_ratio(values, channels)
+
+    treatment_codes, treatment_labels = encode_annotation(treatments, "Treatment", wells)
+    celltype_codes, celltype_labels = encode_annotation(celltypes, "Cell type", wells)
+
+    return PlateCube(channels, times.to_numpy(), wells.to_numpy(dtype=object), values,
+                     treatment_codes, treatment_labels, celltype_codes, celltype_labels)
+
+
+# Function to append the rows of new timepoints (microscopy sheets holding only times after the
+# cube's last one) to a cube. The values live in a buffer with spare timepoints that grows
+# geometrically, so appending copies only the new rows; earlier cubes keep viewing their own
+# timepoints. Returns the new cube, wells and annotations are shared.
+def append_timepoints(cube, sheets):
+    frames = channel_frames(sheets)
+    times = pd.Index([])
+    for frame in frames.values():
+        times = times.union(frame.index) if len(times) else frame.index
+    if not len(times):
+        return cube
+
+    n_old = len(cube.times)
+    n = n_old + len(times)
+    buffer = getattr(cube, "_buffer", None)
+    if buffer is None or buffer.shape[1] < n:
+        buffer = np.full((len(cube.channels), max(n, 2 * n_old), len(cube.wells)), np.nan, dtype=np.float32)
+        buffer[:, :n_old] = cube.values
+
+    block = buffer[:, n_old:n]
+    for channel, frame in frames.items():
+        block[cube.channels.index(channel)] = frame.reindex(index=times, columns=cube.wells).to_numpy(dtype=np.float32)
+    fill_ratio(block, cube.channels)
+
+    appended = PlateCube(cube.channels, np.concatenate([cube.times, times.to_numpy()]), cube.wells, buffer[:, :n],
+                         cube.treatment_codes, cube.treatment_labels, cube.celltype_codes, cube.celltype_labels)
+    appended._buffer = buffer
+    if "geometry" in cube.__dict__:
+        appended.geometry = cube.geometry
+    return appended
@@ -0,0 +1,80 @@
+import base64
+import re
+
+import numpy as np
+
+# Standard plate formats as (rows, columns), smallest first
+PLATE_FORMATS = [(8, 12), (16, 24), (32, 48)]
+
+# Frames are quantized to 16 bits over the channel's value range, the top code marks empty wells
+FRAME_EMPTY_CODE = 65535
+FRAME_LEVELS = FRAME_EMPTY_CODE - 1
+
+WELL_PATTERN = re.compile(r"^([A-Z]+)(\d+)$")
+
+
+# Function to convert a well's row letters to a 0-based index (A -> 0, Z -> 25, AA -> 26, ...)
+def row_index(letters):
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter) - ord("A") + 1
+    return index - 1
+
+
+# Function to convert a 0-based row index back to its letters
+def row_letters(index):
+    letters = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord("A") + remainder) + letters
+    return letters
+
+
+# Function to place wells on the smallest standard plate that holds them.
+# Returns (n_rows, n_cols, row of each well, column of each well), -1 for unparseable wells.
+def plate_geometry(wells):
+    rows = np.full(len(wells), -1, dtype=np.int32)
+    cols = np.full(len(wells), -1, dtype=np.int32)
+    for i, well in enumerate(wells):
+        match = WELL_PATTERN.match(str(well))
+        if match:
+            rows[i] = row_index(match.group(1))
+            cols[i] = int(match.group(2)) - 1
+
+    n_rows, n_cols = rows.max(initial=-1) + 1, cols.max(initial=-1) + 1
+    for format_rows, format_cols in PLATE_FORMATS:
+        if n_rows <= format_rows and n_cols <= format_cols:
+            return format_rows, format_cols, rows, cols
+    return int(n_rows), int(n_cols), rows, cols
+
+
+# Function to precompute every timepoint of a channel on the plate grid as one compact array:
+# (time, row, column) values quantized to uint16 and base64-encoded, played back in the browser
+def plate_frames(dataset_id, cube, channel):
+    n_rows, n_cols, rows, cols = cube.geometry
+    placed = rows >= 0
+    values = cube.channel(channel)[:, placed]
+
+    finite = values[np.isfinite(values)]
+    zmin, zmax = (float(finite.min()), float(finite.max())) if finite.size else (0.0, 1.0)
+    scale = (zmax - zmin) / FRAME_LEVELS or 1.0
+
+    frames = np.full((len(cube.times), n_rows * n_cols), FRAME_EMPTY_CODE, dtype="<u2")
+    with np.errstate(invalid="ignore"):
+        codes = np.rint((values - zmin) / scale)
+    frames[:, rows[placed] * n_cols + cols[placed]] = np.where(np.isfinite(codes), codes, FRAME_EMPTY_CODE)
+
+    return {
+        "key": f"{dataset_id}-{channel}",
+        "channel": channel,
+        "times": cube.times.tolist(),
+        "rows": int(n_rows),
+        "cols": int(n_cols),
+        "row_labels": [row_letters(i) for i in range(n_rows)],
+        "col_labels": [str(i + 1) for i in range(n_cols)],
+        "zmin": zmin,
+        "scale": scale,
+        "empty": FRAME_EMPTY_CODE,
+        "frames": base64.b64encode(frames.tobytes()).decode("ascii"),
+    }
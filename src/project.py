@@ -0,0 +1,233 @@
+import concurrent.futures
+import hashlib
+import json
+import os
+
+import openpyxl
+import pandas as pd
+
+from advanced_data_loader import (MICROSCOPY_SHEETS, PLATEMAP_SHEETS, annotation_sort_key, normalize_wells, process_platemap,
+                                  sheet_to_frame)
+from aggregation import grouped_stats, merge_grouped_stats
+from cache import LRUCache
+from datasets import register_dataset
+from kinetics import cube_kinetics
+from qc import qc_filtered_cube
+from sidecar import SIDECAR_DIR
+from workers import get_worker_pool
+
+# Project indexes are small, they are kept in memory and written next to the sidecars
+PROJECT_CACHE_ENTRIES = 16
+PROJECT_DIR = os.path.join(SIDECAR_DIR, "projects")
+
+# Indexes of the registered projects, keyed by project id
+project_cache = LRUCache(max_entries=PROJECT_CACHE_ENTRIES)
+
+# Directory the project paths typed in the dashboard are resolved under. Any browser user can type
+# them, so the dashboard's project mode is off unless a root is set and reads nothing outside it.
+PROJECT_ROOT = os.environ.get("BIOIMAGING_PROJECT_ROOT", "")
+
+
+# Function to identify a plate workbook by path, size and modification time, without reading it
+def plate_id(path):
+    stat = os.stat(path)
+    key = f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+# Function to resolve a path under a root directory, relative paths are taken from the root. Raises
+# ValueError when the path lies outside the root once symlinks and ".." are followed.
+def resolve_under_root(path, root):
+    root = os.path.realpath(root)
+    resolved = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, resolved]) != root:
+        raise ValueError(f"{path} is outside the project directory")
+    return resolved
+
+
+# Function to expand workbook paths and directories into the list of plate workbooks. With a root,
+# the paths and the workbooks found in directories must all lie under it.
+def find_workbooks(paths, root=None):
+    workbooks = []
+    for path in paths:
+        path = path.strip()
+        if not path:
+            continue
+        path = resolve_under_root(path, root) if root else os.path.expanduser(path)
+        if os.path.isdir(path):
+            # Skip the lock files Excel leaves next to open workbooks
+            workbooks.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                             if name.lower().endswith(".xlsx") and not name.startswith("~$"))
+        else:
+            workbooks.append(path)
+    if root:
+        workbooks = [resolve_under_root(workbook, root) for workbook in workbooks]
+    return list(dict.fromkeys(workbooks))
+
+
+# Function to index one plate: its platemaps and the header of its microscopy sheets,
+# the timepoint rows are not read
+def index_plate(path):
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        platemaps = {name: sheet_to_frame(workbook[name].iter_rows(values_only=True))
+                     for name in PLATEMAP_SHEETS if name in workbook.sheetnames}
+        channels = [name for name in MICROSCOPY_SHEETS if name in workbook.sheetnames]
+
+        wells = set()
+        timepoints = 0
+        for channel in channels:
+            sheet = workbook[channel]
+            header = next(sheet.iter_rows(max_row=1, values_only=True), ())
+            wells.update(normalize_wells([well for well in header[1:] if well is not None]))
+            # The sheet dimension gives the row count when the export records it
+            if sheet.max_row:
+                timepoints = max(timepoints, sheet.max_row - 1)
+    finally:
+        workbook.close()
+
+    if "green" in channels and "red" in channels:
+        channels.append("ratio")
+
+    # (treatment, cell type) combinations present on the plate
+    groups = []
+    if "treatments" in platemaps and "celltypes" in platemaps:
+        treatments = process_platemap(platemaps["treatments"], "Treatment")
+        celltypes = process_platemap(platemaps["celltypes"], "Cell type")
+        wells_groups = pd.merge(treatments, celltypes, on="Well")
+        groups = sorted({(t, c) for t, c in zip(wells_groups["Treatment"], wells_groups["Cell type"])},
+                        key=lambda group: tuple(map(annotation_sort_key, group)))
+
+    return {
+        "plate_id": plate_id(path),
+        "path": os.path.abspath(path),
+        "name": os.path.basename(path),
+        "channels": channels,
+        "wells": len(wells),
+        "timepoints": timepoints,
+        "groups": [list(group) for group in groups],
+    }
+
+
+# Function to build the index of a project from workbook paths and directories (under root, when given)
+def create_project(paths, root=None):
+    workbooks = find_workbooks(paths, root)
+    plates, errors = [], []
+    futures = {get_worker_pool().submit(index_plate, path): path for path in workbooks}
+    for future in concurrent.futures.as_completed(futures):
+        try:
+            plates.append(future.result())
+        except Exception as e:
+            errors.append(f"{os.path.basename(futures[future])}: {e}")
+    plates.sort(key=lambda plate: plate["path"])
+
+    project_id = hashlib.sha256("".join(plate["plate_id"] for plate in plates).encode()).hexdigest()
+    project = {
+        "project_id": project_id,
+        "plates": plates,
+        "treatments": sorted({t for plate in plates for t, _ in plate["groups"]}, key=annotation_sort_key),
+        "celltypes": sorted({c for plate in plates for _, c in plate["groups"]}, key=annotation_sort_key),
+        "channels": [channel for channel in MICROSCOPY_SHEETS + ["ratio"]
+                     if any(channel in plate["channels"] for plate in plates)],
+        "errors": sorted(errors),
+    }
+    save_project(project)
+    return project_cache.put(project_id, project)
+
+
+# Function to persist a project index, so other processes (e.g. background callbacks) find it
+def save_project(project):
+    os.makedirs(PROJECT_DIR, exist_ok=True)
+    path = os.path.join(PROJECT_DIR, f"{project['project_id']}.json")
+    staging = f"{path}.{os.getpid()}.tmp"
+    with open(staging, "w") as f:
+        json.dump(project, f)
+    os.replace(staging, path)
+
+
+# Function to look up a project index. Returns None for unknown projects.
+def get_project(project_id):
+    if not project_id:
+        return None
+    project = project_cache.get(project_id)
+    if project is None:
+        path = os.path.join(PROJECT_DIR, f"{project_id}.json")
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            project = project_cache.put(project_id, json.load(f))
+    return project
+
+
+# Function to list the plates holding at least one of the selected (treatment, cell type) groups
+def plates_with_groups(project, selected_treatments, selected_celltypes):
+    selected = {(t, c) for t in selected_treatments or [] for c in selected_celltypes or []}
+    return [plate for plate in project["plates"] if any(tuple(group) in selected for group in plate["groups"])]
+
+
+# Function to load a plate cube in a project worker (parsed once, then from its sidecar),
+# optionally without its QC-flagged wells
+def plate_cube(plate, exclude_flagged=False):
+    cube = register_dataset(plate["plate_id"], plate["path"])["cube"]
+    return qc_filtered_cube(plate["plate_id"], cube) if exclude_flagged else cube
+
+
+# Function to run in a project worker: reduce the selected wells of a plate to per-group n,
+# mean and std for each data type
+def plate_group_stats(plate, data_types, selected_treatments, selected_celltypes, exclude_flagged=False):
+    cube = plate_cube(plate, exclude_flagged)
+    group_index = cube.group_index(cube.well_mask(selected_treatments, selected_celltypes))
+
+    parts = {}
+    for data_type in data_types:
+        if not cube.has_channel(data_type):
+            continue
+        stats = grouped_stats(cube.channel(data_type), group_index)
+        parts[data_type] = {
+            "keys": [cube.group_labels(group) for group in stats["groups"]],
+            "axis": cube.times,
+            "n": stats["n"],
+            "mean": stats["mean"],
+            "std": stats["std"],
+        }
+    return parts
+
+
+# Function to aggregate the selected groups across all plates of a project, one worker task per
+# plate. Returns the merged statistics of each data type, keyed by (treatment, cell type).
+def project_group_stats(project, data_types, selected_treatments, selected_celltypes, exclude_flagged=False):
+    plates = plates_with_groups(project, selected_treatments, selected_celltypes)
+    pool = get_worker_pool()
+    futures = [pool.submit(plate_group_stats, plate, data_types, selected_treatments, selected_celltypes,
+                           exclude_flagged)
+               for plate in plates]
+    results = [future.result() for future in futures]
+
+    return {
+        data_type: merge_grouped_stats([parts[data_type] for parts in results if data_type in parts])
+        for data_type in data_types
+        if any(data_type in parts for parts in results)
+    }
+
+
+# Function to run in a project worker: tabulate the kinetics of the selected wells of one plate
+def plate_kinetics(plate, data_type, selected_treatments, selected_celltypes, threshold_fraction,
+                   exclude_flagged=False):
+    cube = plate_cube(plate, exclude_flagged)
+    if not cube.has_channel(data_type):
+        return None
+    table = cube_kinetics(cube, threshold_fraction, channels=[data_type])
+    table = table[table["Treatment"].isin(selected_treatments) & table["Cell type"].isin(selected_celltypes)]
+    return table.assign(Plate=plate["name"])
+
+
+# Function to tabulate the kinetics of the selected wells across all plates of a project
+def project_kinetics(project, data_type, selected_treatments, selected_celltypes, threshold_fraction,
+                     exclude_flagged=False):
+    plates = plates_with_groups(project, selected_treatments, selected_celltypes)
+    pool = get_worker_pool()
+    futures = [pool.submit(plate_kinetics, plate, data_type, selected_treatments, selected_celltypes, threshold_fraction,
+                           exclude_flagged)
+               for plate in plates]
+    tables = [table for table in (future.result() for future in futures) if table is not None]
+    return pd.concat(tables, ignore_index=True) if tables else None
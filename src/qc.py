@@ -0,0 +1,197 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from aggregation import grouped_stats
+from cache import qc_cache
+
+# Measured channels checked by QC, the ratio is derived from green and red
+QC_CHANNELS = ["phase", "green", "red"]
+
+# Channels read by a detector that can saturate
+SATURATION_CHANNELS = ["green", "red"]
+
+# Scales the MAD to the standard deviation of normally distributed replicates
+MAD_SCALE = 1.4826
+
+# Wells whose median robust z-score over the time course exceeds this are outliers
+OUTLIER_Z = 3.5
+
+# Replicate groups need this many wells before one of them can be called an outlier
+MIN_REPLICATES = 3
+
+# The MAD is floored to this fraction of the group median, identical replicates would flag any noise
+MIN_RELATIVE_MAD = 0.01
+
+# A timepoint dropping below this fraction of both neighbours counts as a focus dropout, when the
+# neighbours are above DROPOUT_MIN_LEVEL of the well's maximum (noise near background is not a dropout)
+DROPOUT_FRACTION = 0.5
+DROPOUT_MIN_LEVEL = 0.1
+
+# Wells at the channel's ceiling on at least this many timepoints are saturated
+SATURATION_MIN_TIMEPOINTS = 2
+
+# Edge-minus-interior difference and end-to-end row/column gradient (relative to the group
+# medians) above which the plate is flagged
+EDGE_EFFECT_THRESHOLD = 0.1
+GRADIENT_THRESHOLD = 0.1
+
+# Suffix of the dataset key of a cube without its flagged wells, so its caches stay separate
+QC_EXCLUDED_SUFFIX = ":qc-excluded"
+
+# Columns of the per-well QC table, in display order
+QC_WELL_COLUMNS = ["Robust Z", "Dropouts", "Saturated Timepoints"]
+QC_PLATE_COLUMNS = ["Edge Effect", "Row Gradient", "Column Gradient"]
+
+
+# Function to broadcast the median of each replicate group back to its wells, for a (..., well)
+# array. Wells outside a group get NaN.
+def group_medians(values, group_index):
+    medians = np.full(values.shape, np.nan)
+    stats = grouped_stats(values, group_index, quantiles=True)
+    grouped = np.flatnonzero(group_index >= 0)
+    if len(grouped):
+        rows = np.searchsorted(stats["groups"], group_index[grouped])
+        medians[..., grouped] = np.moveaxis(stats["median"][rows], 0, -1)
+    return medians
+
+
+# Function to compute the median over the time axis, all-NaN wells give NaN without a warning
+def time_median(values):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return np.nanmedian(values, axis=-2)
+
+
+# Function to compute the robust z-score of every well against the median and MAD of its replicate
+# group, for a (..., time, well) array. Wells outside a group or in small groups get NaN.
+def robust_z_scores(values, group_index, median=None):
+    group_index = np.asarray(group_index)
+    median = group_medians(values, group_index) if median is None else median
+    mad = group_medians(np.abs(values - median), group_index)
+    mad = np.maximum(mad, MIN_RELATIVE_MAD * np.abs(median))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = (values - median) / (MAD_SCALE * mad)
+
+    # Only annotated wells count as replicates, unannotated wells (-1) belong to no group
+    grouped = group_index >= 0
+    counts = np.zeros(len(group_index), dtype=np.int64)
+    counts[grouped] = np.bincount(group_index[grouped])[group_index[grouped]]
+    return np.where(grouped & (counts >= MIN_REPLICATES), z, np.nan)
+
+
+# Function to count the focus dropouts of every well of a (..., time, well) array: interior
+# timepoints that fall below DROPOUT_FRACTION of both neighbours or are missing between two values
+def dropout_counts(values):
+    if values.shape[-2] < 3:
+        return np.zeros(values.shape[:-2] + values.shape[-1:], dtype=np.int64)
+    previous, current, following = values[..., :-2, :], values[..., 1:-1, :], values[..., 2:, :]
+    neighbours = np.fmin(previous, following)
+    with warnings.catch_warnings(), np.errstate(invalid="ignore"):
+        warnings.simplefilter("ignore", RuntimeWarning)
+        level = DROPOUT_MIN_LEVEL * np.nanmax(values, axis=-2, keepdims=True)
+        dip = (current < DROPOUT_FRACTION * neighbours) & (neighbours > level)
+    gap = np.isnan(current) & ~np.isnan(previous) & ~np.isnan(following)
+    return (dip | gap).sum(axis=-2)
+
+
+# Function to count the timepoints each well spends at the channel's ceiling, for a (time, well) matrix
+def saturation_counts(values):
+    if not np.isfinite(values).any():
+        return np.zeros(values.shape[-1], dtype=np.int64)
+    ceiling = np.nanmax(values)
+    with np.errstate(invalid="ignore"):
+        return (values >= ceiling).sum(axis=0)
+
+
+# Function to measure plate effects from the per-well relative deviation from the group median:
+# the edge-minus-interior difference and the change across the plate along rows and columns
+def plate_effects(relative, rows, cols, n_rows, n_cols):
+    effects = dict.fromkeys(QC_PLATE_COLUMNS, np.nan)
+    placed = (rows >= 0) & np.isfinite(relative)
+    if not placed.any():
+        return effects
+
+    edge = placed & ((rows == 0) | (rows == n_rows - 1) | (cols == 0) | (cols == n_cols - 1))
+    interior = placed & ~edge
+    if edge.any() and interior.any():
+        effects["Edge Effect"] = float(np.median(relative[edge]) - np.median(relative[interior]))
+
+    # Least-squares slope along each axis, scaled to the distance from the first to the last row/column
+    for name, position, size in (("Row Gradient", rows, n_rows), ("Column Gradient", cols, n_cols)):
+        x = position[placed].astype(np.float64)
+        if np.ptp(x) > 0:
+            slope = np.cov(x, relative[placed], bias=True)[0, 1] / np.var(x)
+            effects[name] = float(slope * (size - 1))
+    return effects
+
+
+# Function to run every QC check on a plate cube. Returns the per-well table (one row per channel
+# and well), the per-channel plate effects table and a boolean mask of the wells flagged in any channel.
+def cube_qc(cube):
+    channels = [channel for channel in QC_CHANNELS if cube.has_channel(channel)]
+    n_wells = len(cube.wells)
+    values = np.stack([cube.channel(channel) for channel in channels]) if channels \
+        else np.empty((0, len(cube.times), n_wells), dtype=np.float32)
+    group_index = cube.group_index()
+
+    # Robust z-scores per timepoint, summarized per well by the median over the time course
+    median = group_medians(values, group_index)
+    well_z = time_median(robust_z_scores(values, group_index, median))
+    outliers = np.abs(well_z) > OUTLIER_Z
+
+    dropouts = dropout_counts(values)
+    saturated = np.zeros_like(dropouts)
+    for i, channel in enumerate(channels):
+        if channel in SATURATION_CHANNELS:
+            saturated[i] = saturation_counts(values[i])
+
+    flags = np.full((len(channels), n_wells), "", dtype=object)
+    for name, flagged in (("outlier", outliers), ("dropout", dropouts > 0),
+                          ("saturated", saturated >= SATURATION_MIN_TIMEPOINTS)):
+        flags = np.where(flagged, np.where(flags == "", name, flags + ", " + name), flags)
+
+    treatments = np.array(cube.treatment_labels + [None], dtype=object)[cube.treatment_codes]
+    celltypes = np.array(cube.celltype_labels + [None], dtype=object)[cube.celltype_codes]
+    wells = pd.DataFrame({
+        "Channel": np.repeat(channels, n_wells),
+        "Well": np.tile(cube.wells, len(channels)),
+        "Treatment": np.tile(treatments, len(channels)),
+        "Cell type": np.tile(celltypes, len(channels)),
+        "Robust Z": well_z.ravel(),
+        "Dropouts": dropouts.ravel(),
+        "Saturated Timepoints": saturated.ravel(),
+        "Flags": flags.ravel(),
+    })
+
+    # Plate effects on the well medians relative to their group, outlier wells left out
+    n_rows, n_cols, rows, cols = cube.geometry
+    with np.errstate(divide="ignore", invalid="ignore"):
+        relative = time_median((values - median) / np.abs(median))
+    relative[outliers] = np.nan
+
+    plate = pd.DataFrame([dict(Channel=channel, **plate_effects(relative[i], rows, cols, n_rows, n_cols))
+                          for i, channel in enumerate(channels)], columns=["Channel"] + QC_PLATE_COLUMNS)
+    plate["Flags"] = [
+        ", ".join(name.lower() for name, limit in (("Edge Effect", EDGE_EFFECT_THRESHOLD),
+                                                   ("Row Gradient", GRADIENT_THRESHOLD),
+                                                   ("Column Gradient", GRADIENT_THRESHOLD))
+                  if abs(row[name]) > limit)
+        for _, row in plate.iterrows()
+    ]
+
+    return {"wells": wells, "plate": plate, "flagged": (flags != "").any(axis=0)}
+
+
+# Function to run (or look up) the QC of a dataset
+def dataset_qc(dataset_id, cube):
+    result = qc_cache.get(dataset_id)
+    if result is None:
+        result = qc_cache.put(dataset_id, cube_qc(cube))
+    return result
+
+
+# Function to get the cube of a dataset without its QC-flagged wells
+def qc_filtered_cube(dataset_id, cube):
+    return cube.without_wells(dataset_qc(dataset_id, cube)["flagged"])
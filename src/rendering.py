@@ -0,0 +1,84 @@
+import numpy as np
+import plotly.graph_objects as go
+
+# Default number of points kept per trace, roughly the pixel width of a graph
+DEFAULT_MAX_POINTS = 1000
+
+# Figures with more points than this are drawn with WebGL (go.Scattergl)
+WEBGL_POINT_THRESHOLD = 5000
+
+
+# Function to pick the indices kept by largest-triangle-three-buckets downsampling.
+# y holds one series per row sharing the x axis, so every series is reduced in the same
+# pass over the buckets. Returns one row of n_out indices per series (first and last kept).
+def lttb_indices(x, y, n_out):
+    y = np.atleast_2d(np.asarray(y, dtype=np.float64))
+    n_series, n = y.shape
+    if not n_out or n_out < 3 or n <= n_out:
+        return np.tile(np.arange(n), (n_series, 1))
+
+    x = np.asarray(x, dtype=np.float64)
+    valid = ~np.isnan(y)
+    filled = np.where(valid, y, 0.0)
+    rows = np.arange(n_series)
+
+    # Split the inner points into n_out - 2 buckets
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    selected = np.empty((n_series, n_out), dtype=np.int64)
+    selected[:, 0] = 0
+    selected[:, -1] = n - 1
+
+    previous = np.zeros(n_series, dtype=np.int64)
+    for i in range(n_out - 2):
+        start, stop = edges[i], edges[i + 1]
+
+        # The next bucket's average (or the last point) is the third corner of the triangle
+        next_stop = edges[i + 2] if i + 2 < len(edges) else n
+        with np.errstate(invalid="ignore", divide="ignore"):
+            next_x = x[stop:next_stop].mean()
+            next_y = filled[:, stop:next_stop].sum(axis=1) / valid[:, stop:next_stop].sum(axis=1)
+
+        # Keep the point that forms the largest triangle with the previous pick, never a NaN
+        previous_x = x[previous][:, None]
+        previous_y = y[rows, previous][:, None]
+        areas = np.abs(
+            (previous_x - next_x) * (y[:, start:stop] - previous_y)
+            - (previous_x - x[start:stop]) * (next_y[:, None] - previous_y)
+        )
+        previous = start + np.argmax(np.where(np.isnan(areas), -1.0, areas), axis=1)
+        selected[:, i + 1] = previous
+
+    return selected
+
+
+# Function to build the mean line and std band traces of one group, keeping only the
+# timepoints listed in keep
+def line_traces(x, mean, std, name, color, keep=None, webgl=False):
+    if keep is not None:
+        x, mean, std = np.asarray(x)[keep], mean[keep], std[keep]
+    scatter = go.Scattergl if webgl else go.Scatter
+
+    line = scatter(
+        x=x,
+        y=mean,
+        mode='lines',
+        name=name,
+        line=dict(color=color)
+    )
+
+    # The band runs forward along mean + std and back along mean - std
+    band = scatter(
+        x=np.concatenate([x, x[::-1]]),
+        y=np.concatenate([mean + std, (mean - std)[::-1]]),
+        fill='toself',
+        fillcolor=f'rgba({color[4:-1]},0.2)',
+        line=dict(color='rgba(255,255,255,0)'),
+        showlegend=False
+    )
+    return line, band
+
+
+# Function to decide whether a figure should be drawn with WebGL
+def use_webgl(n_traces, n_points, max_points=DEFAULT_MAX_POINTS):
+    points_per_trace = min(n_points, max_points) if max_points else n_points
+    return n_traces * points_per_trace > WEBGL_POINT_THRESHOLD
@@ -0,0 +1,154 @@
+import argparse
+import os
+import re
+import time
+
+from plotly.subplots import make_subplots
+
+from datasets import register_dataset
+from figures import build_figures
+from project import find_workbooks, plate_id
+from qc import qc_filtered_cube
+from workers import WORKERS, get_worker_pool
+
+# Tabs rendered by the report, in dashboard order
+REPORT_TABS = ["individual", "multi_plot", "heatmaps"]
+REPORT_FORMATS = ["svg", "png", "html"]
+
+# Data types of the Individual and Heatmap figures, the Multi Plot always shows every channel
+REPORT_DATA_TYPES = ["phase", "green", "red", "ratio"]
+
+# Height of each row of the stacked Multi Plot
+MULTI_PLOT_ROW_HEIGHT = 450
+
+
+# Function to turn a figure title into a file name
+def slugify(title):
+    return re.sub(r"[^a-z0-9]+", "_", title.lower()).strip("_")
+
+
+# Function to stack the figures of the Multi Plot into one figure, one row per data type
+def multi_plot_figure(figures):
+    fig = make_subplots(rows=len(figures), cols=1, subplot_titles=[title for title, _ in figures],
+                        vertical_spacing=0.3 / len(figures))
+    for row, (_, figure) in enumerate(figures, start=1):
+        for trace in figure.data:
+            # Every row repeats the same groups, only the first one is listed in the legend
+            fig.add_trace(trace.update(showlegend=trace.showlegend is not False and row == 1), row=row, col=1)
+        fig.update_yaxes(title_text=figure.layout.yaxis.title.text, row=row, col=1)
+    fig.update_xaxes(title_text="Time (hours)", row=len(figures), col=1)
+    fig.update_layout(template="simple_white", height=MULTI_PLOT_ROW_HEIGHT * len(figures),
+                      legend_title_text="Treatment (Cell Type)")
+    return fig
+
+
+# Function to list the (file name, figure) pairs of a tab for every requested data type
+def report_figures(cube, tab, data_types, max_points):
+    treatments, celltypes = cube.treatment_labels, cube.celltype_labels
+    if tab == "multi_plot":
+        figures = build_figures(tab, cube, None, treatments, celltypes, max_points)
+        return [("multi_plot", multi_plot_figure(figures))] if figures else []
+
+    named = []
+    for data_type in data_types:
+        if not cube.has_channel(data_type):
+            continue
+        figures = build_figures(tab, cube, data_type, treatments, celltypes, max_points)
+        # Heatmaps without any group come back as a message
+        if not isinstance(figures, str):
+            named.extend((f"{tab}_{data_type}", figure) for _, figure in figures)
+    return named
+
+
+# Function to run in a report worker: parse one workbook (once, then from its sidecar), build every
+# figure of the requested tabs and write them in each format. Returns the files and the step timings.
+def render_workbook(path, output_dir, formats, tabs, data_types, max_points, exclude_flagged=False):
+    timings = {}
+    start = time.perf_counter()
+    dataset_id = plate_id(path)
+    cube = register_dataset(dataset_id, path)["cube"]
+    if exclude_flagged:
+        cube = qc_filtered_cube(dataset_id, cube)
+    timings["parse"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    figures = [named for tab in tabs for named in report_figures(cube, tab, data_types, max_points)]
+    timings["build"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    workbook_dir = os.path.join(output_dir, slugify(os.path.splitext(os.path.basename(path))[0]))
+    os.makedirs(workbook_dir, exist_ok=True)
+    files = []
+    for name, figure in figures:
+        for export_format in formats:
+            file = os.path.join(workbook_dir, f"{name}.{export_format}")
+            if export_format == "html":
+                figure.write_html(file, include_plotlyjs="cdn")
+            else:
+                figure.write_image(file, format=export_format, scale=2)
+            files.append(file)
+    timings["write"] = time.perf_counter() - start
+
+    return {"path": path, "files": files, "timings": timings}
+
+
+# Function to render the reports of many workbooks in the worker pool, one task per workbook
+def render_reports(paths, output_dir, formats, tabs, data_types, max_points, exclude_flagged=False):
+    workbooks = find_workbooks(paths)
+    pool = get_worker_pool()
+    futures = {pool.submit(render_workbook, path, output_dir, formats, tabs, data_types, max_points,
+                           exclude_flagged): path for path in workbooks}
+
+    results = []
+    for future, path in futures.items():
+        try:
+            result = future.result()
+        except Exception as e:
+            result = {"path": path, "error": str(e)}
+        results.append(result)
+    return results
+
+
+# Function to print the per-workbook timings and the totals
+def print_summary(results, elapsed):
+    print(f"{'Workbook':<40}{'Parse':>9}{'Build':>9}{'Write':>9}{'Files':>7}")
+    totals = {"parse": 0.0, "build": 0.0, "write": 0.0}
+    for result in results:
+        name = os.path.basename(result["path"])[:38]
+        if "error" in result:
+            print(f"{name:<40}  failed: {result['error']}")
+            continue
+        timings = result["timings"]
+        for step in totals:
+            totals[step] += timings[step]
+        print(f"{name:<40}{timings['parse']:8.2f}s{timings['build']:8.2f}s{timings['write']:8.2f}s"
+              f"{len(result['files']):7d}")
+
+    done = [result for result in results if "error" not in result]
+    print(f"{'Total (worker time)':<40}{totals['parse']:8.2f}s{totals['build']:8.2f}s{totals['write']:8.2f}s"
+          f"{sum(len(result['files']) for result in done):7d}")
+    print(f"{len(done)}/{len(results)} workbooks in {elapsed:.2f}s wall time ({WORKERS} workers)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render the dashboard figures of many workbooks without the UI")
+    parser.add_argument("paths", nargs="+", help="Workbooks or directories of workbooks")
+    parser.add_argument("--output-dir", default="reports", help="One sub-directory per workbook is written here")
+    parser.add_argument("--formats", nargs="+", choices=REPORT_FORMATS, default=["svg"])
+    parser.add_argument("--tabs", nargs="+", choices=REPORT_TABS, default=REPORT_TABS)
+    parser.add_argument("--data-types", nargs="+", choices=REPORT_DATA_TYPES, default=REPORT_DATA_TYPES)
+    parser.add_argument("--max-points", type=int, default=0, help="Points kept per trace, 0 keeps every timepoint")
+    parser.add_argument("--exclude-flagged", action="store_true", help="Leave out the wells flagged by QC")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    results = render_reports(args.paths, args.output_dir, args.formats, args.tabs, args.data_types,
+                             args.max_points, args.exclude_flagged)
+    print_summary(results, time.perf_counter() - start)
+    # Nightly runs should notice failed workbooks
+    if not results or any("error" in result for result in results):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from cache import CACHE_DIR, prune_disk_cache, touch_disk_cache_entry
+from plate_cube import PlateCube
+
+# Publish every parsed plate cube as memory-mapped .npy files, so all server worker processes attach
+# the same pages instead of parsing and holding the plate once each (opt-in, for multi-worker serving;
+# on by default with background callbacks, whose jobs each run in a new process)
+SHARED_DATASETS = os.environ.get("BIOIMAGING_SHARED_DATASETS",
+                                 os.environ.get("BIOIMAGING_BACKGROUND_CALLBACKS", "0")) == "1"
+
+# Directory holding the published cubes, on a local disk shared by the workers
+SHARED_DATASET_DIR = os.environ.get("BIOIMAGING_SHARED_DATASET_DIR", os.path.join(CACHE_DIR, "shared"))
+
+# Bump when the on-disk layout changes so stale cubes are ignored
+SHARED_DATASET_VERSION = 1
+
+# Numeric arrays of a cube stored as .npy files, the labels go to the metadata
+CUBE_ARRAYS = ["values", "times", "treatment_codes", "celltype_codes"]
+
+
+# Function to get the directory of a published dataset
+def shared_dataset_path(dataset_id, shared_dir=None):
+    return os.path.join(shared_dir or SHARED_DATASET_DIR, f"{dataset_id}.v{SHARED_DATASET_VERSION}")
+
+
+# Function to publish a parsed dataset once: one .npy file per cube array and a JSON metadata file
+# with the channels, wells and labels. Written to a staging directory and renamed, so attaching
+# workers never see half a cube. Old and unused cubes are pruned afterwards, workers that still map
+# one keep their pages until they let go of it.
+def publish_dataset(dataset_id, dataset, shared_dir=None):
+    target = shared_dataset_path(dataset_id, shared_dir)
+    if os.path.isdir(target):
+        touch_disk_cache_entry(target)
+        return target
+
+    cube = dataset["cube"]
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    staging = tempfile.mkdtemp(prefix=".staging-", dir=os.path.dirname(target))
+    try:
+        for name in CUBE_ARRAYS:
+            np.save(os.path.join(staging, f"{name}.npy"), np.ascontiguousarray(getattr(cube, name)))
+        meta = {
+            "channels": cube.channels,
+            "wells": [str(well) for well in cube.wells],
+            "treatment_labels": cube.treatment_labels,
+            "celltype_labels": cube.celltype_labels,
+            "sheet_names": dataset["sheet_names"],
+        }
+        with open(os.path.join(staging, "meta.json"), "w") as f:
+            json.dump(meta, f, default=str)
+        os.replace(staging, target)
+    except OSError:
+        shutil.rmtree(staging, ignore_errors=True)
+        if not os.path.isdir(target):
+            raise
+    prune_disk_cache(os.path.dirname(target), SHARED_DATASET_VERSION, keep=target)
+    return target
+
+
+# Function to attach a published dataset: the cube arrays are read-only memory maps shared with
+# every other process that attached them. Returns None when the dataset was not published.
+def attach_dataset(dataset_id, shared_dir=None):
+    source = shared_dataset_path(dataset_id, shared_dir)
+    try:
+        with open(os.path.join(source, "meta.json")) as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(source, f"{name}.npy"), mmap_mode="r") for name in CUBE_ARRAYS}
+    except (OSError, ValueError):
+        return None
+    touch_disk_cache_entry(source)
+
+    cube = PlateCube(meta["channels"], arrays["times"], np.array(meta["wells"], dtype=object), arrays["values"],
+                     arrays["treatment_codes"], meta["treatment_labels"], arrays["celltype_codes"],
+                     meta["celltype_labels"])
+    return {"sheet_names": meta["sheet_names"], "cube": cube}
@@ -0,0 +1,89 @@
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from advanced_data_loader import MICROSCOPY_SHEETS, parse_decimal_comma
+from cache import CACHE_DIR, prune_disk_cache, touch_disk_cache_entry
+
+# Directory holding the binary sidecars of previously opened workbooks
+SIDECAR_DIR = CACHE_DIR
+
+# Bump when the on-disk layout changes so stale sidecars are ignored
+SIDECAR_VERSION = 2
+
+
+# Function to get the sidecar directory of a dataset
+def sidecar_path(dataset_id, cache_dir=None):
+    return os.path.join(cache_dir or SIDECAR_DIR, f"{dataset_id}.v{SIDECAR_VERSION}")
+
+
+# Function to convert workbook sheets into a compact sidecar: one .npy file per microscopy sheet
+# and its time index, the platemaps and labels in a JSON metadata file. Old and unused sidecars
+# are pruned afterwards to keep the cache directory within its disk budget.
+def write_sidecar(dataset_id, sheets, cache_dir=None):
+    target = sidecar_path(dataset_id, cache_dir)
+    if os.path.isdir(target):
+        touch_disk_cache_entry(target)
+        return target
+
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    staging = tempfile.mkdtemp(prefix=".staging-", dir=os.path.dirname(target))
+    try:
+        meta = {"sheets": {}}
+        for name, df in sheets.items():
+            if name in MICROSCOPY_SHEETS:
+                # Parse decimal commas once here, later opens map the floats directly
+                values = parse_decimal_comma(df).to_numpy(dtype=np.float64)
+                np.save(os.path.join(staging, f"{name}.npy"), values)
+                # The index keeps its dtype in its own array, JSON would turn e.g. timestamps into strings
+                index = df.index.to_numpy()
+                np.save(os.path.join(staging, f"{name}.index.npy"), index, allow_pickle=index.dtype == object)
+                meta["sheets"][name] = {
+                    "kind": "array",
+                    "index_name": df.index.name,
+                    "columns": df.columns.tolist()
+                }
+            else:
+                split = df.astype(object).where(df.notna(), None).to_dict("split")
+                meta["sheets"][name] = {"kind": "table", "index_name": df.index.name, **split}
+
+        with open(os.path.join(staging, "meta.json"), "w") as f:
+            json.dump(meta, f, default=str)
+
+        # Publish atomically so readers never see a half-written sidecar
+        os.replace(staging, target)
+    except OSError:
+        shutil.rmtree(staging, ignore_errors=True)
+        if not os.path.isdir(target):
+            raise
+    prune_disk_cache(os.path.dirname(target), SIDECAR_VERSION, keep=target)
+    return target
+
+
+# Function to open a dataset's sidecar, memory-mapping the microscopy arrays.
+# Returns None when the workbook has not been converted yet.
+def read_sidecar(dataset_id, cache_dir=None):
+    source = sidecar_path(dataset_id, cache_dir)
+    # A sidecar pruned by another process while it is read counts as missing
+    try:
+        with open(os.path.join(source, "meta.json")) as f:
+            meta = json.load(f)
+
+        sheets = {}
+        for name, info in meta["sheets"].items():
+            if info["kind"] == "array":
+                values = np.load(os.path.join(source, f"{name}.npy"), mmap_mode="r")
+                index = np.load(os.path.join(source, f"{name}.index.npy"), allow_pickle=True)
+                df = pd.DataFrame(values, index=index, columns=info["columns"], copy=False)
+            else:
+                df = pd.DataFrame(info["data"], index=info["index"], columns=info["columns"])
+            df.index.name = info["index_name"]
+            sheets[name] = df
+    except (OSError, ValueError):
+        return None
+    touch_disk_cache_entry(source)
+    return sheets
@@ -0,0 +1,863 @@
+import dash
+import dash_bootstrap_components as dbc
+import numpy as np
+import pandas as pd
+import plotly.colors
+import plotly.graph_objects as go
+from dash import Patch, dash_table, dcc, html
+
+from advanced_data_loader import annotation_sort_key
+from aggregation import grouped_stats
+from cache import comparison_cache, dataset_cache, figure_cache, fit_cache, kinetics_cache, qc_cache, trace_cache
+from datasets import get_dataset
+from figures import GRAPH_TITLES, HEATMAP_TITLES, MULTI_PLOT_DATA_TYPES, Y_AXIS_TITLES, build_figures, group_color, heatmap_figure, line_figure, selected_group_stats
+from heatmap import DEFAULT_HEATMAP_OPTIONS, heatmap_settings
+from instrumentation import INSTRUMENTATION, metrics, stage
+from kinetics import DEFAULT_THRESHOLD_FRACTION, KINETICS_COLUMNS, dataset_kinetics
+from plate_layout import plate_frames
+from project import get_project, project_group_stats, project_kinetics
+from qc import QC_EXCLUDED_SUFFIX, QC_PLATE_COLUMNS, QC_WELL_COLUMNS, dataset_qc, qc_filtered_cube
+from rendering import DEFAULT_MAX_POINTS, line_traces, lttb_indices, use_webgl
+
+# Inputs that only change the export options of the rendered graphs
+EXPORT_INPUTS = ("export_format_selector", "export_filename_input")
+
+# Inputs that add or remove groups from the line plots
+SELECTION_INPUTS = ("treatment_selector", "celltype_selector")
+
+# Inputs that only matter on some tabs
+TAB_OPTION_INPUTS = {
+    "kinetics_threshold_input": ("kinetics", "statistics"),
+    "growth_model_selector": ("curve_fits",),
+    "heatmap_start_input": ("heatmaps",),
+    "heatmap_end_input": ("heatmaps",),
+    "heatmap_bin_width_input": ("heatmaps",),
+    "heatmap_normalization_selector": ("heatmaps",),
+    "heatmap_cluster_selector": ("heatmaps",),
+    "stats_control_selector": ("statistics",),
+    "stats_test_selector": ("statistics",),
+    "stats_correction_selector": ("statistics",),
+}
+
+
+# Function to build the content of the active tab, called by the update_graph callback
+def build_tab_content(set_progress, active_tab, selected_treatments, selected_celltypes, selected_data_type, export_format, export_filename, max_points, kinetics_threshold, growth_model, heatmap_start, heatmap_end, heatmap_bin_width, heatmap_normalization, heatmap_cluster, stats_control, stats_test, stats_correction, qc_exclude, stored_data, processed_data, live_update, rendered):
+    if not stored_data or not processed_data:
+        return html.P("Please upload data first."), None
+
+    # Some options only change a few tabs
+    if active_tab not in TAB_OPTION_INPUTS.get(dash.ctx.triggered_id, (active_tab,)):
+        return dash.no_update, dash.no_update
+    # New timepoints of another live export leave the tab alone
+    if dash.ctx.triggered_id == "live-update" and (live_update or {}).get("dataset_id") != stored_data.get("dataset_id"):
+        return dash.no_update, dash.no_update
+    threshold_fraction = (kinetics_threshold or 100 * DEFAULT_THRESHOLD_FRACTION) / 100
+    exclude_flagged = "exclude" in (qc_exclude or [])
+    heatmap_options = heatmap_settings(heatmap_start, heatmap_end, heatmap_bin_width, heatmap_normalization,
+                                       "cluster" in (heatmap_cluster or []))
+
+    set_progress((10, "Loading dataset"))
+
+    # Projects aggregate across plates and are always rebuilt (or served from the figure cache)
+    project_id = stored_data.get("project_id")
+    if project_id:
+        project = get_project(project_id)
+        if project is None:
+            return html.P("The project index is no longer available. Please load the project again."), None
+        with stage("project"):
+            return update_project_graph(set_progress, project, active_tab, selected_treatments or [],
+                                        selected_celltypes or [], selected_data_type,
+                                        export_config(export_format, export_filename), max_points,
+                                        threshold_fraction, exclude_flagged, heatmap_options), None
+
+    # Look up the parsed frames on the server
+    dataset_id = stored_data.get("dataset_id")
+    with stage("load_dataset"):
+        dataset = get_dataset(dataset_id)
+    if dataset is None:
+        return html.P("The uploaded data is no longer cached on the server. Please upload the file again."), None
+
+    # Live exports grow between polls: the view names the export, the caches its current revision
+    view_id = dataset_id
+    dataset_id = dataset.get("revision_id", dataset_id)
+    revision = dataset.get("revision")
+
+    if active_tab == "diagnostics":
+        with stage("diagnostics"):
+            return create_diagnostics_content(dataset_id, dataset, selected_data_type), None
+
+    # Without the flagged wells the cube is a different dataset for every cache
+    cube = dataset["cube"]
+    if exclude_flagged:
+        set_progress((20, "Running QC"))
+        with stage("qc"):
+            cube = qc_filtered_cube(dataset_id, cube)
+        dataset_id += QC_EXCLUDED_SUFFIX
+        view_id += QC_EXCLUDED_SUFFIX
+
+    if active_tab == "kinetics":
+        with stage("kinetics"):
+            return create_kinetics_content(dataset_id, cube, selected_data_type, selected_treatments or [],
+                                           selected_celltypes or [], threshold_fraction), None
+    if active_tab == "curve_fits":
+        set_progress((20, "Fitting growth curves"))
+        with stage("curve_fits"):
+            return create_curve_fit_content(dataset_id, cube, selected_data_type, selected_treatments or [],
+                                            selected_celltypes or [], growth_model), None
+    if active_tab == "statistics":
+        set_progress((20, "Testing treatments"))
+        with stage("statistics"):
+            return create_statistics_content(dataset_id, cube, selected_data_type, stats_control,
+                                             selected_treatments or [], selected_celltypes or [], stats_test,
+                                             stats_correction, threshold_fraction), None
+    if active_tab not in ("individual", "multi_plot", "heatmaps"):
+        return html.P("Select a tab."), None
+
+    selected_treatments = selected_treatments or []
+    selected_celltypes = selected_celltypes or []
+    config = export_config(export_format, export_filename)
+
+    # What is on screen apart from the selection: the Multi Plot shows every data type,
+    # and heatmaps are binned by their own options instead of downsampled
+    view = [
+        view_id,
+        active_tab,
+        None if active_tab == "multi_plot" else selected_data_type,
+        None if active_tab == "heatmaps" else max_points
+    ] + (list(heatmap_options) if active_tab == "heatmaps" else [])
+    triggered = dash.ctx.triggered_id
+    if rendered and rendered["view"] == view:
+        # Export options only live in the graph config, so patch it in place
+        if triggered in EXPORT_INPUTS:
+            return patch_export_config(active_tab, rendered["n_graphs"], config), dash.no_update
+
+        # Selection changes on the line plots only add and remove the traces of the changed groups
+        if triggered in SELECTION_INPUTS and rendered.get("groups") is not None and rendered.get("revision") == revision:
+            with stage("patch"):
+                patched = patch_selected_groups(dataset_id, cube, active_tab, view[2], max_points, rendered,
+                                                selected_treatments, selected_celltypes)
+            if patched is not None:
+                return patched
+
+        # New timepoints of a live export extend the line plots in place
+        if triggered == "live-update" and rendered.get("groups") is not None:
+            with stage("patch"):
+                patched = patch_appended_timepoints(cube, active_tab, view[2], max_points, rendered, revision)
+            if patched is not None:
+                return patched
+
+    # The heatmap rows follow the selection order
+    figure_key = (dataset_id,) + tuple(view[1:]) + (
+        tuple(selected_treatments) if active_tab == "heatmaps" else tuple(sorted(selected_treatments, key=annotation_sort_key)),
+        tuple(selected_celltypes) if active_tab == "heatmaps" else tuple(sorted(selected_celltypes, key=annotation_sort_key))
+    )
+    figures = figure_cache.get(figure_key)
+    if figures is None:
+        set_progress((40, "Building figures"))
+        with stage("build_figures"):
+            figures = figure_cache.put(figure_key, plain_figures(build_figures(
+                active_tab, cube, selected_data_type, selected_treatments, selected_celltypes, max_points, heatmap_options)))
+    set_progress((90, "Rendering"))
+
+    rendered = {"view": view, "n_graphs": 0 if isinstance(figures, str) else len(figures), "groups": None,
+                "revision": revision}
+    if active_tab != "heatmaps" and not isinstance(figures, str) and (
+            active_tab == "multi_plot" or cube.has_channel(selected_data_type)):
+        # Full builds draw the groups in ascending group id order
+        groups = selected_groups(cube, selected_treatments, selected_celltypes)
+        rendered.update(groups=groups, webgl=use_webgl(2 * len(groups), len(cube.times), max_points))
+    with stage("render"):
+        return render_figures(active_tab, figures, config), rendered
+
+# Function to build the tab content of a multi-plate project
+def update_project_graph(set_progress, project, active_tab, selected_treatments, selected_celltypes,
+                         selected_data_type, config, max_points, threshold_fraction=DEFAULT_THRESHOLD_FRACTION,
+                         exclude_flagged=False, heatmap_options=DEFAULT_HEATMAP_OPTIONS):
+    if active_tab == "diagnostics":
+        return create_project_diagnostics_content(project)
+    if active_tab == "kinetics":
+        set_progress((30, "Computing kinetics"))
+        table = project_kinetics(project, selected_data_type, selected_treatments, selected_celltypes,
+                                 threshold_fraction, exclude_flagged)
+        if table is None or table.empty:
+            return html.P(f"No {selected_data_type} data available for the selected treatments and cell types.")
+        return create_kinetics_table(table)
+    if active_tab == "curve_fits":
+        return html.P("Curve fits work on a single plate, upload one workbook to fit it.")
+    if active_tab == "statistics":
+        return html.P("Statistics compare the wells of a single plate, upload one workbook to test it.")
+    if active_tab not in ("individual", "multi_plot", "heatmaps"):
+        return html.P("Select a tab.")
+
+    figure_key = (
+        project["project_id"],
+        active_tab,
+        None if active_tab == "multi_plot" else selected_data_type,
+        None if active_tab == "heatmaps" else max_points,
+        tuple(selected_treatments) if active_tab == "heatmaps" else tuple(sorted(selected_treatments, key=annotation_sort_key)),
+        tuple(selected_celltypes) if active_tab == "heatmaps" else tuple(sorted(selected_celltypes, key=annotation_sort_key)),
+        exclude_flagged,
+        heatmap_options if active_tab == "heatmaps" else None
+    )
+    figures = figure_cache.get(figure_key)
+    if figures is None:
+        set_progress((30, "Aggregating plates"))
+        figures = figure_cache.put(figure_key, plain_figures(build_project_figures(
+            project, active_tab, selected_data_type, selected_treatments, selected_celltypes, max_points,
+            exclude_flagged, heatmap_options)))
+    set_progress((90, "Rendering"))
+    return render_figures(active_tab, figures, config)
+
+# Function to build the (title, figure) pairs of a tab from statistics merged across plates
+def build_project_figures(project, active_tab, data_type, selected_treatments, selected_celltypes,
+                          max_points=DEFAULT_MAX_POINTS, exclude_flagged=False, heatmap_options=DEFAULT_HEATMAP_OPTIONS):
+    data_types = [dt for dt in MULTI_PLOT_DATA_TYPES if dt in project["channels"]] \
+        if active_tab == "multi_plot" else [data_type]
+    merged = project_group_stats(project, data_types, selected_treatments, selected_celltypes, exclude_flagged)
+
+    if active_tab == "heatmaps":
+        if data_type not in merged:
+            return f"No data available for {data_type}."
+        stats = merged[data_type]
+        return heatmap_figure(data_type, stats["axis"], stats["keys"], stats["n"], stats["mean"],
+                              selected_treatments, selected_celltypes, heatmap_options)
+
+    figures = []
+    for dt in data_types:
+        if dt not in merged:
+            figures.append((GRAPH_TITLES.get(dt, f"{dt.capitalize()} Plot"),
+                            go.Figure(layout_title_text=f"No data available for {dt}")))
+            continue
+        stats = merged[dt]
+        # Colours follow the project-wide group ids, as group_color does for a single plate
+        groups = [project["treatments"].index(t) * len(project["celltypes"]) + project["celltypes"].index(c)
+                  for t, c in stats["keys"]]
+        figures.append((GRAPH_TITLES.get(dt, f"{dt.capitalize()} Plot"),
+                        line_figure(dt, stats["axis"], groups, stats["keys"], stats, max_points)))
+    return figures
+
+# Function to build the Plotly config used for image exports
+def export_config(export_format, export_filename):
+    return {
+        'toImageButtonOptions': {
+            'format': export_format,  # Use the user-selected format (e.g., 'svg', 'png')
+            'filename': export_filename,  # Use the user-provided filename
+            'scale': 2  # Adjust the scale for higher resolution
+        }
+    }
+
+# Function to keep built figures as plain dicts (as the trace cache does), so the figure cache holds
+# no graph objects that would be validated again when read back from a shared store
+def plain_figures(figures):
+    if isinstance(figures, str):
+        return figures
+    return [(title, figure.to_plotly_json()) for title, figure in figures]
+
+
+# Function to wrap the figures of a tab into cards
+def render_figures(active_tab, figures, config):
+    if isinstance(figures, str):
+        return html.P(figures)
+
+    if active_tab == "multi_plot":
+        return html.Div([
+            dbc.Card(
+                [
+                    dbc.CardHeader(title),
+                    dbc.CardBody(
+                        dcc.Graph(figure=figure, config=config)
+                    )
+                ],
+                className="mb-4"
+            ) for title, figure in figures
+        ], style={"display": "grid", "gridTemplateColumns": "repeat(2, 1fr)", "gap": "20px"})
+
+    # Individual plots and heatmaps show a single graph
+    (title, figure), = figures
+    return dbc.Card(
+        [
+            dbc.CardHeader(title),
+            dbc.CardBody(
+                dcc.Graph(
+                    id="confluence_graph" if active_tab == "individual" else "heatmap_graph",
+                    figure=figure,
+                    config=config
+                )
+            )
+        ],
+        className="mt-3"
+    )
+
+# Function to get the Graph components rendered by render_figures inside a Patch of graph_content
+def patched_graphs(patch, active_tab, n_graphs):
+    if active_tab == "multi_plot":
+        # Div -> Card -> CardBody -> Graph
+        return [patch["props"]["children"][i]["props"]["children"][1]["props"]["children"]["props"]
+                for i in range(n_graphs)]
+    # Card -> CardBody -> Graph
+    return [patch["props"]["children"][1]["props"]["children"]["props"]] if n_graphs else []
+
+# Function to update only the export config of the graphs rendered by render_figures
+def patch_export_config(active_tab, n_graphs, config):
+    if not n_graphs:
+        return dash.no_update
+
+    patch = Patch()
+    for graph in patched_graphs(patch, active_tab, n_graphs):
+        graph["config"] = config
+    return patch
+
+# Function to patch the line plots after a selection change: the traces of deselected groups are
+# deleted and the traces of new groups appended, the others stay in the browser untouched.
+# Returns None when a full rebuild is needed.
+def patch_selected_groups(dataset_id, cube, active_tab, data_type, max_points, rendered,
+                          selected_treatments, selected_celltypes):
+    old_groups = rendered["groups"]
+    new_groups = selected_groups(cube, selected_treatments, selected_celltypes)
+    webgl = use_webgl(2 * len(new_groups), len(cube.times), max_points)
+    if webgl != rendered["webgl"]:
+        return None
+
+    removed = [i for i, group in enumerate(old_groups) if group not in new_groups]
+    added = [group for group in new_groups if group not in old_groups]
+    if not removed and not added:
+        return dash.no_update, dash.no_update
+
+    data_types = [dt for dt in MULTI_PLOT_DATA_TYPES if cube.has_channel(dt)] if active_tab == "multi_plot" else [data_type]
+    patch = Patch()
+    for graph, dt in zip(patched_graphs(patch, active_tab, rendered["n_graphs"]), data_types):
+        traces = graph["figure"]["data"]
+        # Each group owns two consecutive traces (line and band), delete from the back
+        for i in reversed(removed):
+            del traces[2 * i + 1]
+            del traces[2 * i]
+        for group in added:
+            traces.extend(group_traces(dataset_id, cube, dt, group, max_points, webgl))
+
+    groups = [group for group in old_groups if group in new_groups] + added
+    return patch, dict(rendered, groups=groups)
+
+# Function to extend the line plots with the timepoints a live export appended since they were drawn.
+# Grouped statistics are independent per timepoint, so only the new timepoints are reduced and sent:
+# lines are extended and the new points inserted in the middle of each band (forward, then back).
+# Returns None when a full rebuild is needed (the export was rewritten, or the new length changes
+# the downsampling or WebGL).
+def patch_appended_timepoints(cube, active_tab, data_type, max_points, rendered, revision):
+    old_revision = rendered.get("revision")
+    if old_revision is None or revision is None or old_revision[0] != revision[0] or old_revision[1] > revision[1]:
+        return None
+    n_old, n = old_revision[1], len(cube.times)
+    if n_old == n:
+        return dash.no_update, dash.no_update
+    groups = rendered["groups"]
+    if (max_points and n > max_points) or use_webgl(2 * len(groups), n, max_points) != rendered["webgl"]:
+        return None
+
+    times = cube.times[n_old:].tolist()
+    group_index = cube.group_index()
+    group_index = np.where(np.isin(group_index, groups), group_index, -1)
+    data_types = [dt for dt in MULTI_PLOT_DATA_TYPES if cube.has_channel(dt)] if active_tab == "multi_plot" else [data_type]
+
+    patch = Patch()
+    for graph, dt in zip(patched_graphs(patch, active_tab, rendered["n_graphs"]), data_types):
+        stats = grouped_stats(cube.channel(dt)[n_old:], group_index)
+        rows = {group: i for i, group in enumerate(stats["groups"].tolist())}
+        traces = graph["figure"]["data"]
+        for i, group in enumerate(groups):
+            mean, std = stats["mean"][rows[group]], stats["std"][rows[group]]
+            traces[2 * i]["x"].extend(times)
+            traces[2 * i]["y"].extend(mean.tolist())
+            band = traces[2 * i + 1]
+            for j, (x, y) in enumerate(zip(times + times[::-1], (mean + std).tolist() + (mean - std)[::-1].tolist())):
+                band["x"].insert(n_old + j, x)
+                band["y"].insert(n_old + j, y)
+
+    return patch, dict(rendered, revision=revision)
+
+# Function to list the group ids of the selected treatments and cell types that have wells
+def selected_groups(cube, selected_treatments, selected_celltypes):
+    group_index = cube.group_index(cube.well_mask(selected_treatments, selected_celltypes))
+    return np.unique(group_index[group_index >= 0]).tolist()
+
+# Function to build (and cache) the line and band traces of a single group
+def group_traces(dataset_id, cube, data_type, group, max_points, webgl):
+    key = (dataset_id, data_type, group, max_points, webgl)
+    traces = trace_cache.get(key)
+    if traces is None:
+        stats = grouped_stats(cube.channel(data_type), np.where(cube.group_index() == group, group, -1))
+        t, c = cube.group_labels(group)
+        keep = lttb_indices(cube.times, stats["mean"], max_points)
+        line, band = line_traces(cube.times, stats["mean"][0], stats["std"][0], f"{t} ({c})", group_color(group),
+                                 keep=keep[0], webgl=webgl)
+        traces = trace_cache.put(key, [line.to_plotly_json(), band.to_plotly_json()])
+    return traces
+
+# Function to create the per-well kinetics table of the selected wells
+def create_kinetics_content(dataset_id, cube, data_type, selected_treatments, selected_celltypes, threshold_fraction):
+    if not cube.has_channel(data_type):
+        return html.P(f"No data available for {data_type}.")
+
+    table = dataset_kinetics(dataset_id, cube, threshold_fraction)
+    table = table[(table["Channel"] == data_type)
+                  & table["Treatment"].isin(selected_treatments)
+                  & table["Cell type"].isin(selected_celltypes)]
+    if table.empty:
+        return html.P("No data available for the selected treatments and cell types.")
+    return create_kinetics_table(table)
+
+# Function to render a kinetics table as a sortable, filterable DataTable
+def create_kinetics_table(table):
+    identifiers = [column for column in ["Plate", "Well", "Treatment", "Cell type"] if column in table.columns]
+    return create_results_table(table[identifiers + KINETICS_COLUMNS], f"Kinetics per Well ({len(table)} wells)",
+                                KINETICS_COLUMNS, "kinetics_table")
+
+# Function to render a results table as a sortable, filterable DataTable in a card.
+# p-value columns keep three significant digits instead of three decimals.
+def create_results_table(table, title, numeric_columns, table_id, p_value_columns=()):
+    rounded = table.round(3)
+    for column in p_value_columns:
+        rounded[column] = [float(f"{p:.3g}") for p in table[column]]
+    table = rounded
+    # Missing values (e.g. no growth, failed fits) are shown as empty cells
+    records = table.astype(object).where(table.notna(), None).to_dict("records")
+
+    return dbc.Card(
+        [
+            dbc.CardHeader(title),
+            dbc.CardBody(
+                dash_table.DataTable(
+                    id=table_id,
+                    columns=[{"name": column, "id": column, "type": "numeric" if column in numeric_columns else "text"}
+                             for column in table.columns],
+                    data=records,
+                    sort_action="native",
+                    filter_action="native",
+                    page_size=50,
+                    export_format="csv",
+                    style_table={"overflowX": "auto"},
+                    style_cell={"fontSize": "0.85rem", "padding": "4px"}
+                )
+            )
+        ],
+        className="mt-3"
+    )
+
+# Function to fit (or look up) the growth model of every well of a channel, cached by the data hash
+def growth_fits(cube, data_type, model_name):
+    from curve_fitting import data_hash, fit_growth_curves, growth_fit_table
+
+    values = cube.channel(data_type)
+    key = (data_hash(cube.times, values), model_name)
+    fits = fit_cache.get(key)
+    if fits is None:
+        fits = fit_cache.put(key, fit_growth_curves(cube.times, values, cube.wells, model_name,
+                                                    groups=cube.group_index()))
+    return growth_fit_table(cube, *fits)
+
+# Function to create the growth-curve and dose-response fits of the selected wells
+def create_curve_fit_content(dataset_id, cube, data_type, selected_treatments, selected_celltypes, model_name):
+    from curve_fitting import GROWTH_MODELS, GROWTH_PARAMETERS
+
+    if not cube.has_channel(data_type):
+        return html.P(f"No data available for {data_type}.")
+
+    fits = growth_fits(cube, data_type, model_name)
+    selected = fits[fits["Treatment"].isin(selected_treatments) & fits["Cell type"].isin(selected_celltypes)]
+    if selected.empty:
+        return html.P("No data available for the selected treatments and cell types.")
+
+    # Each group is summarized by the median parameters of its wells
+    summary = selected.groupby(["Treatment", "Cell type"], sort=False)[GROWTH_PARAMETERS + ["RMSE"]].median()
+    summary.insert(0, "Wells", selected.groupby(["Treatment", "Cell type"], sort=False).size())
+    summary = summary.reset_index()
+
+    # Observed group means with the median fitted curve of each group
+    labels, stats = selected_group_stats(cube, data_type, selected_treatments, selected_celltypes)
+    model = GROWTH_MODELS[model_name]
+    medians = {(row["Treatment"], row["Cell type"]): row for _, row in summary.iterrows()}
+    curve_times = np.linspace(cube.times.min(), cube.times.max(), 200)
+    fig = go.Figure()
+    for i, (group, (t, c)) in enumerate(zip(stats["groups"], labels)):
+        color = group_color(group)
+        fig.add_trace(go.Scatter(x=cube.times, y=stats["mean"][i], mode="markers", name=f"{t} ({c})",
+                                 marker=dict(color=color, size=4, opacity=0.5), legendgroup=f"{t} ({c})"))
+        parameters = medians[(t, c)][GROWTH_PARAMETERS].to_numpy(dtype=float)
+        if not np.any(np.isnan(parameters)):
+            fig.add_trace(go.Scatter(x=curve_times, y=model(curve_times, *parameters), mode="lines",
+                                     line=dict(color=color), legendgroup=f"{t} ({c})", showlegend=False))
+    fig.update_layout(
+        title=f"{model_name.capitalize()} Fits: {GRAPH_TITLES.get(data_type, data_type.capitalize())}",
+        xaxis_title="Time (hours)",
+        yaxis_title=Y_AXIS_TITLES.get(data_type, "Value"),
+        template="simple_white",
+        legend_title_text="Treatment (Cell Type)"
+    )
+
+    content = [
+        dbc.Card([dbc.CardHeader("Growth Curve Fits"), dbc.CardBody(dcc.Graph(figure=fig))], className="mt-3"),
+        create_results_table(summary, "Median Parameters per Group", ["Wells"] + GROWTH_PARAMETERS + ["RMSE"],
+                             "growth_fit_summary_table"),
+        create_results_table(selected, f"Fits per Well ({len(selected)} wells)", GROWTH_PARAMETERS + ["RMSE"],
+                             "growth_fit_table"),
+    ]
+    content.append(create_dose_response_content(dataset_id, cube, data_type, selected_celltypes))
+    return html.Div(content)
+
+# Function to fit dose-response curves to the per-well AUC of treatment series with doses in their names
+def create_dose_response_content(dataset_id, cube, data_type, selected_celltypes):
+    from curve_fitting import DOSE_RESPONSE_PARAMETERS, fit_dose_response, four_parameter_logistic
+
+    kinetics = dataset_kinetics(dataset_id, cube)
+    responses = kinetics[(kinetics["Channel"] == data_type) & kinetics["Cell type"].isin(selected_celltypes)]
+
+    responses, curves = fit_dose_response(responses, "AUC")
+    if curves.empty:
+        return dbc.Alert("No dose-response series found: treatment names need doses such as 'Drug 10 uM', "
+                         "with at least four doses per series.", color="light", className="mt-3")
+
+    fig = go.Figure()
+    colors = plotly.colors.qualitative.Set1
+    for i, curve in curves.iterrows():
+        color = colors[i % len(colors)]
+        name = f"{curve['Series']} ({curve['Cell type']})"
+        points = responses[(responses["Series"] == curve["Series"]) & (responses["Cell type"] == curve["Cell type"])]
+        fig.add_trace(go.Scatter(x=points["Dose"], y=points["AUC"], mode="markers", name=name,
+                                 marker=dict(color=color), legendgroup=name))
+        if not np.isnan(curve["EC50 (uM)"]):
+            log_doses = np.linspace(np.log10(points["Dose"].min()), np.log10(points["Dose"].max()), 100)
+            fig.add_trace(go.Scatter(
+                x=10 ** log_doses,
+                y=four_parameter_logistic(log_doses, curve["Bottom"], curve["Top"], np.log10(curve["EC50 (uM)"]), curve["Hill"]),
+                mode="lines", line=dict(color=color), legendgroup=name, showlegend=False
+            ))
+    fig.update_layout(
+        title=f"Dose Response: {HEATMAP_TITLES.get(data_type, data_type.capitalize())} AUC",
+        xaxis_title="Dose (uM)",
+        xaxis_type="log",
+        yaxis_title="AUC",
+        template="simple_white"
+    )
+    return html.Div([
+        dbc.Card([dbc.CardHeader("Dose Response (4PL)"), dbc.CardBody(dcc.Graph(figure=fig))], className="mt-3"),
+        create_results_table(curves, "Dose-Response Parameters", ["Doses"] + DOSE_RESPONSE_PARAMETERS,
+                             "dose_response_table"),
+    ])
+
+# Function to test every selected treatment against the control within each selected cell type,
+# at every timepoint and on the kinetics metrics of the wells
+def create_statistics_content(dataset_id, cube, data_type, control, selected_treatments, selected_celltypes,
+                              test, correction, threshold_fraction):
+    from comparisons import P_VALUE_CORRECTIONS, SIGNIFICANCE_LEVEL, STATISTICAL_TESTS, compare_treatments
+
+    if not cube.has_channel(data_type):
+        return html.P(f"No data available for {data_type}.")
+    if control not in cube.treatment_labels:
+        return html.P("Select the control treatment to compare with.")
+    test = test if test in STATISTICAL_TESTS else "welch"
+    correction = correction if correction in P_VALUE_CORRECTIONS else "fdr_bh"
+
+    results = compare_treatments(dataset_id, cube, data_type, control, selected_treatments, selected_celltypes,
+                                 test, correction, threshold_fraction)
+    comparisons = results["comparisons"]
+    if not comparisons:
+        return html.P(f"Select a cell type and at least one treatment besides the control ({control}).")
+    treatments = [t for t, _ in comparisons]
+    celltypes = [c for _, c in comparisons]
+
+    # Significance over time, one line per comparison in the colour of its treated group
+    timecourse = results["timecourse"]
+    adjusted = timecourse["p_adjusted"]
+    with np.errstate(divide="ignore"):
+        significance = -np.log10(adjusted)
+    fig = go.Figure()
+    for (t, c), group, y in zip(comparisons, results["groups"], significance):
+        fig.add_trace(go.Scatter(x=cube.times, y=y, mode="lines", name=f"{t} ({c})",
+                                 line=dict(color=group_color(group))))
+    fig.add_hline(y=-np.log10(SIGNIFICANCE_LEVEL), line_dash="dash", line_color="grey",
+                  annotation_text=f"p = {SIGNIFICANCE_LEVEL}", annotation_position="top left")
+    fig.update_layout(
+        title=f"{STATISTICAL_TESTS[test]} vs {control}: {HEATMAP_TITLES.get(data_type, data_type.capitalize())}",
+        xaxis_title="Time (hours)",
+        yaxis_title=f"-log10 p ({P_VALUE_CORRECTIONS[correction]})",
+        template="simple_white",
+        legend_title_text="Treatment (Cell Type)"
+    )
+
+    significant = adjusted < SIGNIFICANCE_LEVEL
+    first = significant.argmax(axis=1)
+    summary = pd.DataFrame({
+        "Treatment": treatments,
+        "Cell type": celltypes,
+        "Wells": timecourse["n_treated"].max(axis=1),
+        "Control Wells": timecourse["n_control"].max(axis=1),
+        "Significant Timepoints": significant.sum(axis=1),
+        "First Significant (h)": np.where(significant.any(axis=1), cube.times[first], np.nan),
+        "Min Adjusted p": np.fmin.reduce(adjusted, axis=1),
+    })
+
+    kinetics = results["kinetics"]
+    n_metrics = len(KINETICS_COLUMNS)
+    metrics = pd.DataFrame({
+        "Treatment": np.repeat(treatments, n_metrics),
+        "Cell type": np.repeat(celltypes, n_metrics),
+        "Metric": np.tile(KINETICS_COLUMNS, len(comparisons)),
+        "Wells": kinetics["n_treated"].ravel(),
+        "Control Wells": kinetics["n_control"].ravel(),
+        "Mean": kinetics["mean_treated"].ravel(),
+        "Control Mean": kinetics["mean_control"].ravel(),
+        "Difference": (kinetics["mean_treated"] - kinetics["mean_control"]).ravel(),
+        "Statistic": kinetics["statistic"].ravel(),
+        "p": kinetics["p"].ravel(),
+        "Adjusted p": kinetics["p_adjusted"].ravel(),
+    })
+
+    return html.Div([
+        dbc.Card([dbc.CardHeader("Significance over Time"), dbc.CardBody(dcc.Graph(figure=fig))], className="mt-3"),
+        create_results_table(summary, f"Timepoints with Adjusted p < {SIGNIFICANCE_LEVEL}",
+                             ["Wells", "Control Wells", "Significant Timepoints", "First Significant (h)",
+                              "Min Adjusted p"], "statistics_timecourse_table", p_value_columns=["Min Adjusted p"]),
+        create_results_table(metrics, "Kinetics Comparisons",
+                             ["Wells", "Control Wells", "Mean", "Control Mean", "Difference", "Statistic", "p",
+                              "Adjusted p"], "statistics_kinetics_table", p_value_columns=["p", "Adjusted p"]),
+    ])
+
+# Function to create diagnostics content
+def create_diagnostics_content(dataset_id, dataset, data_type):
+    import plotly.express as px
+
+    diagnostics = []
+    cube = dataset["cube"]
+
+    if not cube.has_channel("phase") or not len(cube.times):
+        diagnostics.append(html.Div("No phase data available.", className="text-danger"))
+    else:
+        # Seeding check on the first timepoint, exports do not always start at exactly 0 h
+        seeding = cube.channel("phase")[0]
+        seeding = seeding[~np.isnan(seeding)]
+        if not len(seeding):
+            diagnostics.append(html.Div(f"No phase data available at {cube.times[0]:g} h.", className="text-danger"))
+        else:
+            # Create histogram
+            histogram_fig = px.histogram(
+                x=seeding,
+                nbins=200,
+                labels={"x": "Phase Value", "y": "Count"},
+                title=f"Cell Seeding Check: Phase Data Distribution at {cube.times[0]:g} h"
+            )
+            histogram_fig.update_layout(
+                template="simple_white",
+                height=400,
+                width=1000,  # Set a fixed height for the histogram
+                margin=dict(l=40, r=20, t=40, b=40)  # Adjust margins if needed
+            )
+
+            # Add histogram to diagnostics
+            diagnostics.append(
+                dbc.AccordionItem(
+                    dcc.Graph(figure=histogram_fig),
+                    title="Phase Data Visualizations"
+                )
+            )
+
+    # Outlier wells, dropouts, saturation and plate effects
+    diagnostics.append(create_qc_content(dataset_id, cube))
+
+    # Display the selected channel on the plate geometry, played back in the browser
+    if cube.has_channel(data_type) and len(cube.times):
+        diagnostics.append(
+            dbc.AccordionItem(
+                create_plate_layout_content(dataset_id, cube, data_type),
+                title=f"Plate Layout ({HEATMAP_TITLES.get(data_type, data_type)})"
+            )
+        )
+
+    # Display the server-side cache counters
+    diagnostics.append(
+        dbc.AccordionItem(
+            create_cache_statistics_table(),
+            title="Cache Statistics"
+        )
+    )
+
+    # Display the callback latencies recorded by the instrumentation
+    diagnostics.append(
+        dbc.AccordionItem(
+            create_latency_table(),
+            title="Callback Latency"
+        )
+    )
+
+    # Display available sheets
+    diagnostics.append(
+        dbc.AccordionItem(
+            [
+                html.H5("Available Sheets"),
+                html.Ul([html.Li(sheet) for sheet in dataset["sheet_names"]])
+            ],
+            title="Available Sheets"
+        )
+    )
+
+    # Wrap diagnostics in an Accordion
+    return dbc.Accordion(diagnostics, always_open=True)
+
+
+# Function to create the QC section: plate effects per channel and the flagged wells
+def create_qc_content(dataset_id, cube):
+    qc = dataset_qc(dataset_id, cube)
+    flagged = qc["wells"][qc["wells"]["Flags"] != ""]
+
+    content = [create_results_table(qc["plate"], "Plate Effects (Relative to Group Medians)", QC_PLATE_COLUMNS,
+                                    "qc_plate_table")]
+    if flagged.empty:
+        content.append(dbc.Alert("No wells flagged.", color="success", className="mt-3"))
+    else:
+        content.append(create_results_table(flagged, f"Flagged Wells ({int(qc['flagged'].sum())} wells)",
+                                            QC_WELL_COLUMNS, "qc_well_table"))
+    return dbc.AccordionItem(content, title=f"Quality Control ({int(qc['flagged'].sum())} flagged wells)")
+
+
+# Number of labelled ticks on the plate layout time slider
+PLATE_LAYOUT_SLIDER_MARKS = 6
+
+# Milliseconds between frames while the plate layout is playing
+PLATE_LAYOUT_FRAME_INTERVAL = 200
+
+# Function to create the plate layout view: every frame is sent once with the content, the
+# clientside callbacks below draw the heatmap for the slider position
+def create_plate_layout_content(dataset_id, cube, data_type):
+    frames = plate_frames(dataset_id, cube, data_type)
+    last = len(cube.times) - 1
+    marked = np.unique(np.linspace(0, last, PLATE_LAYOUT_SLIDER_MARKS).round().astype(int))
+
+    return html.Div([
+        dcc.Store(id="plate-layout-frames", data=frames),
+        dcc.Interval(id="plate-layout-interval", interval=PLATE_LAYOUT_FRAME_INTERVAL, disabled=True),
+        dcc.Graph(id="plate-layout-graph", config={"displaylogo": False}),
+        dbc.Row(
+            [
+                dbc.Col(
+                    dbc.Button("Play", id="plate-layout-play", color="secondary", outline=True, size="sm",
+                               n_clicks=0),
+                    width="auto"
+                ),
+                dbc.Col(
+                    dcc.Slider(
+                        id="plate-layout-slider",
+                        min=0,
+                        max=last,
+                        step=1,
+                        value=0,
+                        marks={int(i): f"{cube.times[i]:g} h" for i in marked},
+                        updatemode="drag"  # Scrubbing is drawn client-side, no server round-trips
+                    )
+                )
+            ],
+            align="center"
+        )
+    ])
+
+
+# Function to create the diagnostics of a project: the plate index and the cache counters
+def create_project_diagnostics_content(project):
+    plate_rows = [
+        html.Tr([
+            html.Td(plate["name"]),
+            html.Td(plate["wells"]),
+            html.Td(plate["timepoints"]),
+            html.Td(", ".join(plate["channels"])),
+            html.Td(len(plate["groups"]))
+        ]) for plate in project["plates"]
+    ]
+    diagnostics = [
+        dbc.AccordionItem(
+            dbc.Table(
+                [
+                    html.Thead(html.Tr([html.Th(h) for h in ["Plate", "Wells", "Timepoints", "Channels", "Groups"]])),
+                    html.Tbody(plate_rows)
+                ],
+                size="sm",
+                bordered=True
+            ),
+            title=f"Project Plates ({len(project['plates'])})"
+        ),
+        dbc.AccordionItem(
+            create_cache_statistics_table(),
+            title="Cache Statistics"
+        ),
+        dbc.AccordionItem(
+            create_latency_table(),
+            title="Callback Latency"
+        )
+    ]
+    if project["errors"]:
+        diagnostics.append(dbc.AccordionItem(html.Ul([html.Li(error) for error in project["errors"]]),
+                                             title="Skipped Workbooks"))
+    return dbc.Accordion(diagnostics, always_open=True)
+
+
+# Function to tabulate the hit/miss counters of the server-side caches
+def create_cache_statistics_table():
+    rows = []
+    for name, cache in (("Datasets", dataset_cache), ("Figures", figure_cache), ("Traces", trace_cache),
+                        ("Kinetics", kinetics_cache), ("Curve Fits", fit_cache), ("QC", qc_cache),
+                        ("Comparisons", comparison_cache)):
+        stats = cache.stats()
+        lookups = stats["hits"] + stats["misses"]
+        rows.append(html.Tr([
+            html.Td(name),
+            html.Td(stats["entries"]),
+            html.Td(f"{stats['bytes'] / 1e6:.1f} MB" if stats["max_bytes"] is not None else "-"),
+            html.Td(stats["hits"]),
+            html.Td(stats["misses"]),
+            html.Td(f"{stats['hits'] / lookups:.0%}" if lookups else "-")
+        ]))
+
+    return dbc.Table(
+        [
+            html.Thead(html.Tr([html.Th(h) for h in ["Cache", "Entries", "Size", "Hits", "Misses", "Hit Rate"]])),
+            html.Tbody(rows)
+        ],
+        size="sm",
+        bordered=True
+    )
+
+
+# Function to tabulate the p50/p95 latency of each callback and tab, and where update_graph spends its time
+def create_latency_table():
+    if not INSTRUMENTATION:
+        return html.P("Set BIOIMAGING_INSTRUMENTATION=1 to record callback timings and payload sizes.")
+    summary = metrics.summary()
+    if not summary:
+        return html.P("No callbacks recorded yet.")
+
+    rows = [
+        html.Tr([
+            html.Td(row["callback"]),
+            html.Td(row["tab"] or "-"),
+            html.Td(row["count"]),
+            html.Td(f"{row['p50'] * 1000:.0f} ms"),
+            html.Td(f"{row['p95'] * 1000:.0f} ms"),
+            html.Td(f"{row['max'] * 1000:.0f} ms")
+        ]) for row in summary
+    ]
+    stage_seconds, payload_bytes = metrics.totals()
+    stages = [html.Li(f"{callback} / {name}: {seconds:.2f} s")
+              for (callback, name), seconds in sorted(stage_seconds.items(), key=lambda item: -item[1])]
+    payloads = [html.Li(f"{callback} / {name}: {nbytes / 1e6:.1f} MB")
+                for (callback, name), nbytes in sorted(payload_bytes.items())]
+
+    return html.Div([
+        dbc.Table(
+            [
+                html.Thead(html.Tr([html.Th(h) for h in ["Callback", "Tab", "Requests", "p50", "p95", "Max"]])),
+                html.Tbody(rows)
+            ],
+            size="sm",
+            bordered=True
+        ),
+        html.H6("Time per Stage (Total)"),
+        html.Ul(stages),
+        html.H6("Payloads (Total)"),
+        html.Ul(payloads)
+    ])
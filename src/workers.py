@@ -0,0 +1,34 @@
+import concurrent.futures
+import multiprocessing
+import os
+
+from cache import DATASET_CACHE_BYTES, dataset_cache
+
+# Number of worker processes shared by project aggregation and curve fitting
+WORKERS = int(os.environ.get("BIOIMAGING_WORKERS", min(os.cpu_count() or 1, 8)))
+
+# Memory budget for the plate cubes held by all workers together
+WORKER_CACHE_BYTES = int(os.environ.get("BIOIMAGING_WORKER_CACHE_BYTES", DATASET_CACHE_BYTES))
+
+worker_pool = None
+
+
+# Function to run in each worker: split the cube budget between the workers
+def init_worker(max_bytes):
+    dataset_cache.max_bytes = max_bytes
+
+
+# Function to get the shared worker pool, created on first use. Callbacks already running in a
+# daemonic background worker cannot start processes and use threads instead.
+def get_worker_pool():
+    global worker_pool
+    if worker_pool is None and multiprocessing.current_process().daemon:
+        worker_pool = concurrent.futures.ThreadPoolExecutor(max_workers=WORKERS)
+    elif worker_pool is None:
+        worker_pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+            initargs=(WORKER_CACHE_BYTES // WORKERS,)
+        )
+    return worker_pool
@@ -0,0 +1,12 @@
+import os
+
+# Workers share the parsed plates through memory-mapped files unless configured otherwise
+os.environ.setdefault("BIOIMAGING_SHARED_DATASETS", "1")
+
+from dashboard import create_app
+
+# Entry point for production WSGI servers, e.g. gunicorn --preload --workers 4 wsgi:server
+# The app is built eagerly here so the preloading master imports the tab builders once and the
+# forked workers share them.
+app = create_app(eager=True)
+server = app.server
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The dashboard modules import each other by name from src/, as when running python src/dashboard.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
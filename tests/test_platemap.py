@@ -0,0 +1,28 @@
+import numpy as np
+import pandas as pd
+
+from advanced_data_loader import process_platemap
+from aggregation import merge_grouped_stats
+
+
+# Platemaps may mix text and numbers, e.g. a dose of 0.5 next to "DMSO"
+def test_mixed_type_platemap():
+    grid = pd.DataFrame({1: ["DMSO", 10], 2: [0.5, "DMSO"]}, index=["A", "B"])
+    platemap = process_platemap(grid, "Treatment")
+
+    assert platemap["Treatment"].cat.categories.tolist() == [0.5, 10, "DMSO"]
+    assert platemap["Well"].tolist() == ["A1", "A2", "B1", "B2"]
+    assert platemap["Treatment"].tolist() == ["DMSO", 0.5, 10, "DMSO"]
+
+
+def test_numeric_platemap_keeps_numeric_order():
+    grid = pd.DataFrame({1: [10, 2], 2: [0.5, 2]}, index=["A", "B"])
+    assert process_platemap(grid, "Treatment")["Treatment"].cat.categories.tolist() == [0.5, 2, 10]
+
+
+# Plates of a project merge their (treatment, cell type) groups, which may mix types too
+def test_merge_mixed_type_groups():
+    part = {"axis": np.array([0.0]), "n": np.ones((2, 1)), "mean": np.array([[1.0], [2.0]]), "std": np.zeros((2, 1))}
+    merged = merge_grouped_stats([dict(part, keys=[("DMSO", "HD"), (0.5, "HD")]),
+                                  dict(part, keys=[(10, "HD"), ("DMSO", "HD")])])
+    assert merged["keys"] == [(0.5, "HD"), (10, "HD"), ("DMSO", "HD")]
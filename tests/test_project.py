@@ -0,0 +1,19 @@
+import os
+
+import pytest
+
+from project import find_workbooks
+
+
+# Project paths come from the browser, nothing outside the project root may be read
+def test_project_paths_stay_under_root(tmp_path):
+    root = tmp_path / "screen"
+    (root / "plates").mkdir(parents=True)
+    (root / "plates" / "plate1.xlsx").touch()
+    (tmp_path / "other.xlsx").touch()
+    os.symlink(tmp_path / "other.xlsx", root / "plates" / "linked.xlsx")
+
+    assert find_workbooks(["plates/plate1.xlsx"], str(root)) == [os.path.realpath(root / "plates" / "plate1.xlsx")]
+    for path in ["../other.xlsx", str(tmp_path / "other.xlsx"), "plates"]:
+        with pytest.raises(ValueError):
+            find_workbooks([path], str(root))
@@ -0,0 +1,20 @@
+import os
+
+from benchmarks import cold_start
+
+# Budget of create_app() in a fresh interpreter, the same as `benchmarks.py startup`
+STARTUP_BUDGET_MS = 1000
+
+# Fraction above the budget that a run may take, CI runners are slower and noisier than a workstation
+STARTUP_TOLERANCE = float(os.environ.get("BIOIMAGING_STARTUP_TOLERANCE", "0.5"))
+
+
+# Cold start fails when it regresses beyond the budget or imports a module it should defer
+def test_cold_start_within_budget():
+    # Best of three fresh interpreters, the first one also pays for cold .pyc and disk caches
+    runs = [cold_start() for _ in range(3)]
+    seconds = min(seconds for seconds, _ in runs)
+
+    assert runs[0][1] == [], f"create_app() imported deferred modules: {', '.join(runs[0][1])}"
+    assert seconds * 1000 <= STARTUP_BUDGET_MS * (1 + STARTUP_TOLERANCE), (
+        f"create_app() took {seconds * 1000:.0f} ms, budget {STARTUP_BUDGET_MS} ms + {STARTUP_TOLERANCE:.0%}")